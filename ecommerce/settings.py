@@ -88,6 +88,12 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_THROTTLE_RATES': {
+        'tracking': os.getenv("TRACKING_THROTTLE_RATE", "60/min"),  # Per client IP, on the public track/ endpoint
+    },
+    # Reverse proxies in front of the app; throttles take the client IP that many X-Forwarded-For entries from the
+    # right. 0 ignores the header (clients can set it to anything) and uses REMOTE_ADDR.
+    'NUM_PROXIES': int(os.getenv("NUM_PROXIES", 0)),
 }
 
 SIMPLE_JWT = {
@@ -115,6 +121,22 @@ RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID")
 RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET")
 WEBHOOK = os.getenv("WEBHOOK")
 
+# Shared Razorpay client (orders/gateway.py). Point the base URL at `manage.py razorpay_stub` to run without Razorpay
+RAZORPAY_BASE_URL = os.getenv("RAZORPAY_BASE_URL", "https://api.razorpay.com")
+RAZORPAY_TIMEOUT_SECONDS = float(os.getenv("RAZORPAY_TIMEOUT_SECONDS", 10))
+RAZORPAY_POOL_SIZE = int(os.getenv("RAZORPAY_POOL_SIZE", 10))
+RAZORPAY_MAX_RETRIES = int(os.getenv("RAZORPAY_MAX_RETRIES", 2))  # Extra attempts for idempotent fetches
+
+# Seconds a checkout request waits for Razorpay before leaving the payment link to the worker
+PAYMENT_LINK_REQUEST_TIMEOUT = float(os.getenv("PAYMENT_LINK_REQUEST_TIMEOUT", 5))
+
+# Minutes a pending order holds its stock before the sweeper releases it
+STOCK_RESERVATION_TTL_MINUTES = int(os.getenv("STOCK_RESERVATION_TTL_MINUTES", 30))
+
+# Hours an unpaid order stays Pending before expire_pending_orders closes it, and the status it gets
+PENDING_ORDER_TTL_HOURS = int(os.getenv("PENDING_ORDER_TTL_HOURS", 48))
+PENDING_ORDER_EXPIRED_STATUS = os.getenv("PENDING_ORDER_EXPIRED_STATUS", "Cancelled")
+
 
 ROOT_URLCONF = 'ecommerce.urls'
 
@@ -159,6 +181,35 @@ DATABASES = {
 #     }
 # }
 
+# Shared cache when REDIS_URL is set, otherwise per-process memory
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Seconds a rendered order stays cached; any status change or save gives it a new key anyway
+ORDER_CACHE_TIMEOUT = int(os.getenv("ORDER_CACHE_TIMEOUT", 24 * 60 * 60))
+
+# Public tracking entries (written on every status change) and the cached "no such tracking ID" answer.
+# Status changes only rewrite the entry in the process that made them, so without a shared cache
+# entries are kept briefly and other processes catch up within that time.
+TRACKING_CACHE_TIMEOUT = int(os.getenv("TRACKING_CACHE_TIMEOUT", 7 * 24 * 60 * 60 if os.getenv("REDIS_URL") else 60))
+TRACKING_NOT_FOUND_CACHE_TIMEOUT = int(os.getenv("TRACKING_NOT_FOUND_CACHE_TIMEOUT", 60))
+TRACKING_MAX_AGE = int(os.getenv("TRACKING_MAX_AGE", 30))  # Seconds browsers and CDNs may reuse a tracking response
+
+# How long an Idempotency-Key's response is replayed, and when a repeat that found the first request still running should retry
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", 24))
+IDEMPOTENCY_RETRY_AFTER_SECONDS = int(os.getenv("IDEMPOTENCY_RETRY_AFTER_SECONDS", 1))
+
 AUTH_USER_MODEL = 'users.CustomUser'
 
 # Password validation
@@ -204,6 +255,11 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'  # URL for serving media files
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media') 
 
+# Rendered invoices (private, served only through order/<id>/invoice/) and the threads that render them
+INVOICE_ROOT = os.getenv("INVOICE_ROOT", os.path.join(BASE_DIR, 'invoices'))
+INVOICE_WORKERS = int(os.getenv("INVOICE_WORKERS", 2))  # 0 renders inline, in the request that changed the order
+INVOICE_CACHE_TIMEOUT = int(os.getenv("INVOICE_CACHE_TIMEOUT", 24 * 60 * 60))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
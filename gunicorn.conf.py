@@ -0,0 +1,12 @@
+# gunicorn.conf.py
+# Read by `gunicorn` from the working directory. Uvicorn workers serve the
+# ASGI application, so payment-status long-polls and SSE streams wait on
+# the event loop instead of each holding a sync worker.
+import multiprocessing
+import os
+
+wsgi_app = "ecommerce.asgi:application"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))  # Above PAYMENT_STATUS_MAX_WAIT
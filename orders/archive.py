@@ -0,0 +1,55 @@
+# orders/archive.py
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedOrder, ArchivedOrderDetail, Order, OrderDetail, StockReservation
+from .reservations import release_reservations
+
+CLOSED_STATUSES = ["Delivered", "Cancelled", "Failed"]
+ARCHIVED_ORDER_FIELDS = [
+    "order_id", "user_id", "total_price", "shipping_address", "status", "tracking_id", "created_at", "updated_at",
+    "razorpay_payment_link_id", "razorpay_payment_link_url", "razorpay_payment_id", "is_refunded", "is_active",
+]
+ARCHIVED_DETAIL_FIELDS = [
+    "order_detail_id", "order_id", "product_id", "quantity", "price_at_purchase",
+    "product_name", "product_code", "thumbnail_url", "is_active",
+]
+
+
+def archivable_orders(days, now=None):
+    """Closed orders whose last change is more than `days` days old."""
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    return Order.objects.filter(status__in=CLOSED_STATUSES, updated_at__lt=cutoff)
+
+
+def archive_batch(days, batch_size=500):
+    """
+    Move one batch of archivable orders, with their details, into the archive
+    tables and delete them from `orders` / `order_details`, all in one
+    transaction. Returns the number of orders archived (0 when done).
+    """
+    with transaction.atomic():
+        # Locked and re-checked here, so an order that changed since it was picked is left alone
+        order_ids = list(
+            archivable_orders(days).select_for_update(skip_locked=True)
+            .order_by("order_id").values_list("order_id", flat=True)[:batch_size]
+        )
+        if not order_ids:
+            return 0
+
+        ArchivedOrder.objects.bulk_create([
+            ArchivedOrder(**row) for row in Order.objects.filter(order_id__in=order_ids).values(*ARCHIVED_ORDER_FIELDS)
+        ])
+        ArchivedOrderDetail.objects.bulk_create([
+            ArchivedOrderDetail(**row)
+            for row in OrderDetail.objects.filter(order_id__in=order_ids).values(*ARCHIVED_DETAIL_FIELDS)
+        ], batch_size=1000)
+
+        # A Failed order can still hold stock until release_stock_reservations runs; give it back
+        # before its reservations go with the order (payment link jobs of closed orders are done)
+        release_reservations(StockReservation.objects.filter(order_id__in=order_ids))
+        OrderDetail.objects.filter(order_id__in=order_ids).delete()
+        Order.objects.filter(order_id__in=order_ids).delete()
+        return len(order_ids)
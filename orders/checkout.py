@@ -0,0 +1,80 @@
+# orders/checkout.py
+import razorpay
+
+from . import gateway
+from .models import Order, OrderDetail
+from .reservations import reserve_stock
+from .snapshots import primary_thumbnails, snapshot
+from .status import record_status_changes
+
+
+def place_order(user, shipping_address, lines):
+    """
+    Create a pending order with its details and reserve its stock.
+
+    `lines` is a list of (product, quantity) with the products already loaded,
+    so no per-line queries are made. Must run inside a transaction: a product
+    without enough stock raises InsufficientStock and nothing should be kept.
+    """
+    total_price = sum(product.offer_price_decimal * quantity for product, quantity in lines)
+
+    order = Order.objects.create(
+        user=user,
+        total_price=total_price,
+        shipping_address=shipping_address,
+        status="Pending"
+    )
+
+    # price_at_purchase and the product snapshot are set here, so OrderDetail.save() never has to re-read the product
+    thumbnails = primary_thumbnails({product.product_id for product, _ in lines})
+    OrderDetail.objects.bulk_create([
+        OrderDetail(
+            order=order,
+            product=product,
+            quantity=quantity,
+            price_at_purchase=product.offer_price_decimal,
+            **snapshot(product, thumbnails)
+        )
+        for product, quantity in lines
+    ])
+
+    # Hold the stock for this order until it is paid, fails or expires
+    reserve_stock(order, lines)
+    record_status_changes([(order.order_id, None, order.status)])
+    return order
+
+
+def create_payment_link(order, timeout=None):
+    """
+    Create a Razorpay Payment Link for the order and store its ID and URL on the order.
+
+    The order ID is sent as the link's reference_id, which Razorpay keeps
+    unique, so a retry after a timed-out call cannot create a second link;
+    the existing one is fetched instead.
+    """
+    user = order.user
+    reference_id = f"order_{order.order_id}"
+
+    try:
+        payment_link = gateway.create_payment_link({
+            "amount": int(order.total_price * 100),  # Convert to paise
+            "currency": "INR",
+            "description": f"Order #{order.order_id} Payment",
+            "reference_id": reference_id,
+            "notes": {"order_id": str(order.order_id)},  # Copied onto the payment; webhooks find the order by it
+            "customer": {
+                "name": user.username,
+                "email": user.email,
+                "contact": user.phone_number,  # Ensure phone number is available
+            }
+        }, timeout=timeout)
+    except razorpay.errors.BadRequestError:
+        existing = gateway.list_payment_links({"reference_id": reference_id}, timeout=timeout).get("payment_links", [])
+        if not existing:
+            raise
+        payment_link = existing[0]
+
+    order.razorpay_payment_link_id = payment_link["id"]
+    order.razorpay_payment_link_url = payment_link["short_url"]
+    order.save(update_fields=["razorpay_payment_link_id", "razorpay_payment_link_url", "updated_at"])
+    return payment_link
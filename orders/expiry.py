@@ -0,0 +1,92 @@
+# orders/expiry.py
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from ecommerce.logger import logger
+from users.utils import create_admin_notification
+from . import gateway
+from .models import Order, StockReservation
+from .reservations import release_reservations
+from .status import TRANSITIONS, record_status_changes
+
+EXPIRED_STATUSES = ["Failed", "Cancelled"]
+
+
+def expirable_orders(ttl, now=None):
+    """Pending orders placed more than `ttl` ago."""
+    return Order.objects.filter(status="Pending", created_at__lt=(now or timezone.now()) - ttl)
+
+
+def expire_batch(ttl, new_status, batch_size=500):
+    """
+    Close one batch of expirable orders with `new_status` in a single
+    transaction: one UPDATE for the orders, one set-based stock release for
+    their reservations. Returns [(order_id, payment link ID or None)].
+    """
+    with transaction.atomic():
+        expired = list(
+            expirable_orders(ttl).select_for_update(skip_locked=True)
+            .order_by("order_id").values_list("order_id", "razorpay_payment_link_id")[:batch_size]
+        )
+        if not expired:
+            return []
+
+        order_ids = [order_id for order_id, _ in expired]
+        changes = {"status": new_status, "version": F("version") + 1, "next_payment_check_at": None, "updated_at": timezone.now()}
+        if new_status == "Cancelled":
+            changes["is_active"] = False
+        Order.objects.filter(order_id__in=order_ids, status__in=TRANSITIONS[new_status]).update(**changes)
+        release_reservations(StockReservation.objects.filter(order_id__in=order_ids))
+        record_status_changes([(order_id, "Pending", new_status) for order_id in order_ids])
+    return expired
+
+
+def _cancel_link(payment_link_id):
+    try:
+        gateway.cancel_payment_link(payment_link_id)
+        return True
+    except Exception as e:  # Already paid, expired or cancelled on Razorpay's side, or the gateway is down
+        logger.warning(f"Could not cancel payment link {payment_link_id}: {e}")
+        return False
+
+
+def expire_pending_orders(ttl=None, new_status=None, batch_size=500, cancel_links=True, workers=4):
+    """
+    Expire every Pending order older than `ttl` (PENDING_ORDER_TTL_HOURS by
+    default) as `new_status`, batch by batch. Unless `cancel_links` is off,
+    their payment links are cancelled on a thread pool while the next batches
+    are being expired, so a late payment cannot go through (one that slips in
+    first is refused by mark_paid and flagged for a refund).
+    Sends one admin notification summarising the run.
+    Returns a dict with `expired`, `links_cancelled` and `link_errors`.
+    """
+    ttl = ttl or timedelta(hours=settings.PENDING_ORDER_TTL_HOURS)
+    new_status = new_status or settings.PENDING_ORDER_EXPIRED_STATUS
+    if new_status not in EXPIRED_STATUSES:
+        raise ValueError(f"Expired orders can only become {' or '.join(EXPIRED_STATUSES)}")
+    counts = {"expired": 0, "links_cancelled": 0, "link_errors": 0}
+    cancellations = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            expired = expire_batch(ttl, new_status, batch_size)
+            counts["expired"] += len(expired)
+            if cancel_links:
+                cancellations += [executor.submit(_cancel_link, link_id) for _, link_id in expired if link_id]
+            if len(expired) < batch_size:
+                break
+
+        for future in cancellations:
+            counts["links_cancelled" if future.result() else "link_errors"] += 1
+
+    if counts["expired"]:
+        message = f"{counts['expired']} order(s) pending for more than {ttl} were marked {new_status}."
+        if cancel_links:
+            message += f" Payment links cancelled: {counts['links_cancelled']}, failed: {counts['link_errors']}."
+        create_admin_notification(user=None, title="orders_expired", message=message, event_type="orders_expired")
+    return counts
@@ -0,0 +1,84 @@
+# orders/exports.py
+"""
+Streaming CSV / NDJSON exports. Rows are read with `.values().iterator()`, so
+neither model instances nor the whole result set are held in memory.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import DecimalField, ExpressionWrapper, F
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+CHUNK_SIZE = 2000
+
+# One row per order line, with its order and buyer alongside, for accounting
+ORDER_LINE_EXPORT_FIELDS = [
+    "order_id", "order_created_at", "order_status", "user_id", "username", "email", "shipping_address",
+    "order_total", "razorpay_payment_id", "is_refunded",
+    "order_detail_id", "product_id", "product_name", "product_code", "quantity", "price_at_purchase", "line_total",
+]
+
+
+class _Echo:
+    """File-like object for csv.writer that hands each line straight back."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, fields):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([row[field] for field in fields])
+
+
+def ndjson_lines(rows, fields):
+    for row in rows:
+        yield json.dumps({field: row[field] for field in fields}, cls=DjangoJSONEncoder) + "\n"
+
+
+def export_response(rows, fields, export_format, filename):
+    """
+    Stream `rows` (an iterable of dicts, e.g. `qs.values(...).iterator(chunk_size=CHUNK_SIZE)`)
+    as CSV or NDJSON with the given column order.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValidationError({"error": f"Unsupported export format: {export_format}. Use one of: {', '.join(EXPORT_FORMATS)}"})
+
+    lines = csv_lines(rows, fields) if export_format == "csv" else ndjson_lines(rows, fields)
+    response = StreamingHttpResponse(lines, content_type=EXPORT_FORMATS[export_format])
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{export_format}"'
+    return response
+
+
+def order_line_rows(orders, detail_model):
+    """
+    The active lines of `orders` (an Order or ArchivedOrder queryset, with
+    `detail_model` its line model) as flat ORDER_LINE_EXPORT_FIELDS dicts,
+    oldest order first, read CHUNK_SIZE rows at a time in one joined query.
+    """
+    return (
+        detail_model.objects.filter(order__in=orders, is_active=True)
+        .order_by("order__created_at", "order_id", "order_detail_id")
+        .annotate(
+            order_created_at=F("order__created_at"),
+            order_status=F("order__status"),
+            user_id=F("order__user_id"),
+            username=F("order__user__username"),
+            email=F("order__user__email"),
+            shipping_address=F("order__shipping_address"),
+            order_total=F("order__total_price"),
+            razorpay_payment_id=F("order__razorpay_payment_id"),
+            is_refunded=F("order__is_refunded"),
+            line_total=ExpressionWrapper(F("quantity") * F("price_at_purchase"), output_field=DecimalField(max_digits=14, decimal_places=2)),
+        )
+        .values(*ORDER_LINE_EXPORT_FIELDS)
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
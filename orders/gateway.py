@@ -0,0 +1,205 @@
+# orders/gateway.py
+"""
+Process-wide access to Razorpay.
+
+Every call goes through one shared client (keep-alive session, bounded
+connection pool, default timeout) and through `call()`, which adds retries
+with jitter for idempotent reads, a circuit breaker and per-operation
+latency/error metrics. Point RAZORPAY_BASE_URL at orders.gateway_stub to
+run without the real gateway.
+"""
+import random
+import threading
+import time
+
+from django.conf import settings
+import razorpay
+import requests
+from requests.adapters import HTTPAdapter
+
+from ecommerce.logger import logger
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class GatewayUnavailable(Exception):
+    """Raised without calling Razorpay while the circuit breaker is open."""
+
+
+class _GatewaySession(requests.Session):
+    """requests.Session that applies a default timeout to every call."""
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().request(method, url, **kwargs)
+
+
+def get_client():
+    """Return the shared Razorpay client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                session = _GatewaySession(timeout=settings.RAZORPAY_TIMEOUT_SECONDS)
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=settings.RAZORPAY_POOL_SIZE,
+                    pool_block=True,  # Wait for a free connection instead of opening unbounded ones
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _client = razorpay.Client(
+                    session=session,
+                    auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET),
+                    base_url=settings.RAZORPAY_BASE_URL,
+                )
+    return _client
+
+
+def reset_client():
+    """Drop the shared client and breaker state (settings changed, or between tests)."""
+    global _client
+    with _client_lock:
+        _client = None
+    breaker.reset()
+    metrics.reset()
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive gateway failures and rejects
+    calls for `reset_timeout` seconds, then lets one trial call through.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "open":
+                raise GatewayUnavailable("Razorpay circuit breaker is open")
+            if self.state == "half-open":
+                self.opened_at = time.monotonic()  # Only one trial call per reset_timeout
+
+    def record_success(self):
+        with self._lock:
+            self.reset()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class GatewayMetrics:
+    """Per-operation call counts, errors and latency, kept in memory for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.operations = {}
+
+    def record(self, operation, latency, error=None):
+        with self._lock:
+            stats = self.operations.setdefault(operation, {
+                "calls": 0, "errors": 0, "total_latency_ms": 0.0, "max_latency_ms": 0.0, "last_error": None,
+            })
+            latency_ms = latency * 1000
+            stats["calls"] += 1
+            stats["total_latency_ms"] += latency_ms
+            stats["max_latency_ms"] = max(stats["max_latency_ms"], latency_ms)
+            if error is not None:
+                stats["errors"] += 1
+                stats["last_error"] = f"{type(error).__name__}: {error}"
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                operation: {
+                    **stats,
+                    "avg_latency_ms": round(stats["total_latency_ms"] / stats["calls"], 2) if stats["calls"] else 0.0,
+                }
+                for operation, stats in self.operations.items()
+            }
+
+
+breaker = CircuitBreaker()
+metrics = GatewayMetrics()
+
+# Failures that say something about the gateway's health; a BadRequestError is our own fault
+_TRANSIENT_ERRORS = (requests.RequestException, razorpay.errors.ServerError, razorpay.errors.GatewayError)
+
+
+def call(operation, fn, *args, idempotent=False, **kwargs):
+    """
+    Run `fn(*args, **kwargs)` against Razorpay under the breaker, recording
+    metrics as `operation`. Idempotent calls are retried on transient errors
+    with exponential backoff and full jitter.
+    """
+    attempts = 1 + (settings.RAZORPAY_MAX_RETRIES if idempotent else 0)
+
+    for attempt in range(attempts):
+        breaker.before_call()
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except _TRANSIENT_ERRORS as e:
+            metrics.record(operation, time.perf_counter() - started, error=e)
+            breaker.record_failure()
+            if attempt + 1 >= attempts:
+                raise
+            delay = random.uniform(0, 0.2 * 2 ** attempt)
+            logger.warning(f"Razorpay {operation} failed ({e}); retrying in {delay:.2f}s")
+            time.sleep(delay)
+        except Exception as e:
+            metrics.record(operation, time.perf_counter() - started, error=e)
+            breaker.record_success()  # The gateway answered; the request itself was rejected
+            raise
+        else:
+            metrics.record(operation, time.perf_counter() - started)
+            breaker.record_success()
+            return result
+
+
+def create_payment_link(data, timeout=None):
+    return call("payment_link.create", get_client().payment_link.create, data, timeout=timeout)
+
+
+def list_payment_links(params, timeout=None):
+    return call("payment_link.all", get_client().payment_link.all, params, timeout=timeout, idempotent=True)
+
+
+def fetch_payment_link(payment_link_id):
+    return call("payment_link.fetch", get_client().payment_link.fetch, payment_link_id, idempotent=True)
+
+
+def cancel_payment_link(payment_link_id):
+    return call("payment_link.cancel", get_client().payment_link.cancel, payment_link_id)
+
+
+def fetch_payment(payment_id):
+    return call("payment.fetch", get_client().payment.fetch, payment_id, idempotent=True)
@@ -0,0 +1,189 @@
+# orders/gateway_stub.py
+"""
+In-memory stand-in for the parts of the Razorpay API this app uses
+(payment links and payments). Run it with `manage.py razorpay_stub` and set
+RAZORPAY_BASE_URL to its address, or start it from a test.
+
+Besides the Razorpay routes it serves two control routes:
+    POST /stub/payment_links/<id>/pay     mark the link paid with a captured payment
+    POST /stub/payment_links/<id>/expire  mark the link expired
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+
+class RazorpayStub:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.latency = latency  # Seconds added to every response
+        self.fail_next = 0  # Answer this many upcoming requests with a 500
+        self.payment_links = {}
+        self.payments = {}
+        self.requests = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def pay(self, payment_link_id):
+        """Settle a link as a captured payment, as if the customer paid it."""
+        with self._lock:
+            return self._pay(payment_link_id)
+
+    def _pay(self, payment_link_id):
+        link = self.payment_links[payment_link_id]
+        payment_id = f"pay_stub{next(self._ids)}"
+        self.payments[payment_id] = {"id": payment_id, "entity": "payment", "status": "captured", "amount": link["amount"], "notes": link["notes"]}
+        link["status"] = "paid"
+        link["amount_paid"] = link["amount"]
+        link["payments"] = [{"payment_id": payment_id, "amount": link["amount"], "status": "captured"}]
+        return payment_id
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep connections alive, like the real API
+
+            def log_message(self, format, *args):
+                pass
+
+            def _respond(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _error(self, status, code, description):
+                self._respond(status, {"error": {"code": code, "description": description}})
+
+            def _dispatch(self, method):
+                # Read the body first, even for an injected failure, or it is parsed as the next keep-alive request
+                length = int(self.headers.get("Content-Length") or 0)
+                data = json.loads(self.rfile.read(length) or b"{}") if length else {}
+                with stub._lock:
+                    stub.requests += 1
+                    failing = stub.fail_next > 0
+                    if failing:
+                        stub.fail_next -= 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if failing:
+                    return self._error(500, "SERVER_ERROR", "Injected failure")
+
+                url = urlparse(self.path)
+
+                for pattern, route_method, handler in ROUTES:
+                    match = re.fullmatch(pattern, url.path)
+                    if match and route_method == method:
+                        with stub._lock:
+                            status, body = handler(stub, data, parse_qs(url.query), *match.groups())
+                        return self._respond(status, body)
+                self._error(404, "BAD_REQUEST_ERROR", "The requested URL was not found on the server.")
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+        return Handler
+
+
+def _create_link(stub, data, query):
+    reference_id = data.get("reference_id")
+    if reference_id and any(link["reference_id"] == reference_id for link in stub.payment_links.values()):
+        return 400, {"error": {"code": "BAD_REQUEST_ERROR", "description": "reference_id already exists"}}
+    link_id = f"plink_stub{next(stub._ids)}"
+    link = {
+        "id": link_id,
+        "amount": data.get("amount"),
+        "amount_paid": 0,
+        "currency": data.get("currency", "INR"),
+        "description": data.get("description"),
+        "reference_id": reference_id,
+        "notes": data.get("notes", {}),
+        "customer": data.get("customer", {}),
+        "status": "created",
+        "payments": None,
+        "short_url": f"https://rzp.io/i/{link_id}",
+        "created_at": int(time.time()),
+    }
+    stub.payment_links[link_id] = link
+    return 200, link
+
+
+def _list_links(stub, data, query):
+    links = list(stub.payment_links.values())
+    if "reference_id" in query:
+        links = [link for link in links if link["reference_id"] == query["reference_id"][0]]
+    return 200, {"payment_links": links}
+
+
+def _fetch_link(stub, data, query, link_id):
+    if link_id not in stub.payment_links:
+        return 400, {"error": {"code": "BAD_REQUEST_ERROR", "description": "The id provided does not exist"}}
+    return 200, stub.payment_links[link_id]
+
+
+def _set_link_status(status):
+    def handler(stub, data, query, link_id):
+        if link_id not in stub.payment_links:
+            return 400, {"error": {"code": "BAD_REQUEST_ERROR", "description": "The id provided does not exist"}}
+        link = stub.payment_links[link_id]
+        if link["status"] == "paid":
+            return 400, {"error": {"code": "BAD_REQUEST_ERROR", "description": "Payment link is already paid"}}
+        link["status"] = status
+        return 200, link
+    return handler
+
+
+def _pay_link(stub, data, query, link_id):
+    if link_id not in stub.payment_links:
+        return 400, {"error": {"code": "BAD_REQUEST_ERROR", "description": "The id provided does not exist"}}
+    stub._pay(link_id)
+    return 200, stub.payment_links[link_id]
+
+
+def _fetch_payment(stub, data, query, payment_id):
+    if payment_id not in stub.payments:
+        return 400, {"error": {"code": "BAD_REQUEST_ERROR", "description": "The id provided does not exist"}}
+    return 200, stub.payments[payment_id]
+
+
+ROUTES = [
+    (r"/v1/payment_links/?", "POST", _create_link),
+    (r"/v1/payment_links/?", "GET", _list_links),
+    (r"/v1/payment_links/(\w+)", "GET", _fetch_link),
+    (r"/v1/payment_links/(\w+)/cancel", "POST", _set_link_status("cancelled")),
+    (r"/v1/payments/(\w+)", "GET", _fetch_payment),
+    (r"/stub/payment_links/(\w+)/pay", "POST", _pay_link),
+    (r"/stub/payment_links/(\w+)/expire", "POST", _set_link_status("expired")),
+]
@@ -0,0 +1,117 @@
+# orders/idempotency.py
+"""
+Idempotency-Key support for endpoints that create things.
+
+The first request with a key inserts an InProgress IdempotencyRecord (the
+unique (scope, key) constraint makes that the claim), runs the view and
+stores its response. Repeats of the key get that response back; repeats
+that arrive while the first one is still running get a 409 with
+Retry-After straight away rather than holding a worker until it finishes,
+so a retry storm creates one order and calls the gateway once. Records
+expire after IDEMPOTENCY_TTL_HOURS.
+"""
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyRecord
+
+HEADER = "Idempotency-Key"
+
+
+def _request_hash(request):
+    return hashlib.sha256(b"%s %s\n%s" % (request.method.encode(), request.get_full_path().encode(), request.body)).hexdigest()
+
+
+def _claim(scope, key, request_hash):
+    """Insert the InProgress record. Returns (record, created)."""
+    now = timezone.now()
+    IdempotencyRecord.objects.filter(scope=scope, key=key, expires_at__lte=now).delete()
+    try:
+        with transaction.atomic():
+            record = IdempotencyRecord.objects.create(
+                scope=scope,
+                key=key,
+                request_hash=request_hash,
+                expires_at=now + timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS),
+            )
+        return record, True
+    except IntegrityError:
+        return IdempotencyRecord.objects.filter(scope=scope, key=key).first(), False
+
+
+def _response_data(response):
+    """The body as the client received it (DRF turns Decimals into numbers, not strings)."""
+    if hasattr(response, "data"):
+        return json.loads(json.dumps(response.data, cls=JSONEncoder))
+    return json.loads(response.content or b"null")
+
+
+def _replay(record):
+    response = Response(record.response_body, status=record.response_status)
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def idempotent(name):
+    """
+    Decorate a view (function or viewset method) so requests carrying an
+    Idempotency-Key run at most once per caller and key. `name` scopes the
+    keys to the endpoint. Requests without a key are passed straight through.
+    Server errors are not stored, so the client can retry them.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            request = args[1] if len(args) > 1 else args[0]  # (self, request) on viewsets, (request,) on function views
+            key = request.headers.get(HEADER)
+            if not key:
+                return view(*args, **kwargs)
+
+            scope = f"{name}:{request.user.pk if request.user.is_authenticated else 'anonymous'}"
+            request_hash = _request_hash(request)
+            record, created = _claim(scope, key, request_hash)
+            while not created:
+                if record is not None and record.request_hash != request_hash:
+                    return Response(
+                        {"error": f"{HEADER} {key} was already used with a different request"},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    )
+                if record is not None and record.status == "Completed":
+                    return _replay(record)
+                if record is not None:
+                    return Response(
+                        {"error": f"A request with {HEADER} {key} is still being processed, retry later"},
+                        status=status.HTTP_409_CONFLICT,
+                        headers={"Retry-After": str(settings.IDEMPOTENCY_RETRY_AFTER_SECONDS)},
+                    )
+                record, created = _claim(scope, key, request_hash)  # The first attempt failed; take over
+
+            try:
+                response = view(*args, **kwargs)
+            except Exception:
+                record.delete()
+                raise
+            if response.status_code >= 500:
+                record.delete()
+                return response
+
+            IdempotencyRecord.objects.filter(pk=record.pk).update(
+                status="Completed", response_status=response.status_code, response_body=_response_data(response)
+            )
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired_records(now=None):
+    """Delete records past their TTL. Returns the number deleted."""
+    return IdempotencyRecord.objects.filter(expires_at__lte=now or timezone.now()).delete()[0]
@@ -0,0 +1,117 @@
+# orders/invoices.py
+"""
+Invoices rendered once per order state, in the background.
+
+record_status_changes schedules a render when an order is paid and again
+whenever an invoiced order changes status. Renders run on a small thread
+pool after the transaction commits; each one reads the order and its line
+snapshots (no catalog joins), writes the HTML to INVOICE_ROOT under its
+content hash and points the order's Invoice row at it. An order whose
+state matches the Invoice's `source` is not rendered again. Archived orders
+no longer change, so they are rendered only if they have no invoice yet.
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.template.loader import render_to_string
+
+from ecommerce.logger import logger
+from .models import ArchivedOrder, Invoice, Order
+
+INVOICED_STATUSES = ["Processing", "Shipped", "Delivered"]
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.INVOICE_WORKERS, thread_name_prefix="invoice")
+    return _executor
+
+
+def invoice_needed(old_status, new_status):
+    """A status change that creates the invoice or changes what it shows."""
+    return new_status in INVOICED_STATUSES or old_status in INVOICED_STATUSES
+
+
+def schedule_invoices(order_ids):
+    """Render the invoices of these orders once the current transaction commits."""
+    order_ids = list(order_ids)
+    if not order_ids:
+        return
+    if not settings.INVOICE_WORKERS:
+        transaction.on_commit(lambda: [render_invoice(order_id) for order_id in order_ids])
+        return
+    transaction.on_commit(lambda: [_get_executor().submit(_render_in_worker, order_id) for order_id in order_ids])
+
+
+def _render_in_worker(order_id):
+    close_old_connections()
+    try:
+        render_invoice(order_id)
+    except Exception as e:
+        logger.error(f"Invoice for Order #{order_id} failed: {e}")
+    finally:
+        connection.close()
+
+
+def invoice_source(order):
+    """The order state an invoice is rendered from; a new one means a new render."""
+    if isinstance(order, ArchivedOrder):  # Archived orders keep no version
+        return f"archived:{order.updated_at.isoformat()}"
+    return f"{order.version}:{order.updated_at.isoformat()}"
+
+
+def render_invoice(order_id):
+    """
+    Render and store the invoice of one order, unless the stored one was
+    rendered from the same order state. Orders moved out by archive_orders
+    are rendered from the archive tables. Returns the Invoice, or None if the
+    order does not exist or was never paid.
+    """
+    order = (
+        Order.objects.select_related("user").filter(order_id=order_id).first()
+        or ArchivedOrder.objects.select_related("user").filter(order_id=order_id).first()
+    )
+    invoice = Invoice.objects.filter(order_id=order_id).first()
+    if order is None or (invoice is None and order.status not in INVOICED_STATUSES):
+        return None
+
+    source = invoice_source(order)
+    if invoice and (invoice.source == source or isinstance(order, ArchivedOrder)):
+        return invoice
+
+    lines = list(order.order_details.filter(is_active=True).order_by("order_detail_id"))
+    for line in lines:
+        line.amount = line.price_at_purchase * line.quantity
+    content = render_to_string("orders/invoice.html", {"order": order, "lines": lines}).encode()
+
+    content_hash = hashlib.sha256(content).hexdigest()
+    file_path = os.path.join(content_hash[:2], f"{content_hash}.html")
+    full_path = os.path.join(settings.INVOICE_ROOT, file_path)
+    if not os.path.exists(full_path):  # Same content, same file: nothing to write
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        temporary_path = f"{full_path}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(content)
+        os.replace(temporary_path, full_path)  # Readers never see a half-written file
+
+    invoice, _ = Invoice.objects.update_or_create(
+        order_id=order_id,
+        defaults={"source": source, "content_hash": content_hash, "file_path": file_path, "size": len(content)},
+    )
+    return invoice
+
+
+def read_invoice(invoice):
+    """The stored document of an invoice."""
+    with open(os.path.join(settings.INVOICE_ROOT, invoice.file_path), "rb") as f:
+        return f.read()
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.archive import archivable_orders, archive_batch
+
+
+class Command(BaseCommand):
+    help = 'Move closed (Delivered, Cancelled, Failed) orders older than N days into the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Archive orders closed more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=500, help='Orders moved per transaction')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between batches to spare the database')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the orders that would be archived')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            count = archivable_orders(options['days']).count()
+            self.stdout.write(self.style.SUCCESS(f"{count} order(s) would be archived"))
+            return
+
+        total = 0
+        while True:
+            archived = archive_batch(options['days'], options['batch_size'])
+            total += archived
+            if archived < options['batch_size']:
+                break
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} order(s)"))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.snapshots import BACKFILL_MODELS, backfill_batch
+
+
+class Command(BaseCommand):
+    help = 'Copy product name, code and thumbnail onto order lines (live and archived) placed before snapshots existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Order lines updated per statement')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between batches to spare the database')
+
+    def handle(self, *args, **options):
+        for model in BACKFILL_MODELS:
+            last_id, batches = 0, 0
+            while True:
+                last_id = backfill_batch(model, options['batch_size'], after=last_id)
+                if last_id is None:
+                    break
+                batches += 1
+                if options['pause']:
+                    time.sleep(options['pause'])
+            self.stdout.write(self.style.SUCCESS(f"{model._meta.db_table}: backfilled {batches} batch(es)"))
@@ -0,0 +1,51 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from orders.models import ArchivedOrder, Order, OrderDetail
+from orders.serializers import OrderListSerializer, OrderSerializer, with_order_details
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the order listing queries against the current database. '
+        'Run it before and after archive_orders to compare.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=20, help='Timed runs per listing')
+        parser.add_argument('--page-size', type=int, default=50)
+
+    def _time(self, label, build):
+        timings = []
+        for _ in range(self.runs):
+            started = time.perf_counter()
+            build()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(f"{label:<40} p50 {statistics.median(timings):8.2f} ms   p95 {p95:8.2f} ms")
+
+    def handle(self, *args, **options):
+        self.runs = options['runs']
+        page_size = options['page_size']
+
+        self.stdout.write(
+            f"orders: {Order.objects.count()}   order_details: {OrderDetail.objects.count()}   "
+            f"archived_orders: {ArchivedOrder.objects.count()}"
+        )
+        busiest = Order.objects.values("user_id").annotate(n=Count("order_id")).order_by("-n").first()
+        if not busiest:
+            self.stdout.write(self.style.WARNING("No orders to list"))
+            return
+
+        # The queries behind order/ (customer), all/ (admin, lean and full) and an open-orders filter
+        customer_orders = Order.objects.filter(user_id=busiest["user_id"]).order_by("-created_at")
+        admin_orders = Order.objects.filter(is_active=True).order_by("-created_at", "-order_id")
+        self._time("customer order history (full)", lambda: OrderSerializer(with_order_details(customer_orders)[:page_size], many=True).data)
+        self._time("admin listing (lean)", lambda: OrderListSerializer(admin_orders.select_related("user")[:page_size], many=True).data)
+        self._time("admin listing (full)", lambda: OrderSerializer(with_order_details(admin_orders)[:page_size], many=True).data)
+        self._time("admin listing, open orders", lambda: list(admin_orders.filter(status__in=["Pending", "Processing"])[:page_size]))
+        self._time("count of all orders", lambda: Order.objects.count())
@@ -0,0 +1,43 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from orders.expiry import EXPIRED_STATUSES, expire_pending_orders
+
+
+class Command(BaseCommand):
+    help = 'Close Pending orders older than a TTL (abandoned checkouts) and cancel their payment links'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl-hours', type=int, default=settings.PENDING_ORDER_TTL_HOURS, help='Expire orders pending for longer than this')
+        parser.add_argument('--status', choices=EXPIRED_STATUSES, default=settings.PENDING_ORDER_EXPIRED_STATUS, help='Status given to expired orders')
+        parser.add_argument('--batch-size', type=int, default=500, help='Orders expired per transaction')
+        parser.add_argument(
+            '--keep-links', action='store_false', dest='cancel_links',
+            help='Leave the expired orders\' Razorpay payment links open (late payments are then flagged for refund)'
+        )
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent payment link cancellations')
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Keep running and sweep every N seconds (0 = sweep once and exit)'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            counts = expire_pending_orders(
+                ttl=timedelta(hours=options['ttl_hours']),
+                new_status=options['status'],
+                batch_size=options['batch_size'],
+                cancel_links=options['cancel_links'],
+                workers=options['workers'],
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"Expired {counts['expired']} pending order(s) as {options['status']}; "
+                f"payment links cancelled: {counts['links_cancelled']} (errors: {counts['link_errors']})"
+            ))
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
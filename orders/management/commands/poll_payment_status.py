@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.payments import poll_due_orders
+
+
+class Command(BaseCommand):
+    help = 'Check pending orders against Razorpay on a shared backoff schedule and update their status'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Orders checked per batch')
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Keep running and look for due orders every N seconds (0 = one batch and exit)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        interval = options['interval']
+
+        while True:
+            counts = poll_due_orders(batch_size)
+            self.stdout.write(self.style.SUCCESS(
+                f"Paid: {counts['paid']}, Failed: {counts['failed']}, "
+                f"Still pending: {counts['pending']} (errors: {counts['errors']})"
+            ))
+
+            if not interval:
+                break
+            if sum(counts.values()) - counts['errors'] < batch_size:
+                time.sleep(interval)
@@ -0,0 +1,34 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from orders.outbox import due_jobs, run_payment_link_job
+
+
+class Command(BaseCommand):
+    help = 'Create Razorpay Payment Links for orders whose in-request attempt did not finish'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Jobs picked up per pass')
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Keep running and poll for due jobs every N seconds (0 = run once and exit)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        interval = options['interval']
+
+        while True:
+            job_ids = list(due_jobs().order_by('next_attempt_at').values_list('job_id', flat=True)[:batch_size])
+            created = sum(
+                1 for job_id in job_ids
+                if run_payment_link_job(job_id, timeout=settings.PAYMENT_LINK_REQUEST_TIMEOUT) is not None
+            )
+            self.stdout.write(self.style.SUCCESS(f"Created {created} of {len(job_ids)} due payment link(s)"))
+
+            if not interval:
+                break
+            if len(job_ids) < batch_size:
+                time.sleep(interval)
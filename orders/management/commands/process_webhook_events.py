@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.webhooks import process_pending_events
+
+
+class Command(BaseCommand):
+    help = 'Apply stored Razorpay webhook events to their orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Events applied per batch')
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Keep running and look for new events every N seconds (0 = drain the inbox and exit)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        interval = options['interval']
+
+        while True:
+            processed, failed = process_pending_events(batch_size)
+            self.stdout.write(self.style.SUCCESS(f"Processed {processed} webhook event(s), {failed} failed"))
+
+            if processed + failed < batch_size:
+                if not interval:
+                    break
+                time.sleep(interval)
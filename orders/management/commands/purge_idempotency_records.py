@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from orders.idempotency import purge_expired_records
+
+
+class Command(BaseCommand):
+    help = 'Delete Idempotency-Key records older than IDEMPOTENCY_TTL_HOURS'
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_records()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency record(s)"))
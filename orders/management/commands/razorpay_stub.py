@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.gateway_stub import RazorpayStub
+
+
+class Command(BaseCommand):
+    help = 'Serve an in-memory Razorpay stand-in; point RAZORPAY_BASE_URL at it to run without Razorpay'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+
+    def handle(self, *args, **options):
+        stub = RazorpayStub(host=options['host'], port=options['port'], latency=options['latency']).start()
+        self.stdout.write(self.style.SUCCESS(f"Razorpay stub listening on {stub.base_url}"))
+
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            stub.stop()
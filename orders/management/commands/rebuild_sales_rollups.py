@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from orders.rollups import rebuild_sales_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily and per-product sales rollups from the orders (reconciliation)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First order date to rebuild (YYYY-MM-DD); default: the beginning')
+        parser.add_argument('--end', help='Last order date to rebuild (YYYY-MM-DD); default: today')
+
+    def handle(self, *args, **options):
+        bounds = {}
+        for name in ['start', 'end']:
+            if options[name]:
+                bounds[name] = parse_date(options[name])
+                if bounds[name] is None:
+                    raise CommandError(f"Invalid --{name} date: {options[name]}")
+
+        daily_rows, product_rows = rebuild_sales_rollups(**bounds)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {daily_rows} daily and {product_rows} per-product rollup row(s)"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from orders.rollups import rebuild_user_summaries
+
+
+class Command(BaseCommand):
+    help = "Recompute every user's order summary (count, lifetime value, last order, open orders) from the orders"
+
+    def handle(self, *args, **options):
+        written = rebuild_user_summaries()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt order summaries for {written} user(s)"))
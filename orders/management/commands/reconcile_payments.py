@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from orders.reconcile import reconcile_pending_orders
+
+
+class Command(BaseCommand):
+    help = 'Check every pending order with a payment link against Razorpay and apply paid/failed outcomes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Orders fetched and updated per batch')
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent gateway requests')
+        parser.add_argument('--rate', type=float, default=20, help='Gateway requests per second, across all workers')
+        parser.add_argument(
+            '--min-age', type=int, default=5,
+            help='Skip orders placed less than this many minutes ago (their buyer may still be paying)'
+        )
+
+    def handle(self, *args, **options):
+        counts = reconcile_pending_orders(
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            rate=options['rate'],
+            min_age=timedelta(minutes=options['min_age']),
+        )
+        seconds = counts['seconds']
+        throughput = counts['checked'] / seconds if seconds else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {counts['checked']} order(s) in {seconds:.2f}s ({throughput:.1f} orders/s). "
+            f"Paid: {counts['paid']}, Failed: {counts['failed']}, "
+            f"Still pending: {counts['pending']} (errors: {counts['errors']})"
+        ))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.models import StockReservation
+from orders.reservations import releasable_reservations, release_reservations
+
+
+class Command(BaseCommand):
+    help = 'Release stock held by orders whose payment failed, was cancelled or expired'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Reservations released per transaction')
+        parser.add_argument(
+            '--interval', type=int, default=0,
+            help='Keep running and sweep every N seconds (0 = sweep once and exit)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        interval = options['interval']
+
+        while True:
+            released = self.sweep(batch_size)
+            self.stdout.write(self.style.SUCCESS(f"Released {released} stock reservation(s)"))
+
+            if not interval:
+                break
+            time.sleep(interval)
+
+    def sweep(self, batch_size):
+        released = 0
+        while True:
+            batch_ids = list(releasable_reservations().values_list('reservation_id', flat=True)[:batch_size])
+            if not batch_ids:
+                return released
+            released += release_reservations(StockReservation.objects.filter(reservation_id__in=batch_ids))
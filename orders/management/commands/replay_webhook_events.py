@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from orders.models import WebhookEvent
+from orders.webhooks import process_pending_events
+
+
+class Command(BaseCommand):
+    help = 'Re-drive stored Razorpay webhook events (Failed ones by default) through process_webhook_events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event-key', action='append', default=[], help='Replay this event (repeatable)')
+        parser.add_argument('--event', help='Only events of this type, e.g. payment.captured')
+        parser.add_argument(
+            '--status', default='Failed', choices=['Failed', 'Processed', 'all'],
+            help='Which events to replay; applying an event twice is safe'
+        )
+        parser.add_argument('--since', help='Only events received at or after this ISO datetime')
+        parser.add_argument('--now', action='store_true', help='Apply the replayed events immediately')
+        parser.add_argument('--batch-size', type=int, default=100, help='Events applied per batch with --now')
+
+    def handle(self, *args, **options):
+        events = WebhookEvent.objects.exclude(status='Pending')
+        if options['event_key']:
+            events = events.filter(event_key__in=options['event_key'])
+        if options['status'] != 'all':
+            events = events.filter(status=options['status'])
+        if options['event']:
+            events = events.filter(event=options['event'])
+        if options['since']:
+            try:
+                since = parse_datetime(options['since'])
+            except ValueError:
+                since = None
+            if since is None:
+                raise CommandError(f"--since must be an ISO datetime, got {options['since']!r}")
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            events = events.filter(received_at__gte=since)
+
+        replayed = events.update(status='Pending', attempts=0, next_attempt_at=timezone.now(), last_error=None, processed_at=None)
+        self.stdout.write(self.style.SUCCESS(f"Queued {replayed} webhook event(s) for replay"))
+
+        if options['now']:
+            processed = failed = 0
+            while True:
+                batch_processed, batch_failed = process_pending_events(options['batch_size'])
+                processed += batch_processed
+                failed += batch_failed
+                if batch_processed + batch_failed < options['batch_size']:
+                    break
+            self.stdout.write(self.style.SUCCESS(f"Processed {processed} webhook event(s), {failed} failed"))
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_alter_orderdetail_price_at_purchase'),
+        ('products', '0005_product_reserved_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('reservation_id', models.AutoField(primary_key=True, serialize=False)),
+                ('quantity', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('Active', 'Active'), ('Released', 'Released'), ('Committed', 'Committed')], default='Active', max_length=20)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='orders.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='products.product')),
+            ],
+            options={
+                'db_table': 'stock_reservations',
+                'indexes': [models.Index(fields=['status', 'expires_at'], name='reservation_status_expiry_idx')],
+                'constraints': [models.UniqueConstraint(fields=('order', 'product'), name='unique_order_product_reservation')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:09
+
+from django.db import migrations, models
+
+
+def merge_duplicate_cart_items(apps, schema_editor):
+    """Keep one row per (cart, product) before the unique constraint is added, preferring the active one."""
+    CartItem = apps.get_model('orders', 'CartItem')
+    seen = set()
+    duplicate_ids = []
+    for item in CartItem.objects.order_by('cart_id', 'product_id', '-is_active', '-id').only('id', 'cart_id', 'product_id'):
+        key = (item.cart_id, item.product_id)
+        if key in seen:
+            duplicate_ids.append(item.id)
+        else:
+            seen.add(key)
+    CartItem.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_stockreservation'),
+        ('products', '0005_product_reserved_stock'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_cart_product'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:12
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_cartitem_unique_cart_product'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='razorpay_payment_link_url',
+            field=models.URLField(blank=True, max_length=255, null=True),
+        ),
+        migrations.CreateModel(
+            name='PaymentLinkJob',
+            fields=[
+                ('job_id', models.AutoField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Running', 'Running'), ('Done', 'Done'), ('Failed', 'Failed')], default='Pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='payment_link_job', to='orders.order')),
+            ],
+            options={
+                'db_table': 'payment_link_jobs',
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='payment_link_job_due_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_paymentlinkjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='next_payment_check_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='payment_check_attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
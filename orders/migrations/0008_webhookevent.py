@@ -0,0 +1,31 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_order_payment_check_schedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('webhook_event_id', models.AutoField(primary_key=True, serialize=False)),
+                ('event_key', models.CharField(max_length=255, unique=True)),
+                ('event', models.CharField(max_length=100)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Processed', 'Processed'), ('Failed', 'Failed')], default='Pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'webhook_events',
+                'indexes': [models.Index(fields=['status', 'received_at'], name='webhook_event_due_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_order_listing_indexes'),
+        ('products', '0005_product_reserved_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('rollup_id', models.AutoField(primary_key=True, serialize=False)),
+                ('date', models.DateField(unique=True)),
+                ('orders', models.IntegerField(default=0)),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cancellations', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'daily_sales_rollups',
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSalesRollup',
+            fields=[
+                ('rollup_id', models.AutoField(primary_key=True, serialize=False)),
+                ('date', models.DateField()),
+                ('orders', models.IntegerField(default=0)),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cancellations', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='products.product')),
+            ],
+            options={
+                'db_table': 'product_sales_rollups',
+                'indexes': [models.Index(fields=['product', 'date'], name='product_sales_product_idx')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'product'), name='unique_product_sales_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0010_sales_rollups'),
+        ('products', '0005_product_reserved_stock'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('order_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('total_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('shipping_address', models.TextField(max_length=250)),
+                ('status', models.CharField(choices=[('Pending', 'Pending'), ('Processing', 'Processing'), ('Shipped', 'Shipped'), ('Delivered', 'Delivered'), ('Failed', 'Failed'), ('Cancelled', 'Cancelled')], max_length=20)),
+                ('tracking_id', models.UUIDField(editable=False, unique=True)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('razorpay_payment_link_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('razorpay_payment_link_url', models.URLField(blank=True, max_length=255, null=True)),
+                ('razorpay_payment_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('is_refunded', models.BooleanField(default=False)),
+                ('is_active', models.BooleanField(default=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'archived_orders',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderDetail',
+            fields=[
+                ('order_detail_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('quantity', models.PositiveIntegerField()),
+                ('price_at_purchase', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('is_active', models.BooleanField(default=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_details', to='orders.archivedorder')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_order_details', to='products.product')),
+            ],
+            options={
+                'db_table': 'archived_order_details',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', '-created_at'], name='archived_order_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['created_at'], name='archived_order_created_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0011_order_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0013_idempotencyrecord'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorderdetail',
+            name='product_code',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedorderdetail',
+            name='product_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='archivedorderdetail',
+            name='thumbnail_url',
+            field=models.CharField(blank=True, max_length=500, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderdetail',
+            name='product_code',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderdetail',
+            name='product_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='orderdetail',
+            name='thumbnail_url',
+            field=models.CharField(blank=True, max_length=500, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0014_order_detail_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Invoice',
+            fields=[
+                ('invoice_id', models.AutoField(primary_key=True, serialize=False)),
+                ('order_id', models.IntegerField(unique=True)),
+                ('source', models.CharField(max_length=100)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('file_path', models.CharField(max_length=255)),
+                ('size', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'invoices',
+            },
+        ),
+    ]
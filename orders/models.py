@@ -1,4 +1,7 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import UniqueConstraint
+from django.utils import timezone
 from users.models import CustomUser
 from products.models import Product
 import uuid
@@ -19,6 +22,9 @@ class Cart(models.Model):
 class CartItem(models.Model):
     class Meta:
         db_table = 'cart_items'
+        constraints = [
+            UniqueConstraint(fields=["cart", "product"], name="unique_cart_product")  # One line per product; see upsert_cart_items
+        ]
 
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -41,16 +47,26 @@ class Order(models.Model):
 
     class Meta:
         db_table = 'orders'
+        # Back the admin listing's filters, each ending in its keyset cursor order
+        indexes = [
+            models.Index(fields=["is_active", "-created_at", "-order_id"], name="order_active_created_idx"),
+            models.Index(fields=["status", "-created_at", "-order_id"], name="order_status_created_idx"),
+            models.Index(fields=["user", "-created_at", "-order_id"], name="order_user_created_idx"),
+        ]
 
     order_id = models.AutoField(primary_key=True)
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     shipping_address = models.TextField(max_length=250)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="Pending")
+    version = models.PositiveIntegerField(default=0)  # Bumped by every status change; see orders.status.transition
     tracking_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     razorpay_payment_link_id = models.CharField(max_length=255, blank=True, null=True)  # Payment Link ID
+    razorpay_payment_link_url = models.URLField(max_length=255, blank=True, null=True)  # Short URL shown to the customer
     razorpay_payment_id = models.CharField(max_length=255, blank=True, null=True)  # Set after payment
+    next_payment_check_at = models.DateTimeField(blank=True, null=True, db_index=True)  # Shared schedule for poll_payment_status
+    payment_check_attempts = models.PositiveIntegerField(default=0)  # Drives the poller's backoff
     is_refunded = models.BooleanField(default=False)  # Track refunds
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)  # Soft delete flag for orders
@@ -68,13 +84,253 @@ class OrderDetail(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
     price_at_purchase = models.DecimalField(max_digits=10, decimal_places=2, help_text="Stores the offer price at purchase")
+    # The product as it was bought (see orders.snapshots), so orders render without the catalog
+    product_name = models.CharField(max_length=255, blank=True, default="")
+    product_code = models.CharField(max_length=100, blank=True, null=True)
+    thumbnail_url = models.CharField(max_length=500, blank=True, null=True)
     is_active = models.BooleanField(default=True)  # Soft delete flag for order details
 
     def save(self, *args, **kwargs):
         """Ensure price_at_purchase is the offer price at the time of purchase"""
-        if not self.price_at_purchase:  # Only set if not already provided
-            self.price_at_purchase = self.product.offer_price  # Store the offer price
+        if self.price_at_purchase is None:  # Only set if not already provided
+            self.price_at_purchase = self.product.offer_price_decimal  # Store the offer price
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.quantity} x {self.product.name} for Order #{self.order.order_id}"
+
+# StockReservation Model (units held for an order until it ships, fails or expires)
+class StockReservation(models.Model):
+    STATUS_CHOICES = [
+        ('Active', 'Active'),
+        ('Released', 'Released'),
+        ('Committed', 'Committed'),
+    ]
+
+    class Meta:
+        db_table = 'stock_reservations'
+        constraints = [
+            UniqueConstraint(fields=["order", "product"], name="unique_order_product_reservation")
+        ]
+        indexes = [
+            models.Index(fields=["status", "expires_at"], name="reservation_status_expiry_idx"),
+        ]
+
+    reservation_id = models.AutoField(primary_key=True)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="reservations")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="reservations")
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="Active")
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product.name} reserved for Order #{self.order.order_id} ({self.status})"
+
+# PaymentLinkJob Model (outbox entry: create the Razorpay Payment Link after the order commits)
+class PaymentLinkJob(models.Model):
+    STATUS_CHOICES = [
+        ('Pending', 'Pending'),
+        ('Running', 'Running'),
+        ('Done', 'Done'),
+        ('Failed', 'Failed'),
+    ]
+
+    class Meta:
+        db_table = 'payment_link_jobs'
+        indexes = [
+            models.Index(fields=["status", "next_attempt_at"], name="payment_link_job_due_idx"),
+        ]
+
+    job_id = models.AutoField(primary_key=True)
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name="payment_link_job")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="Pending")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)  # Also the lease expiry while Running
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Payment link job for Order #{self.order_id} ({self.status})"
+
+
+class WebhookEvent(models.Model):
+    """Raw Razorpay webhook, stored on receipt and applied later by process_webhook_events."""
+    STATUS_CHOICES = [
+        ('Pending', 'Pending'),
+        ('Processed', 'Processed'),
+        ('Failed', 'Failed'),
+    ]
+
+    class Meta:
+        db_table = 'webhook_events'
+        indexes = [
+            models.Index(fields=["status", "received_at"], name="webhook_event_due_idx"),
+            models.Index(fields=["status", "next_attempt_at"], name="webhook_event_retry_idx"),
+        ]
+
+    webhook_event_id = models.AutoField(primary_key=True)
+    # X-Razorpay-Event-Id, or "<event>:<entity id>" when the header is missing; duplicates are dropped on insert
+    event_key = models.CharField(max_length=255, unique=True)
+    event = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="Pending")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)  # Pushed back with each failed attempt
+    last_error = models.TextField(blank=True, null=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.event} ({self.event_key}, {self.status})"
+
+
+class DailySalesRollup(models.Model):
+    """
+    Sales per day an order was placed, kept up to date by orders.status.record_status_changes.
+    An order counts as sold while it is Processing, Shipped or Delivered.
+    """
+    class Meta:
+        db_table = 'daily_sales_rollups'
+
+    rollup_id = models.AutoField(primary_key=True)
+    date = models.DateField(unique=True)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cancellations = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Sales on {self.date}: {self.orders} orders, ₹{self.revenue}"
+
+
+class ProductSalesRollup(models.Model):
+    """Per-product sales per day an order was placed; see DailySalesRollup."""
+    class Meta:
+        db_table = 'product_sales_rollups'
+        constraints = [
+            UniqueConstraint(fields=["date", "product"], name="unique_product_sales_day")
+        ]
+        indexes = [
+            models.Index(fields=["product", "date"], name="product_sales_product_idx"),
+        ]
+
+    rollup_id = models.AutoField(primary_key=True)
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="sales_rollups")
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cancellations = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Sales of {self.product_id} on {self.date}: {self.units} units"
+
+
+class ArchivedOrder(models.Model):
+    """
+    A closed order (Delivered, Cancelled or Failed) moved out of `orders` by
+    archive_orders. Keeps the original order_id, so lookups by ID can fall
+    back here transparently.
+    """
+    class Meta:
+        db_table = 'archived_orders'
+        indexes = [
+            models.Index(fields=["user", "-created_at"], name="archived_order_user_idx"),
+            models.Index(fields=["created_at"], name="archived_order_created_idx"),
+        ]
+
+    order_id = models.IntegerField(primary_key=True)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name="archived_orders")
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    shipping_address = models.TextField(max_length=250)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    tracking_id = models.UUIDField(unique=True, editable=False)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    razorpay_payment_link_id = models.CharField(max_length=255, blank=True, null=True)
+    razorpay_payment_link_url = models.URLField(max_length=255, blank=True, null=True)
+    razorpay_payment_id = models.CharField(max_length=255, blank=True, null=True)
+    is_refunded = models.BooleanField(default=False)
+    is_active = models.BooleanField(default=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived order #{self.order_id} ({self.status})"
+
+
+class ArchivedOrderDetail(models.Model):
+    """A line of an ArchivedOrder, with its original order_detail_id."""
+    class Meta:
+        db_table = 'archived_order_details'
+
+    order_detail_id = models.IntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name="order_details")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="archived_order_details")
+    quantity = models.PositiveIntegerField()
+    price_at_purchase = models.DecimalField(max_digits=10, decimal_places=2)
+    product_name = models.CharField(max_length=255, blank=True, default="")
+    product_code = models.CharField(max_length=100, blank=True, null=True)
+    thumbnail_url = models.CharField(max_length=500, blank=True, null=True)
+    is_active = models.BooleanField(default=True)
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} in archived order #{self.order_id}"
+
+
+class IdempotencyRecord(models.Model):
+    """
+    The outcome of a request sent with an Idempotency-Key (see orders.idempotency).
+    Repeats of the key within the TTL get the stored response; while the first
+    request is still running the record stays InProgress and repeats wait for it.
+    """
+    STATUS_CHOICES = [
+        ('InProgress', 'InProgress'),
+        ('Completed', 'Completed'),
+    ]
+
+    class Meta:
+        db_table = 'idempotency_records'
+        constraints = [
+            UniqueConstraint(fields=["scope", "key"], name="unique_idempotency_scope_key")
+        ]
+
+    idempotency_record_id = models.AutoField(primary_key=True)
+    scope = models.CharField(max_length=100)  # Endpoint and caller, so keys of different users never collide
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)  # A reused key with a different body is rejected
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="InProgress")
+    response_status = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_body = models.JSONField(blank=True, null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.scope} {self.key} ({self.status})"
+
+
+class Invoice(models.Model):
+    """
+    The rendered invoice of an order (see orders.invoices). The document lives
+    on disk under INVOICE_ROOT, named by its content hash; `source` records the
+    order state it was rendered from, so it is only re-rendered when that changes.
+    Keyed by order_id rather than a foreign key so it outlives archiving.
+    """
+    class Meta:
+        db_table = 'invoices'
+
+    invoice_id = models.AutoField(primary_key=True)
+    order_id = models.IntegerField(unique=True)
+    source = models.CharField(max_length=100)  # "<order version>:<order updated_at>"
+    content_hash = models.CharField(max_length=64)
+    file_path = models.CharField(max_length=255)  # Relative to INVOICE_ROOT
+    size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Invoice for order #{self.order_id}"
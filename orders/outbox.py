@@ -0,0 +1,66 @@
+# orders/outbox.py
+from datetime import timedelta
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from ecommerce.logger import logger
+from .checkout import create_payment_link
+from .models import PaymentLinkJob
+from .payments import schedule_first_check
+from .status import transition
+
+MAX_ATTEMPTS = 6
+LEASE = timedelta(minutes=2)  # A Running job whose worker died is picked up again after this
+
+
+def enqueue_payment_link(order):
+    """Record that the order needs a payment link. Call inside the order's transaction."""
+    return PaymentLinkJob.objects.create(order=order)
+
+
+def due_jobs(now=None):
+    """Jobs that are waiting for a retry, or Running with an expired lease."""
+    now = now or timezone.now()
+    return PaymentLinkJob.objects.filter(status__in=["Pending", "Running"], next_attempt_at__lte=now)
+
+
+def run_payment_link_job(job_id, timeout=None):
+    """
+    Claim the job and call Razorpay for it. Returns the payment link, or None if
+    the job was already claimed elsewhere or the call failed (it is then
+    rescheduled with exponential backoff, and the order is marked Failed
+    once MAX_ATTEMPTS is reached).
+
+    Runs outside any transaction so no database lock is held while the
+    gateway is being called.
+    """
+    now = timezone.now()
+    claimed = PaymentLinkJob.objects.filter(
+        Q(status="Pending") | Q(status="Running", next_attempt_at__lte=now),
+        job_id=job_id,
+    ).update(status="Running", attempts=F("attempts") + 1, next_attempt_at=now + LEASE, updated_at=now)
+    if not claimed:
+        return None
+
+    job = PaymentLinkJob.objects.select_related("order__user").get(job_id=job_id)
+    try:
+        payment_link = create_payment_link(job.order, timeout=timeout)
+    except Exception as e:
+        logger.warning(f"Payment link for Order #{job.order_id} failed (attempt {job.attempts}): {e}")
+        if job.attempts >= MAX_ATTEMPTS:
+            PaymentLinkJob.objects.filter(job_id=job_id).update(status="Failed", last_error=str(e), updated_at=timezone.now())
+            # Failed orders have their stock released by release_stock_reservations
+            transition(job.order, "Failed")
+        else:
+            PaymentLinkJob.objects.filter(job_id=job_id).update(
+                status="Pending",
+                last_error=str(e),
+                next_attempt_at=timezone.now() + timedelta(seconds=30 * 2 ** (job.attempts - 1)),
+                updated_at=timezone.now(),
+            )
+        return None
+
+    PaymentLinkJob.objects.filter(job_id=job_id).update(status="Done", last_error=None, updated_at=timezone.now())
+    schedule_first_check(job.order)  # Let poll_payment_status pick it up if no callback arrives
+    return payment_link
@@ -0,0 +1,155 @@
+# orders/payments.py
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from ecommerce.logger import logger
+from users.utils import create_admin_notification
+from . import gateway
+from .models import Order
+from .reservations import InsufficientStock, restore_reservations
+from .status import transition
+from .utils import clear_purchased_cart_items
+
+FIRST_CHECK_DELAY = timedelta(minutes=1)  # Give the customer time to pay before the first poll
+MAX_CHECK_DELAY = timedelta(hours=1)
+CHECK_LEASE = timedelta(minutes=2)  # Claimed orders are skipped by other pollers for this long
+
+
+def mark_paid(order, razorpay_payment_id):
+    """
+    Move the order to Processing and deactivate the purchased cart lines.
+    Returns False, changing nothing, if the order was no longer payable; a
+    capture refused that way (the order was cancelled or expired, or is
+    already paid by another payment) is flagged to admins for a refund.
+    """
+    with transaction.atomic():
+        if not transition(order, "Processing", razorpay_payment_id=razorpay_payment_id, next_payment_check_at=None):
+            flag_unapplied_capture(order, razorpay_payment_id)
+            return False
+        restore_paid_stock(order)
+    clear_purchased_cart_items(order)
+    return True
+
+
+def flag_unapplied_capture(order, razorpay_payment_id):
+    """
+    Ask admins to refund a captured payment that mark_paid did not apply.
+    Repeats of the capture that already paid the order are ignored.
+    """
+    paid_with = Order.objects.filter(order_id=order.order_id).values_list("razorpay_payment_id", flat=True).first()
+    if not razorpay_payment_id or order.status == "Pending" or paid_with == razorpay_payment_id:
+        return
+    logger.warning(f"Payment {razorpay_payment_id} captured for Order #{order.order_id} ({order.status}) was not applied")
+    create_admin_notification(
+        title="refund_needed",
+        user=order.user,
+        message=f"Payment {razorpay_payment_id} was captured for Order #{order.order_id}, which is {order.status}. Refund it.",
+        event_type="refund_needed"
+    )
+
+
+def restore_paid_stock(order):
+    """
+    Reserve the stock of a just-paid order again if it had been released (a
+    capture after a failure or after the reservation lapsed), so the units
+    are not sold twice. If they already have been, admins are notified to
+    restock or refund the order.
+    """
+    try:
+        with transaction.atomic():
+            restore_reservations(order)
+    except InsufficientStock as e:
+        logger.warning(f"Order #{order.order_id} was paid after its stock was released: {e}")
+        create_admin_notification(
+            title="stock_shortfall",
+            user=order.user,
+            message=f"Order #{order.order_id} was paid after its stock was released and cannot be reserved again ({e}). Restock or refund it.",
+            event_type="stock_shortfall"
+        )
+
+
+def mark_failed(order, razorpay_payment_id=None):
+    """
+    Move the order to Failed; its stock is released by release_stock_reservations.
+    Returns False, changing nothing, if the order had already left Pending.
+    """
+    fields = {"next_payment_check_at": None}
+    if razorpay_payment_id:
+        fields["razorpay_payment_id"] = razorpay_payment_id
+    return transition(order, "Failed", **fields)
+
+
+def fetch_link_outcome(payment_link_id):
+    """
+    Ask Razorpay where a payment link stands.
+    Returns ("paid", payment_id), ("failed", None) or ("pending", None).
+    """
+    link = gateway.fetch_payment_link(payment_link_id)
+    if link.get("status") == "paid":
+        payments = link.get("payments") or []
+        return "paid", (payments[-1]["payment_id"] if payments else None)
+    if link.get("status") in ["cancelled", "expired"]:
+        return "failed", None
+    return "pending", None
+
+
+def schedule_first_check(order):
+    """Put a freshly linked order on the shared polling schedule."""
+    Order.objects.filter(order_id=order.order_id).update(next_payment_check_at=timezone.now() + FIRST_CHECK_DELAY)
+
+
+def claim_due_orders(batch_size, now=None):
+    """
+    Claim up to `batch_size` pending orders whose next check is due.
+
+    The schedule lives on the orders themselves, so any number of pollers can
+    share it: claimed rows get their next check pushed out by CHECK_LEASE
+    (and are skipped while locked on databases with SKIP LOCKED).
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        orders = list(
+            Order.objects.select_for_update(skip_locked=True).filter(
+                Q(next_payment_check_at__lte=now) | Q(next_payment_check_at__isnull=True),
+                status="Pending",
+                is_active=True,
+                razorpay_payment_link_id__isnull=False,
+            ).order_by("next_payment_check_at")[:batch_size]
+        )
+        Order.objects.filter(order_id__in=[order.order_id for order in orders]).update(
+            next_payment_check_at=now + CHECK_LEASE
+        )
+    return orders
+
+
+def poll_due_orders(batch_size=100):
+    """
+    Check one batch of due pending orders against Razorpay and apply the
+    result. Orders that are still unpaid are re-scheduled with exponential
+    backoff. Returns a dict of counts per outcome.
+    """
+    counts = {"paid": 0, "failed": 0, "pending": 0, "errors": 0}
+
+    for order in claim_due_orders(batch_size):
+        try:
+            outcome, payment_id = fetch_link_outcome(order.razorpay_payment_link_id)
+        except Exception as e:
+            logger.warning(f"Payment status check for Order #{order.order_id} failed: {e}")
+            outcome, payment_id = "pending", None
+            counts["errors"] += 1
+
+        counts[outcome] += 1
+        if outcome == "paid":
+            mark_paid(order, payment_id)
+        elif outcome == "failed":
+            mark_failed(order)
+        else:
+            delay = min(FIRST_CHECK_DELAY * 2 ** order.payment_check_attempts, MAX_CHECK_DELAY)
+            Order.objects.filter(order_id=order.order_id, status="Pending").update(
+                payment_check_attempts=order.payment_check_attempts + 1,
+                next_payment_check_at=timezone.now() + delay,
+            )
+
+    return counts
@@ -0,0 +1,149 @@
+# orders/reconcile.py
+"""
+Sweep of every pending order with a payment link against Razorpay, for
+orders whose webhook never arrived and whose buyer never called verify.
+
+Link statuses are fetched concurrently by a bounded thread pool under a
+shared rate limit; the database work stays on the calling thread and is
+applied once per batch.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, CharField, F, Value, When
+from django.utils import timezone
+
+from ecommerce.logger import logger
+from .models import Order, StockReservation
+from .payments import fetch_link_outcome, restore_paid_stock
+from .status import TRANSITIONS, record_status_changes
+from .utils import clear_purchased_cart_items_for_orders
+
+
+class RateLimiter:
+    """Token bucket shared by the worker threads: at most `rate` calls per second, bursting to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def reconcilable_orders(min_age, now=None):
+    """Pending orders with a payment link created more than `min_age` ago."""
+    cutoff = (now or timezone.now()) - min_age
+    return Order.objects.filter(
+        status="Pending",
+        is_active=True,
+        razorpay_payment_link_id__isnull=False,
+        created_at__lt=cutoff,
+    )
+
+
+def apply_outcomes(paid, failed):
+    """
+    Move the orders in `paid` ({order_id: payment_id}) to Processing and those
+    in `failed` to Failed, with one UPDATE each. Orders that left Pending in
+    the meantime (a webhook or verify got there first) are skipped.
+    Returns the (paid, failed) counts actually applied.
+    """
+    with transaction.atomic():
+        still_pending = set(
+            Order.objects.select_for_update().filter(order_id__in=[*paid, *failed], status="Pending")
+            .values_list("order_id", flat=True)
+        )
+        paid = {order_id: payment_id for order_id, payment_id in paid.items() if order_id in still_pending}
+        failed = [order_id for order_id in failed if order_id in still_pending]
+        now = timezone.now()
+
+        if paid:
+            Order.objects.filter(order_id__in=paid, status__in=TRANSITIONS["Processing"]).update(
+                status="Processing",
+                version=F("version") + 1,
+                razorpay_payment_id=Case(
+                    *[When(order_id=order_id, then=Value(payment_id)) for order_id, payment_id in paid.items()],
+                    output_field=CharField(),
+                ),
+                next_payment_check_at=None,
+                updated_at=now,
+            )
+            clear_purchased_cart_items_for_orders(paid.keys())
+            lapsed = StockReservation.objects.filter(order_id__in=paid, status="Released").values_list("order_id", flat=True)
+            for order in Order.objects.filter(order_id__in=set(lapsed)).select_related("user"):
+                restore_paid_stock(order)
+        if failed:
+            Order.objects.filter(order_id__in=failed, status__in=TRANSITIONS["Failed"]).update(
+                status="Failed", version=F("version") + 1, next_payment_check_at=None, updated_at=now
+            )
+
+        record_status_changes(
+            [(order_id, "Pending", "Processing") for order_id in paid] +
+            [(order_id, "Pending", "Failed") for order_id in failed]
+        )
+    return len(paid), len(failed)
+
+
+def reconcile_pending_orders(batch_size=200, workers=8, rate=20, min_age=timedelta(minutes=5)):
+    """
+    Check every reconcilable order against Razorpay, `batch_size` orders at a
+    time (walked by order_id so the scan always finishes), with `workers`
+    concurrent fetches and at most `rate` fetches per second overall.
+    Returns a dict of counts plus `checked` and `seconds`.
+    """
+    limiter = RateLimiter(rate)
+    counts = {"checked": 0, "paid": 0, "failed": 0, "pending": 0, "errors": 0}
+    orders = reconcilable_orders(min_age).order_by("order_id")
+    last_id = 0
+    started = time.perf_counter()
+
+    def check(link_id):
+        limiter.acquire()
+        return fetch_link_outcome(link_id)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            batch = list(orders.filter(order_id__gt=last_id).values_list("order_id", "razorpay_payment_link_id")[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1][0]
+
+            futures = {order_id: executor.submit(check, link_id) for order_id, link_id in batch}
+            paid, failed = {}, []
+            for order_id, future in futures.items():
+                try:
+                    outcome, payment_id = future.result()
+                except Exception as e:
+                    logger.warning(f"Reconciliation of Order #{order_id} failed: {e}")
+                    counts["errors"] += 1
+                    continue
+                if outcome == "paid":
+                    paid[order_id] = payment_id
+                elif outcome == "failed":
+                    failed.append(order_id)
+                else:
+                    counts["pending"] += 1
+
+            applied_paid, applied_failed = apply_outcomes(paid, failed)
+            counts["paid"] += applied_paid
+            counts["failed"] += applied_failed
+            counts["checked"] += len(batch)
+
+    counts["seconds"] = time.perf_counter() - started
+    return counts
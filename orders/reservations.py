@@ -0,0 +1,187 @@
+# orders/reservations.py
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from products.models import Product
+from .models import OrderDetail, StockReservation
+
+
+class InsufficientStock(Exception):
+    """Raised when a product cannot cover the requested quantity."""
+
+    def __init__(self, product):
+        self.product = product
+        super().__init__(f"Only {product.available_stock} available for {product.name}")
+
+
+def reserve_stock(order, lines):
+    """
+    Reserve stock for an order. `lines` is an iterable of (product, quantity).
+
+    All products are claimed with a single conditional
+    `UPDATE ... SET reserved_stock = reserved_stock + qty WHERE stock >= reserved_stock + qty`
+    (qty picked per row with CASE), so concurrent checkouts can never reserve
+    more units than exist.
+    Must be called inside a transaction; raises InsufficientStock on the first
+    product that cannot be covered so the caller can roll everything back.
+    """
+    quantities = defaultdict(int)
+    products = {}
+    for product, quantity in lines:
+        quantities[product.product_id] += quantity
+        products[product.product_id] = product
+
+    # One statement for all products: every row is only touched if it can cover its own quantity
+    needed = _per_product_case(quantities)
+    savepoint = transaction.savepoint()
+    reserved = Product.objects.filter(
+        product_id__in=quantities.keys(),
+        is_active=True,
+        stock__gte=F("reserved_stock") + needed,
+    ).update(reserved_stock=F("reserved_stock") + needed)
+
+    if reserved != len(quantities):
+        # Undo the rows that were claimed, then find the first product that could not be covered
+        transaction.savepoint_rollback(savepoint)
+        current = Product.objects.filter(product_id__in=quantities.keys()).in_bulk()
+        for product_id, quantity in quantities.items():
+            product = current.get(product_id)
+            if product is None or not product.is_active or product.available_stock < quantity:
+                raise InsufficientStock(product or products[product_id])
+        raise InsufficientStock(products[next(iter(quantities))])  # Stock changed underneath us
+    transaction.savepoint_commit(savepoint)
+
+    expires_at = timezone.now() + timedelta(minutes=settings.STOCK_RESERVATION_TTL_MINUTES)
+    return StockReservation.objects.bulk_create([
+        StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+        for product_id, quantity in quantities.items()
+    ])
+
+
+def _per_product_case(quantities, default=None):
+    """CASE product_id WHEN ... THEN qty, for a per-row amount in one UPDATE."""
+    return Case(
+        *[When(product_id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        default=default,
+        output_field=IntegerField(),
+    )
+
+
+def _settle(reservations, new_status, consume_stock):
+    """Move active reservations to `new_status`, returning their units to the products."""
+    with transaction.atomic():
+        active = list(
+            reservations.filter(status="Active").select_for_update().values_list("reservation_id", "product_id", "quantity")
+        )
+        if not active:
+            return 0
+
+        StockReservation.objects.filter(
+            reservation_id__in=[reservation_id for reservation_id, _, _ in active]
+        ).update(status=new_status, updated_at=timezone.now())
+
+        per_product = defaultdict(int)
+        for _, product_id, quantity in active:
+            per_product[product_id] += quantity
+
+        quantity = _per_product_case(per_product)
+        changes = {"reserved_stock": F("reserved_stock") - quantity}
+        if consume_stock:
+            changes["stock"] = F("stock") - quantity
+        Product.objects.filter(product_id__in=per_product.keys()).update(**changes)
+
+        return len(active)
+
+
+def release_reservations(reservations):
+    """Give the reserved units back to available stock (payment failed, expired or cancelled)."""
+    return _settle(reservations, "Released", consume_stock=False)
+
+
+def restore_reservations(order):
+    """
+    Reserve again the units of `order` whose reservations were released
+    (its payment failed, or it sat unpaid past the TTL) when a payment then
+    goes through after all. Must be called inside a transaction; raises
+    InsufficientStock, reserving nothing, if the units have been sold since.
+    Returns the number of products reserved again.
+    """
+    released = list(StockReservation.objects.filter(order_id=order.order_id, status="Released").select_related("product"))
+    if not released:
+        return 0
+    # The released rows make way for new ones (one reservation per order and product)
+    StockReservation.objects.filter(reservation_id__in=[reservation.reservation_id for reservation in released]).delete()
+    return len(reserve_stock(order, [(reservation.product, reservation.quantity) for reservation in released]))
+
+
+def ship_order_stock(order_ids):
+    """
+    Take the units of the given orders out of stock when they ship, in one statement.
+
+    Lines covered by an active reservation move from reserved_stock out of
+    stock; lines without one (their reservation lapsed) come straight out of
+    stock. A single `UPDATE ... CASE` touches every product, guarded so no
+    product ends up with less stock than it still has reserved for other
+    orders. Must be called inside a transaction holding the orders' row
+    locks; raises InsufficientStock, leaving stock untouched, if a product
+    cannot cover its lines.
+    """
+    active = list(
+        StockReservation.objects.filter(order_id__in=order_ids, status="Active")
+        .select_for_update().values_list("reservation_id", "order_id", "product_id", "quantity")
+    )
+    reserved_lines = {(order_id, product_id): quantity for _, order_id, product_id, quantity in active}
+
+    ordered_lines = defaultdict(int)
+    for order_id, product_id, quantity in OrderDetail.objects.filter(order_id__in=order_ids).values_list("order_id", "product_id", "quantity"):
+        ordered_lines[(order_id, product_id)] += quantity
+
+    # Reserved lines are settled by their reservation, as reserve_stock merged them per product
+    shipped = defaultdict(int)
+    reserved = defaultdict(int)
+    for line, quantity in ordered_lines.items():
+        product_id = line[1]
+        shipped[product_id] += reserved_lines.get(line) or quantity
+        reserved[product_id] += reserved_lines.get(line, 0)
+    if not shipped:
+        return 0
+
+    stock_decrement = _per_product_case(shipped)
+    reserved_decrement = _per_product_case(reserved, default=Value(0))
+    savepoint = transaction.savepoint()
+    updated = Product.objects.filter(
+        product_id__in=shipped.keys(),
+        stock__gte=F("reserved_stock") - reserved_decrement + stock_decrement,
+    ).update(stock=F("stock") - stock_decrement, reserved_stock=F("reserved_stock") - reserved_decrement)
+
+    if updated != len(shipped):
+        transaction.savepoint_rollback(savepoint)
+        current = Product.objects.filter(product_id__in=shipped.keys()).in_bulk()
+        for product_id, quantity in shipped.items():
+            product = current[product_id]
+            if product.stock - product.reserved_stock + reserved[product_id] < quantity:
+                raise InsufficientStock(product)
+        raise InsufficientStock(current[next(iter(shipped))])  # Stock changed underneath us
+    transaction.savepoint_commit(savepoint)
+
+    StockReservation.objects.filter(
+        reservation_id__in=[reservation_id for reservation_id, _, _, _ in active]
+    ).update(status="Committed", updated_at=timezone.now())
+    return updated
+
+
+def releasable_reservations(now=None):
+    """
+    Active reservations whose order will not be paid: the payment failed, the
+    order was cancelled, or it is still pending after the reservation expired.
+    """
+    now = now or timezone.now()
+    return StockReservation.objects.filter(status="Active").filter(
+        Q(order__status__in=["Failed", "Cancelled"]) |
+        Q(order__status="Pending", expires_at__lt=now)
+    )
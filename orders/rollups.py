@@ -0,0 +1,243 @@
+# orders/rollups.py
+"""
+Data derived from order statuses, moved incrementally on every status change
+(see orders.status.record_status_changes) and rebuildable from the orders:
+
+- Daily and per-product sales rollups, bucketed by the day the order was
+  placed. An order counts as sold (orders, units, revenue) while its status
+  is in SOLD_STATUSES, and as a cancellation once it is Cancelled.
+- Per-user order summaries (users.UserOrderSummary).
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, Max, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, TruncDate
+from django.utils import timezone
+
+from users.models import UserOrderSummary
+from .models import ArchivedOrder, ArchivedOrderDetail, DailySalesRollup, Order, OrderDetail, ProductSalesRollup
+
+SOLD_STATUSES = ["Processing", "Shipped", "Delivered"]
+OPEN_STATUSES = ["Pending", "Processing", "Shipped"]
+ROLLUP_FIELDS = ["orders", "units", "revenue", "cancellations"]
+SUMMARY_FIELDS = ["order_count", "lifetime_value", "open_orders"]
+
+
+def _increment(model, key_fields, deltas, fields=ROLLUP_FIELDS, extra=None):
+    """
+    Add `deltas` ({key tuple: {field: amount}}) to the rollup rows, creating
+    missing rows first. Every row is changed by one UPDATE with a CASE per
+    field, so concurrent writers add up instead of overwriting each other.
+    `extra` maps further fields to expressions built from {key: row pk}.
+    """
+    deltas = {key: amounts for key, amounts in deltas.items() if any(amounts.values())}
+    if not deltas:
+        return
+
+    model.objects.bulk_create([model(**dict(zip(key_fields, key))) for key in deltas], ignore_conflicts=True)
+    row_ids = {
+        tuple(row[1:]): row[0]
+        for row in model.objects.filter(
+            **{f"{field}__in": {key[i] for key in deltas} for i, field in enumerate(key_fields)}
+        ).values_list("pk", *key_fields)
+    }
+
+    changes = {field: build(row_ids) for field, build in (extra or {}).items()}
+    for field in fields:
+        whens = [
+            When(pk=row_ids[key], then=F(field) + Value(amounts[field]))
+            for key, amounts in deltas.items() if amounts.get(field)
+        ]
+        if whens:
+            changes[field] = Case(*whens, default=F(field), output_field=model._meta.get_field(field))
+    model.objects.filter(pk__in=[row_ids[key] for key in deltas]).update(**changes, updated_at=timezone.now())
+
+
+def update_sales_rollups(changes):
+    """Apply a batch of (order_id, old_status, new_status) changes to the rollups."""
+    signs = {}
+    cancelled = set()
+    for order_id, old_status, new_status in changes:
+        sign = (new_status in SOLD_STATUSES) - (old_status in SOLD_STATUSES)
+        if sign:
+            signs[order_id] = sign
+        if new_status == "Cancelled" and old_status != "Cancelled":
+            cancelled.add(order_id)
+
+    order_ids = set(signs) | cancelled
+    if not order_ids:
+        return
+
+    days = {
+        order_id: timezone.localdate(created_at)
+        for order_id, created_at in Order.objects.filter(order_id__in=order_ids).values_list("order_id", "created_at")
+    }
+    daily = defaultdict(lambda: defaultdict(int))
+    per_product = defaultdict(lambda: defaultdict(int))
+
+    for order_id, day in days.items():
+        daily[(day,)]["orders"] += signs.get(order_id, 0)
+        daily[(day,)]["cancellations"] += order_id in cancelled
+
+    counted = set()
+    lines = OrderDetail.objects.filter(order_id__in=order_ids, is_active=True).values_list(
+        "order_id", "product_id", "quantity", "price_at_purchase"
+    )
+    for order_id, product_id, quantity, price in lines:
+        day, sign = days[order_id], signs.get(order_id, 0)
+        product = per_product[(day, product_id)]
+        product["units"] += sign * quantity
+        product["revenue"] += sign * quantity * price
+        daily[(day,)]["units"] += sign * quantity
+        daily[(day,)]["revenue"] += sign * quantity * price
+        if (order_id, product_id) not in counted:  # An order counts once per product
+            counted.add((order_id, product_id))
+            product["orders"] += sign
+            product["cancellations"] += order_id in cancelled
+
+    with transaction.atomic():
+        _increment(DailySalesRollup, ["date"], daily)
+        _increment(ProductSalesRollup, ["date", "product_id"], per_product)
+
+
+def update_user_summaries(changes):
+    """Apply a batch of (order_id, old_status, new_status) changes to the buyers' summaries."""
+    changes = {order_id: (old_status, new_status) for order_id, old_status, new_status in changes}
+    deltas = defaultdict(lambda: defaultdict(int))
+    placed = {}  # user_id -> latest created_at among newly placed orders
+
+    for order_id, user_id, total_price, created_at in Order.objects.filter(order_id__in=changes.keys()).values_list(
+        "order_id", "user_id", "total_price", "created_at"
+    ):
+        old_status, new_status = changes[order_id]
+        summary = deltas[(user_id,)]
+        if old_status is None:
+            summary["order_count"] += 1
+            placed[user_id] = max(placed.get(user_id, created_at), created_at)
+        summary["open_orders"] += (new_status in OPEN_STATUSES) - (old_status in OPEN_STATUSES)
+        summary["lifetime_value"] += ((new_status in SOLD_STATUSES) - (old_status in SOLD_STATUSES)) * total_price
+
+    def last_order_at(row_ids):
+        return Case(
+            *[
+                When(pk=row_ids[(user_id,)], then=Greatest(Coalesce(F("last_order_at"), Value(at)), Value(at)))
+                for user_id, at in placed.items()
+            ],
+            default=F("last_order_at"),
+        )
+
+    with transaction.atomic():
+        _increment(UserOrderSummary, ["user_id"], deltas, fields=SUMMARY_FIELDS, extra={"last_order_at": last_order_at} if placed else None)
+
+
+# Orders and their archived copies (see orders.archive); the rebuilds read both
+ORDER_SOURCES = [(Order, OrderDetail), (ArchivedOrder, ArchivedOrderDetail)]
+
+
+def _merge(rows, key, into, fields):
+    """Add the aggregate `rows` of one source into `into` ({key: {field: total}})."""
+    for row in rows:
+        totals = into[row[key] if isinstance(key, str) else tuple(row[k] for k in key)]
+        for field in fields:
+            totals[field] = (totals.get(field) or 0) + (row[field] or 0)
+
+
+def rebuild_user_summaries():
+    """Recompute every user's order summary from the orders. Returns the number of rows written."""
+    sold = Q(status__in=SOLD_STATUSES)
+    summaries = defaultdict(dict)
+    last_order_at = {}
+    for order_model, _ in ORDER_SOURCES:
+        rows = order_model.objects.values("user_id").annotate(
+            order_count=Count("order_id"),
+            lifetime_value=Sum("total_price", filter=sold),
+            last_order_at=Max("created_at"),
+            open_orders=Count("order_id", filter=Q(status__in=OPEN_STATUSES)),
+        )
+        _merge(rows, "user_id", summaries, SUMMARY_FIELDS)
+        for row in rows:
+            last_order_at[row["user_id"]] = max(last_order_at.get(row["user_id"], row["last_order_at"]), row["last_order_at"])
+
+    with transaction.atomic():
+        UserOrderSummary.objects.all().delete()
+        return len(UserOrderSummary.objects.bulk_create([
+            UserOrderSummary(
+                user_id=user_id,
+                order_count=row["order_count"],
+                lifetime_value=row["lifetime_value"] or Decimal("0"),
+                last_order_at=last_order_at[user_id],
+                open_orders=row["open_orders"],
+            )
+            for user_id, row in summaries.items()
+        ], batch_size=1000))
+
+
+def rebuild_sales_rollups(start=None, end=None):
+    """
+    Recompute the rollups for orders placed between `start` and `end`
+    (inclusive dates, open-ended when None) from the orders themselves,
+    archived ones included. Returns the number of (daily, per-product) rows written.
+    """
+    sold = Q(order__status__in=SOLD_STATUSES)
+    line_revenue = F("quantity") * F("price_at_purchase")
+    money = DecimalField(max_digits=14, decimal_places=2)
+    daily = defaultdict(dict)
+    per_product = defaultdict(dict)
+
+    for order_model, detail_model in ORDER_SOURCES:
+        orders = order_model.objects.all()
+        if start:
+            orders = orders.filter(created_at__date__gte=start)
+        if end:
+            orders = orders.filter(created_at__date__lte=end)
+
+        _merge(orders.annotate(day=TruncDate("created_at")).values("day").annotate(
+            orders=Count("order_id", filter=Q(status__in=SOLD_STATUSES)),
+            cancellations=Count("order_id", filter=Q(status="Cancelled")),
+        ), "day", daily, ["orders", "cancellations"])
+
+        lines = detail_model.objects.filter(is_active=True, order__in=orders).annotate(day=TruncDate("order__created_at"))
+        _merge(
+            lines.filter(sold).values("day").annotate(units=Sum("quantity"), revenue=Sum(line_revenue, output_field=money)),
+            "day", daily, ["units", "revenue"],
+        )
+        _merge(lines.values("day", "product_id").annotate(
+            orders=Count("order_id", distinct=True, filter=sold),
+            units=Sum("quantity", filter=sold),
+            revenue=Sum(line_revenue, filter=sold, output_field=money),
+            cancellations=Count("order_id", distinct=True, filter=Q(order__status="Cancelled")),
+        ), ("day", "product_id"), per_product, ROLLUP_FIELDS)
+
+    with transaction.atomic():
+        for model in [DailySalesRollup, ProductSalesRollup]:
+            existing = model.objects.all()
+            if start:
+                existing = existing.filter(date__gte=start)
+            if end:
+                existing = existing.filter(date__lte=end)
+            existing.delete()
+
+        daily_rows = DailySalesRollup.objects.bulk_create([
+            DailySalesRollup(
+                date=day,
+                orders=row.get("orders") or 0,
+                units=row.get("units") or 0,
+                revenue=row.get("revenue") or Decimal("0"),
+                cancellations=row.get("cancellations") or 0,
+            )
+            for day, row in daily.items()
+        ])
+        product_rows = ProductSalesRollup.objects.bulk_create([
+            ProductSalesRollup(
+                date=day,
+                product_id=product_id,
+                orders=row["orders"],
+                units=row["units"],
+                revenue=row["revenue"] or Decimal("0"),
+                cancellations=row["cancellations"],
+            )
+            for (day, product_id), row in per_product.items()
+        ], batch_size=1000)
+    return len(daily_rows), len(product_rows)
@@ -1,17 +1,54 @@
 # orders/serializers.py
 from rest_framework import serializers
 from .models import Order, OrderDetail, CartItem, Cart
-from products.serializers import ProductSerializer
+from django.db.models import Prefetch
+from products.serializers import ProductSerializer, product_details_queryset
 from users.serializers import UserSerializer
 
 # serializers.py
 
-class OrderDetailSerializer(serializers.ModelSerializer):
-    product_details = serializers.SerializerMethodField()
+def order_details_queryset():
+    """Order details with their products loaded the way ProductSerializer reads them."""
+    return OrderDetail.objects.prefetch_related(
+        Prefetch("product", queryset=product_details_queryset())
+    ).order_by("order_detail_id")
+
+
+def with_order_details(orders):
+    """
+    The prefetch plan for OrderSerializer: the user is joined in, and the
+    details, their products (with category), images and favorite counts come
+    in a fixed number of queries however many orders are on the page.
+    """
+    return orders.select_related("user").prefetch_related(
+        Prefetch("order_details", queryset=order_details_queryset())
+    )
+
+
+class OrderLineSerializer(serializers.ModelSerializer):
+    """An order line as it was bought, from its snapshot columns only; never touches the catalog."""
+    thumbnail_url = serializers.SerializerMethodField()
 
     class Meta:
         model = OrderDetail
-        fields = ['order_detail_id', 'order', 'product', 'product_details', 'quantity', 'price_at_purchase', 'is_active']
+        fields = ['order_detail_id', 'product', 'product_name', 'product_code', 'thumbnail_url', 'quantity', 'price_at_purchase', 'is_active']
+
+    def get_thumbnail_url(self, obj):
+        request = self.context.get('request')
+        if obj.thumbnail_url and request:
+            return request.build_absolute_uri(obj.thumbnail_url)
+        return obj.thumbnail_url
+
+
+class OrderDetailSerializer(OrderLineSerializer):
+    """An order line with the snapshot plus the product as it is in the catalog now."""
+    product_details = serializers.SerializerMethodField()
+
+    class Meta(OrderLineSerializer.Meta):
+        fields = [
+            'order_detail_id', 'order', 'product', 'product_details', 'product_name', 'product_code', 'thumbnail_url',
+            'quantity', 'price_at_purchase', 'is_active',
+        ]
 
     def get_product_details(self, obj):
         request = self.context.get('request')
@@ -33,6 +70,34 @@ class OrderSerializer(serializers.ModelSerializer):
         return OrderDetailSerializer(active_order_details, many=True, context={'request': request}).data
 
 
+class OrderHistorySerializer(serializers.ModelSerializer):
+    """Orders with their lines rendered from the snapshots: two queries per page, no catalog joins."""
+    order_details = OrderLineSerializer(many=True, read_only=True)
+    tracking_id = serializers.ReadOnlyField()
+
+    class Meta:
+        model = Order
+        fields = ['order_id', 'total_price', 'shipping_address', 'status', 'tracking_id', 'created_at', 'order_details', 'is_active', 'updated_at']
+
+
+def with_order_lines(orders):
+    """The prefetch plan for OrderHistorySerializer."""
+    return orders.prefetch_related(
+        Prefetch("order_details", queryset=OrderDetail.objects.filter(is_active=True).order_by("order_detail_id"))
+    )
+
+
+class OrderListSerializer(serializers.ModelSerializer):
+    """One flat row per order for the admin listing; no nested details or products."""
+    user_id = serializers.IntegerField(read_only=True)
+    username = serializers.CharField(source='user.username', read_only=True)
+    tracking_id = serializers.ReadOnlyField()
+
+    class Meta:
+        model = Order
+        fields = ['order_id', 'user_id', 'username', 'total_price', 'status', 'tracking_id', 'created_at', 'updated_at']
+
+
 class CartItemSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(read_only=True)
     product_details = serializers.SerializerMethodField()  # Pass request to ProductSerializer
@@ -58,6 +123,8 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ['cart_id', 'user', 'products']
 
     def get_products(self, obj):
-        active_cart_items = obj.cartitem_set.filter(is_active=True)
+        active_cart_items = obj.cartitem_set.filter(is_active=True).prefetch_related(
+            Prefetch("product", queryset=product_details_queryset())
+        )
         request = self.context.get('request')  # Retrieve request from context
         return CartItemSerializer(active_cart_items, many=True, context={'request': request}).data
@@ -0,0 +1,55 @@
+# orders/snapshots.py
+"""
+The product name, code and primary thumbnail copied onto each order line
+when it is bought, so order history and invoices render from the order
+tables alone and survive later catalog edits or soft deletes.
+"""
+from products.models import Product, UploadedImage
+from .models import ArchivedOrderDetail, OrderDetail
+
+SNAPSHOT_FIELDS = ["product_name", "product_code", "thumbnail_url"]
+BACKFILL_MODELS = [OrderDetail, ArchivedOrderDetail]
+
+
+def primary_thumbnails(product_ids):
+    """{product_id: image URL} of each product's first normal image (any image if it has none), in one query."""
+    thumbnails = {}
+    images = UploadedImage.objects.filter(product_id__in=product_ids).exclude(image="").order_by("product_id", "id")
+    for product_id, image_type, image in images.values_list("product_id", "type", "image"):
+        if product_id not in thumbnails or (image_type == "normal" and thumbnails[product_id][0] != "normal"):
+            thumbnails[product_id] = (image_type, image)
+    storage = UploadedImage._meta.get_field("image").storage
+    return {product_id: storage.url(image) for product_id, (_, image) in thumbnails.items()}
+
+
+def snapshot(product, thumbnails):
+    """The snapshot fields of an order line for `product`."""
+    return {
+        "product_name": product.name,
+        "product_code": product.product_code,
+        "thumbnail_url": thumbnails.get(product.product_id),
+    }
+
+
+def backfill_batch(model, batch_size=1000, after=0):
+    """
+    Fill the snapshot fields of up to `batch_size` lines of `model` (OrderDetail
+    or ArchivedOrderDetail) that have none yet, from the current catalog,
+    with one bulk UPDATE. Returns the last order_detail_id handled, or None when done.
+    """
+    lines = list(
+        model.objects.filter(product_name="", order_detail_id__gt=after)
+        .order_by("order_detail_id").only("order_detail_id", "product_id")[:batch_size]
+    )
+    if not lines:
+        return None
+
+    product_ids = {line.product_id for line in lines}
+    products = Product.objects.filter(product_id__in=product_ids).only("product_id", "name", "product_code").in_bulk()
+    thumbnails = primary_thumbnails(product_ids)
+    for line in lines:
+        for field, value in snapshot(products[line.product_id], thumbnails).items():
+            setattr(line, field, value)
+    model.objects.bulk_update(lines, SNAPSHOT_FIELDS, batch_size=batch_size)
+    return lines[-1].order_detail_id
+
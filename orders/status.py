@@ -0,0 +1,151 @@
+# orders/status.py
+from django.conf import settings
+from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from users.utils import create_admin_notifications
+from .invoices import invoice_needed, schedule_invoices
+from .models import Order, StockReservation
+from .reservations import release_reservations, ship_order_stock
+from .rollups import update_sales_rollups, update_user_summaries
+from .tracking import refresh_tracking
+
+# The statuses an order may enter each status from. Every status write is checked against it.
+TRANSITIONS = {
+    "Processing": ["Pending", "Failed"],  # A capture can still arrive after a failed attempt
+    "Failed": ["Pending"],  # Never over a payment that went through
+    "Shipped": ["Processing"],  # Only paid orders ship
+    "Delivered": ["Shipped"],
+    "Cancelled": ["Pending", "Processing", "Failed"],
+}
+# The transitions staff can apply in bulk
+BULK_TRANSITIONS = {new_status: TRANSITIONS[new_status] for new_status in ["Shipped", "Delivered", "Cancelled"]}
+
+
+def record_status_changes(changes):
+    """
+    The one place every order status change is reported to, as a list of
+    (order_id, old_status, new_status); old_status is None for a new order.
+    Call it right after the status has been written, in the same transaction
+    where there is one; it keeps the data derived from order statuses (sales
+    rollups, user order summaries, and, once committed, cached tracking entries
+    and invoices) in step.
+    """
+    changes = [change for change in changes if change[1] != change[2]]
+    if changes:
+        update_sales_rollups(changes)
+        update_user_summaries(changes)
+        order_ids = [order_id for order_id, _, _ in changes]
+        transaction.on_commit(lambda: refresh_tracking(order_ids))  # A rolled-back change must not reach the public cache
+        schedule_invoices([order_id for order_id, old_status, new_status in changes if invoice_needed(old_status, new_status)])
+
+
+def transition(order, new_status, **fields):
+    """
+    Move `order` to `new_status` with one conditional statement, without locking:
+
+        UPDATE orders SET status = ..., version = version + 1, updated_at = ..., <fields>
+        WHERE order_id = ... AND version = <version read> AND status IN (<TRANSITIONS[new_status]>)
+
+    Only those columns are written. If another writer changed the status
+    since `order` was read, nothing is written: `order` is reloaded with the
+    current status and False is returned. On success `order` is updated in
+    memory, the change is recorded and True is returned.
+    """
+    previous_status = order.status
+    if previous_status not in TRANSITIONS[new_status]:
+        return False
+
+    now = timezone.now()
+    with transaction.atomic():
+        updated = Order.objects.filter(
+            order_id=order.order_id,
+            version=order.version,
+            status__in=TRANSITIONS[new_status],
+        ).update(status=new_status, version=F("version") + 1, updated_at=now, **fields)
+        if updated:
+            record_status_changes([(order.order_id, previous_status, new_status)])
+
+    if not updated:
+        order.refresh_from_db(fields=["status", "version", "is_active", "updated_at"])
+        return False
+    order.status = new_status
+    order.version += 1
+    order.updated_at = now
+    for field, value in fields.items():
+        setattr(order, field, value)
+    return True
+
+
+class TransitionError(Exception):
+    """Some orders cannot make the requested transition; `rejected` says which and why."""
+
+    def __init__(self, rejected):
+        self.rejected = rejected
+        super().__init__(f"{len(rejected)} order(s) cannot be updated")
+
+
+def bulk_transition(order_ids, new_status):
+    """
+    Move every order in `order_ids` to `new_status`, or none of them.
+
+    The orders are locked and validated with one query. Stock is then taken
+    (Shipped) or released (Cancelled) set-based across all orders, the
+    statuses are written with one UPDATE and the admin notifications with
+    one INSERT. Raises TransitionError listing the offending orders, or
+    InsufficientStock, without changing anything.
+    """
+    allowed = BULK_TRANSITIONS[new_status]
+    order_ids = list(dict.fromkeys(order_ids))
+
+    with transaction.atomic():
+        orders = {
+            order_id: (current_status, is_active, user_id)
+            for order_id, current_status, is_active, user_id in Order.objects.select_for_update()
+            .filter(order_id__in=order_ids).values_list("order_id", "status", "is_active", "user_id")
+        }
+
+        rejected = []
+        for order_id in order_ids:
+            if order_id not in orders:
+                rejected.append({"order_id": order_id, "error": "Order not found"})
+                continue
+            current_status, is_active, _ = orders[order_id]
+            if not is_active:
+                rejected.append({"order_id": order_id, "error": "Cannot update an inactive order"})
+            elif current_status not in allowed:
+                rejected.append({"order_id": order_id, "error": f"Cannot move from {current_status} to {new_status}"})
+        if rejected:
+            raise TransitionError(rejected)
+
+        changes = {"status": new_status, "version": F("version") + 1, "updated_at": timezone.now()}
+        if new_status == "Shipped":
+            ship_order_stock(order_ids)
+        elif new_status == "Cancelled":
+            release_reservations(StockReservation.objects.filter(order_id__in=order_ids))
+            changes["is_active"] = False
+        Order.objects.filter(order_id__in=order_ids, status__in=allowed).update(**changes)
+        record_status_changes([(order_id, orders[order_id][0], new_status) for order_id in order_ids])
+
+        create_admin_notifications([
+            {
+                "title": "order_status",
+                "user_id": orders[order_id][2],
+                "message": f"Order {order_id} status updated to '{new_status}'.",
+                "event_type": "order_status_update",
+            }
+            for order_id in order_ids
+        ])
+
+    # Paid orders that were cancelled need a manual refund, as with single cancellations
+    to_refund = [order_id for order_id in order_ids if orders[order_id][0] == "Processing"]
+    if new_status == "Cancelled" and to_refund:
+        send_mail(
+            subject=f"Refund Request for {len(to_refund)} cancelled order(s)",
+            message=f"Orders {', '.join(map(str, to_refund))} were cancelled after payment. Please process the refunds manually.",
+            from_email=settings.EMAIL_HOST_USER,
+            recipient_list=[settings.EMAIL_HOST_USER]
+        )
+    return len(order_ids)
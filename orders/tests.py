@@ -1,3 +1,1247 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import razorpay
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from ecommerce.logger import logger
+from orders import gateway, idempotency, outbox
+from orders.gateway_stub import RazorpayStub
+from orders.archive import archive_batch
+from orders.expiry import expire_pending_orders
+from orders.models import ArchivedOrder, Cart, CartItem, DailySalesRollup, IdempotencyRecord, Invoice, Order, OrderDetail, PaymentLinkJob, ProductSalesRollup, StockReservation, WebhookEvent
+from orders.payments import mark_failed, mark_paid, poll_due_orders
+from orders.checkout import place_order
+from orders.invoices import render_invoice
+from orders.reconcile import reconcile_pending_orders
+from orders.serializers import OrderListSerializer
+from orders.throttles import TrackingRateThrottle
+from orders.rollups import rebuild_sales_rollups, rebuild_user_summaries
+from orders.webhooks import apply_event, process_pending_events
+from orders.reservations import InsufficientStock, reserve_stock, release_reservations, releasable_reservations
+from products.models import Category, Favorite, Product, UploadedImage
+from users.models import AdminNotification, CustomUser, UserOrderSummary, UserRole
+
+
+class StockReservationStressTest(TransactionTestCase):
+    """Many buyers racing for the last units of one product must never oversell it."""
+
+    STOCK = 25
+    BUYERS = 8
+    ORDERS_PER_BUYER = 10
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user("9000000000", "buyer", "buyer@example.com", "pass")
+        self.product = Product.objects.create(name="Flash sale drill", description="-", price=100, stock=self.STOCK)
+        self.orders = [
+            Order.objects.create(user=self.user, total_price=100, shipping_address="Somewhere")
+            for _ in range(self.BUYERS * self.ORDERS_PER_BUYER)
+        ]
+
+    def _buy(self, orders, results):
+        try:
+            for order in orders:
+                while True:
+                    try:
+                        with transaction.atomic():
+                            reserve_stock(order, [(Product(product_id=self.product.product_id, name="-"), 1)])
+                        results.append(True)
+                        break
+                    except InsufficientStock:
+                        results.append(False)
+                        break
+                    except OperationalError:
+                        time.sleep(0.001)  # SQLite lets one writer in at a time; try again
+        finally:
+            connection.close()
+
+    def test_concurrent_reservations_do_not_oversell(self):
+        results = []
+        threads = [
+            threading.Thread(target=self._buy, args=(self.orders[i::self.BUYERS], results))
+            for i in range(self.BUYERS)
+        ]
+
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        self.product.refresh_from_db()
+        self.assertEqual(len(results), len(self.orders))
+        self.assertEqual(results.count(True), self.STOCK)
+        self.assertEqual(self.product.reserved_stock, self.STOCK)
+        self.assertEqual(self.product.available_stock, 0)
+        self.assertEqual(StockReservation.objects.filter(status="Active").count(), self.STOCK)
+        logger.info(f"{len(results) / elapsed:.0f} reservation attempts/s across {self.BUYERS} threads")
+
+    def test_product_edits_keep_reservations(self):
+        admin = CustomUser.objects.create_user("9000000014", "admin", "stock-admin@example.com", "pass", role=UserRole.ADMIN)
+        client = APIClient()
+        client.force_authenticate(admin)
+        stale = Product.objects.get(pk=self.product.pk)  # Read before the checkout below
+        with transaction.atomic():
+            reserve_stock(self.orders[0], [(self.product, 5)])
+
+        stale.name = "Renamed drill"
+        stale.save()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.name, self.product.reserved_stock), ("Renamed drill", 5))
+
+        url = f"/api/products/productdetail/{self.product.pk}/"
+        payload = {"name": "Drill", "description": "-", "price": "100.00"}
+        response = client.put(url, {**payload, "stock": 4}, format="json")
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertIn("stock", response.json())
+        response = client.put(url, {**payload, "stock": 10}, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.reserved_stock, self.product.available_stock), (10, 5, 5))
+
+    def test_failed_orders_release_their_stock(self):
+        with transaction.atomic():
+            reserve_stock(self.orders[0], [(self.product, 5)])
+        Order.objects.filter(pk=self.orders[0].pk).update(status="Failed")
+
+        self.assertEqual(release_reservations(releasable_reservations()), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved_stock, 0)
+        self.assertEqual(self.product.stock, self.STOCK)
+
+
+class CartTest(TestCase):
+    """The cart lists a page of items in a fixed number of queries and upserts its lines."""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user("9000000018", "shopper", "shopper@example.com", "pass")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name="Tools", description="-")
+        UploadedImage.objects.create(image="categories/tools.png", category=self.category)
+        self.cart = Cart.objects.create(user=self.user)
+
+    def _add_items(self, count):
+        for i in range(count):
+            product = Product.objects.create(name=f"Item {CartItem.objects.count()}", description="-", price=10, stock=5, category=self.category)
+            UploadedImage.objects.create(image=f"products/cart-{product.pk}.png", product=product)
+            CartItem.objects.create(cart=self.cart, product=product, quantity=1)
+
+    def _list_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(queries), response.json()
+
+    def test_list_is_paginated_in_constant_queries(self):
+        self._add_items(1)
+        few, _ = self._list_queries("/api/orders/cart/")
+        self._add_items(11)
+        many, page = self._list_queries("/api/orders/cart/")
+        self.assertEqual(few, many)
+        self.assertEqual((page["count"], len(page["results"])), (12, 5))
+        self.assertEqual(page["results"][0]["product_details"]["images"][0]["type"], "normal")
+
+        last, page = self._list_queries("/api/orders/cart/?page=3")
+        self.assertEqual(last, many)
+        self.assertEqual([item["product_details"]["name"] for item in page["results"]], ["Item 10", "Item 11"])
+        _, page = self._list_queries("/api/orders/cart/?page_size=50")
+        self.assertEqual(len(page["results"]), 12)  # Capped at max_page_size (20)
+
+
+    def test_adding_a_product_again_updates_its_line(self):
+        self._add_items(1)
+        product = Product.objects.get()
+        item = CartItem.objects.get()
+
+        # Used to be a 400 "already in the cart"; the new quantity now replaces the old one
+        response = self.client.post("/api/orders/cart/", {"products": [{"product": product.pk, "quantity": 3}]}, format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(list(CartItem.objects.values_list("id", "quantity", "is_active")), [(item.id, 3, True)])
+
+        self.client.delete(f"/api/orders/cart/{item.id}/")
+        self.assertFalse(CartItem.objects.get().is_active)
+        response = self.client.post("/api/orders/cart/", {"products": [{"product": product.pk, "quantity": 2}]}, format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(list(CartItem.objects.values_list("id", "quantity", "is_active")), [(item.id, 2, True)])
+        self.assertEqual([line["quantity"] for line in response.json()["products"]], [2])
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            CartItem.objects.create(cart=self.cart, product=product, quantity=1)
+
+
+class CartDoubleSubmitTest(TransactionTestCase):
+    """Two add-to-cart requests racing for the same product leave one line."""
+
+    def test_double_submit_keeps_one_line(self):
+        user = CustomUser.objects.create_user("9000000019", "double", "double@example.com", "pass")
+        product = Product.objects.create(name="Widget", description="-", price=10, stock=5)
+        barrier = threading.Barrier(2)
+        statuses = []
+
+        def submit(quantity):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                barrier.wait()
+                while True:
+                    try:
+                        response = client.post("/api/orders/cart/", {"products": [{"product": product.pk, "quantity": quantity}]}, format="json")
+                        break
+                    except OperationalError:
+                        time.sleep(0.001)  # SQLite lets one writer in at a time; try again
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=submit, args=(quantity,)) for quantity in [1, 2]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [201, 201])
+        self.assertEqual(Cart.objects.count(), 1)
+        self.assertEqual(CartItem.objects.count(), 1)
+        self.assertIn(CartItem.objects.get().quantity, [1, 2])
+
+
+class RazorpayGatewayStubTest(TestCase):
+    """Checkout and payment polling end to end, with the local stub standing in for Razorpay."""
+
+    def setUp(self):
+        self.stub = RazorpayStub().start()
+        self.addCleanup(self.stub.stop)
+        settings_override = override_settings(RAZORPAY_BASE_URL=self.stub.base_url, RAZORPAY_KEY_ID="rzp_test", RAZORPAY_KEY_SECRET="secret")
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        gateway.reset_client()
+        self.addCleanup(gateway.reset_client)
+
+        self.user = CustomUser.objects.create_user("9000000001", "payer", "payer@example.com", "pass")
+        self.product = Product.objects.create(name="Cordless drill", description="-", price=100, stock=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_checkout_and_poll_against_stub(self):
+        response = self.client.post("/api/orders/checkout/", {
+            "items": [{"product": self.product.product_id, "quantity": 2}],
+            "shipping_address": "Somewhere",
+        }, format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+
+        order = Order.objects.get()
+        self.assertIn(order.razorpay_payment_link_id, self.stub.payment_links)
+        self.assertEqual(self.stub.payment_links[order.razorpay_payment_link_id]["reference_id"], f"order_{order.order_id}")
+        self.assertEqual(self.stub.payment_links[order.razorpay_payment_link_id]["notes"], {"order_id": str(order.order_id)})
+
+        payment_id = self.stub.pay(order.razorpay_payment_link_id)
+        Order.objects.filter(pk=order.pk).update(next_payment_check_at=timezone.now())
+        self.assertEqual(poll_due_orders()["paid"], 1)
+
+        order.refresh_from_db()
+        self.assertEqual(order.status, "Processing")
+        self.assertEqual(order.razorpay_payment_id, payment_id)
+        self.assertEqual(gateway.metrics.snapshot()["payment_link.fetch"]["errors"], 0)
+
+    def test_order_placement_queries_do_not_grow_with_lines(self):
+        def place(phone, lines):
+            buyer = CustomUser.objects.create_user(phone, f"buyer{phone}", f"{phone}@example.com", "pass")
+            cart = Cart.objects.create(user=buyer)
+            for i in range(lines):
+                product = Product.objects.create(name=f"Part {phone}-{i}", description="-", price=100, stock=5)
+                UploadedImage.objects.create(image=f"products/{phone}-{i}.png", product=product)
+                CartItem.objects.create(cart=cart, product=product, quantity=2)
+            client = APIClient()
+            client.force_authenticate(buyer)
+            with CaptureQueriesContext(connection) as queries:
+                response = client.post("/api/orders/order/", {"shipping_address": "Somewhere"}, format="json")
+            self.assertEqual(response.status_code, 201, response.content)
+            self.assertEqual(OrderDetail.objects.filter(order__user=buyer).count(), lines)
+            return len(queries)
+
+        self.assertEqual(place("9000000020", 1), place("9000000021", 12))
+
+    def test_cart_rejects_malformed_items(self):
+        for item in [{}, {"product": "abc"}, {"product": [1]}, {"product": self.product.product_id, "quantity": "2"}]:
+            response = self.client.post("/api/orders/cart/", {"products": [item]}, format="json")
+            self.assertEqual(response.status_code, 400, item)
+        response = self.client.post("/api/orders/cart/", {"products": [{"product": str(self.product.product_id), "quantity": 2}]}, format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+
+    def test_checkout_rejects_malformed_product_ids(self):
+        for product in [None, "abc", {"id": 1}, 999999]:
+            item = {"quantity": 1} if product is None else {"product": product, "quantity": 1}
+            response = self.client.post("/api/orders/checkout/", {"items": [item], "shipping_address": "Somewhere"}, format="json")
+            self.assertEqual(response.status_code, 400, product)
+            self.assertEqual(response.json(), {"error": "Product not found"})
+        self.assertFalse(Order.objects.exists())
+
+    def test_fetches_are_retried_and_breaker_opens(self):
+        link_id = gateway.create_payment_link({"amount": 100, "currency": "INR", "reference_id": "order_x"})["id"]
+
+        self.stub.fail_next = 1  # One 500, then the retry succeeds
+        self.assertEqual(gateway.fetch_payment_link(link_id)["id"], link_id)
+
+        self.stub.fail_next = 100
+        for _ in range(gateway.breaker.failure_threshold):
+            try:
+                gateway.fetch_payment_link(link_id)
+            except (razorpay.errors.ServerError, gateway.GatewayUnavailable):
+                pass
+        requests_before = self.stub.requests
+        with self.assertRaises(gateway.GatewayUnavailable):
+            gateway.fetch_payment_link(link_id)
+        self.assertEqual(self.stub.requests, requests_before)  # Rejected without calling the gateway
+
+        stats = gateway.metrics.snapshot()["payment_link.fetch"]
+        self.assertGreaterEqual(stats["errors"], gateway.breaker.failure_threshold)
+
+    def test_reconcile_applies_outcomes_in_bulk(self):
+        other = Product.objects.create(name="Drill bits", description="-", price=10, stock=50)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        CartItem.objects.create(cart=cart, product=other, quantity=1)
+        with transaction.atomic():
+            orders = [place_order(self.user, "Somewhere", [(other, 1)]) for _ in range(5)]
+            orders.append(place_order(self.user, "Somewhere", [(self.product, 1)]))
+        for order in orders:
+            link_id = gateway.create_payment_link({"amount": 1000, "currency": "INR", "reference_id": f"order_{order.order_id}"})["id"]
+            Order.objects.filter(pk=order.pk).update(razorpay_payment_link_id=link_id)
+            order.razorpay_payment_link_id = link_id
+        payment_id = self.stub.pay(orders[5].razorpay_payment_link_id)
+        self.stub.payment_links[orders[0].razorpay_payment_link_id]["status"] = "expired"
+
+        counts = reconcile_pending_orders(batch_size=2, workers=4, rate=100, min_age=timedelta(0))
+        self.assertEqual({key: counts[key] for key in ["checked", "paid", "failed", "pending", "errors"]},
+                         {"checked": 6, "paid": 1, "failed": 1, "pending": 4, "errors": 0})
+
+        statuses = dict(Order.objects.values_list("order_id", "status"))
+        self.assertEqual(statuses[orders[5].order_id], "Processing")
+        self.assertEqual(statuses[orders[0].order_id], "Failed")
+        self.assertEqual(Order.objects.get(pk=orders[5].pk).razorpay_payment_id, payment_id)
+        self.assertEqual(list(CartItem.objects.filter(is_active=True).values_list("product_id", flat=True)), [other.product_id])
+        self.assertEqual(DailySalesRollup.objects.get().orders, 1)
+
+    def test_expiry_closes_old_pending_orders_and_cancels_links(self):
+        with transaction.atomic():
+            orders = [place_order(self.user, "Somewhere", [(self.product, 1)]) for _ in range(3)]
+        for order in orders:
+            link_id = gateway.create_payment_link({"amount": 10000, "currency": "INR", "reference_id": f"order_{order.order_id}"})["id"]
+            Order.objects.filter(pk=order.pk).update(razorpay_payment_link_id=link_id)
+        Order.objects.filter(pk__in=[orders[0].pk, orders[1].pk]).update(created_at=timezone.now() - timedelta(hours=72))
+
+        counts = expire_pending_orders(ttl=timedelta(hours=48), new_status="Cancelled", batch_size=1)  # Links cancelled by default
+        self.assertEqual(counts, {"expired": 2, "links_cancelled": 2, "link_errors": 0})
+
+        self.assertEqual(
+            list(Order.objects.order_by("order_id").values_list("status", "is_active")),
+            [("Cancelled", False), ("Cancelled", False), ("Pending", True)],
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved_stock, 1)
+        self.assertEqual(
+            sorted(link["status"] for link in self.stub.payment_links.values()),
+            ["cancelled", "cancelled", "created"],
+        )
+        self.assertEqual(AdminNotification.objects.filter(event_type="orders_expired").count(), 1)
+        self.assertEqual(expire_pending_orders(ttl=timedelta(hours=48))["expired"], 0)
+
+        # A capture that got in before its link was cancelled is not applied but flagged for a refund
+        late_capture = {"payload": {"payment": {"entity": {"id": "pay_late", "amount": 10000, "notes": {"order_id": orders[0].order_id}}}}}
+        apply_event(WebhookEvent(event="payment.captured", payload=late_capture))
+        self.assertEqual(Order.objects.get(pk=orders[0].pk).status, "Cancelled")
+        self.assertTrue(AdminNotification.objects.filter(event_type="refund_needed", message__contains="pay_late").exists())
+
+
+
+class PaymentLinkOutboxTest(TestCase):
+    """Payment links the request could not create are retried by the outbox worker, then given up on."""
+
+    def setUp(self):
+        self.stub = RazorpayStub().start()
+        self.addCleanup(self.stub.stop)
+        settings_override = override_settings(RAZORPAY_BASE_URL=self.stub.base_url, RAZORPAY_KEY_ID="rzp_test", RAZORPAY_KEY_SECRET="secret")
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        gateway.reset_client()
+        self.addCleanup(gateway.reset_client)
+
+        self.user = CustomUser.objects.create_user("9000000022", "outboxed", "outbox@example.com", "pass")
+        self.product = Product.objects.create(name="Cordless drill", description="-", price=100, stock=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _checkout(self):
+        return self.client.post("/api/orders/checkout/", {
+            "items": [{"product": self.product.product_id, "quantity": 1}],
+            "shipping_address": "Somewhere",
+        }, format="json")
+
+    def _process_jobs(self):
+        out = io.StringIO()
+        call_command("process_payment_link_jobs", stdout=out)
+        return out.getvalue()
+
+    def test_gateway_timeout_answers_202_and_the_worker_retries(self):
+        self.stub.latency = 0.5
+        with override_settings(PAYMENT_LINK_REQUEST_TIMEOUT=0.1):
+            response = self._checkout()
+        self.assertEqual(response.status_code, 202, response.content)
+        self.assertIsNone(response.json()["payment_link"])
+
+        order = Order.objects.get()
+        job = PaymentLinkJob.objects.get(order=order)
+        self.assertEqual((job.status, job.attempts, order.status), ("Pending", 1, "Pending"))
+        self.assertGreater(job.next_attempt_at, timezone.now() + timedelta(seconds=25))  # 30s backoff after the first failure
+        self.assertIsNone(order.razorpay_payment_link_id)
+
+        self.stub.latency = 0
+        self.assertIn("Created 0 of 0", self._process_jobs())  # Not due yet
+        PaymentLinkJob.objects.update(next_attempt_at=timezone.now())
+        self.stub.fail_next = 1
+        self.assertIn("Created 0 of 1", self._process_jobs())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ("Pending", 2))
+        self.assertGreater(job.next_attempt_at, timezone.now() + timedelta(seconds=55))  # Doubled
+
+        PaymentLinkJob.objects.update(next_attempt_at=timezone.now())
+        self.assertIn("Created 1 of 1", self._process_jobs())
+        job.refresh_from_db()
+        order.refresh_from_db()
+        self.assertEqual(job.status, "Done")
+        self.assertIn(order.razorpay_payment_link_id, self.stub.payment_links)
+        self.assertEqual(len(self.stub.payment_links), 1)  # reference_id keeps the timed-out attempt from adding a second link
+        self.assertIsNotNone(order.next_payment_check_at)
+
+    def test_jobs_give_up_after_max_attempts(self):
+        self.stub.fail_next = 100
+        response = self._checkout()
+        self.assertEqual(response.status_code, 202, response.content)
+        PaymentLinkJob.objects.update(attempts=outbox.MAX_ATTEMPTS - 1, next_attempt_at=timezone.now())
+
+        self._process_jobs()
+        job = PaymentLinkJob.objects.get()
+        self.assertEqual((job.status, job.attempts), ("Failed", outbox.MAX_ATTEMPTS))
+        self.assertEqual(Order.objects.get().status, "Failed")
+        self.assertIn("Created 0 of 0", self._process_jobs())  # Never picked up again
+
+    def test_a_leased_job_is_not_claimed_twice(self):
+        with transaction.atomic():
+            order = place_order(self.user, "Somewhere", [(self.product, 1)])
+            job = outbox.enqueue_payment_link(order)
+        # Another worker holds it
+        PaymentLinkJob.objects.filter(pk=job.pk).update(status="Running", attempts=1, next_attempt_at=timezone.now() + outbox.LEASE)
+
+        self.assertIsNone(outbox.run_payment_link_job(job.job_id))
+        self.assertFalse(outbox.due_jobs().exists())
+        self.assertEqual(PaymentLinkJob.objects.get().attempts, 1)
+        self.assertEqual(self.stub.payment_links, {})
+
+        # The worker died: once its lease runs out the job is due again
+        PaymentLinkJob.objects.filter(pk=job.pk).update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertIsNotNone(outbox.run_payment_link_job(job.job_id))
+        self.assertEqual(PaymentLinkJob.objects.get().status, "Done")
+
+
+class IdempotencyKeyTest(TransactionTestCase):
+    """Retried checkouts with the same Idempotency-Key place one order and call Razorpay once."""
+
+    def setUp(self):
+        self.stub = RazorpayStub().start()
+        self.addCleanup(self.stub.stop)
+        settings_override = override_settings(RAZORPAY_BASE_URL=self.stub.base_url, RAZORPAY_KEY_ID="rzp_test", RAZORPAY_KEY_SECRET="secret")
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        gateway.reset_client()
+        self.addCleanup(gateway.reset_client)
+
+        self.user = CustomUser.objects.create_user("9000000010", "retrier", "retrier@example.com", "pass")
+        self.product = Product.objects.create(name="Cordless drill", description="-", price=100, stock=5)
+        self.body = {"items": [{"product": self.product.product_id, "quantity": 1}], "shipping_address": "Somewhere"}
+
+    def _checkout(self, body, key="key-1"):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.post("/api/orders/checkout/", body, format="json", HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_duplicates_are_coalesced_and_replayed(self):
+        responses = {}
+        in_gateway, release = threading.Event(), threading.Event()
+        create_payment_link = gateway.create_payment_link
+
+        def held_create_payment_link(*args, **kwargs):
+            in_gateway.set()
+            release.wait(5)
+            return create_payment_link(*args, **kwargs)
+
+        def send():
+            try:
+                responses["first"] = self._checkout(self.body)
+            finally:
+                connection.close()
+
+        with mock.patch.object(gateway, "create_payment_link", held_create_payment_link):
+            thread = threading.Thread(target=send)
+            thread.start()
+            self.assertTrue(in_gateway.wait(5))  # The order is committed and the first request holds the key
+            started = time.monotonic()
+            in_progress = self._checkout(self.body)
+            self.assertLess(time.monotonic() - started, 1)  # Turned away at once, not held until the first finishes
+            release.set()
+            thread.join()
+        self.assertEqual(in_progress.status_code, 409, in_progress.content)
+        self.assertEqual(in_progress["Retry-After"], "1")
+
+        first, duplicate = responses["first"], self._checkout(self.body)
+
+        self.assertEqual(first.status_code, 201, first.content)
+        self.assertEqual(duplicate.status_code, 201, duplicate.content)
+        self.assertEqual(duplicate["Idempotent-Replayed"], "true")
+        self.assertEqual(duplicate.json()["order_id"], first.json()["order_id"])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(len(self.stub.payment_links), 1)
+
+        self.assertEqual(duplicate.json(), first.json())
+        self.assertEqual(self._checkout({**self.body, "shipping_address": "Elsewhere"}).status_code, 422)
+        self.assertEqual(self._checkout(self.body, key="key-2").status_code, 201)
+        self.assertEqual(Order.objects.count(), 2)
+
+@override_settings(WEBHOOK="webhook-secret")
+class WebhookInboxTest(TestCase):
+    """Webhooks are stored and acknowledged; redeliveries and replays change nothing twice."""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user("9000000002", "hooked", "hooked@example.com", "pass")
+        self.order = Order.objects.create(
+            user=self.user, total_price=100, shipping_address="Somewhere", razorpay_payment_id="pay_123"
+        )
+
+    def _deliver(self, payload, event_id="evt_1"):
+        body = json.dumps(payload)
+        signature = hmac.new(b"webhook-secret", body.encode(), hashlib.sha256).hexdigest()
+        return self.client.post(
+            "/api/orders/razorpay-webhook/", body, content_type="application/json",
+            HTTP_X_RAZORPAY_SIGNATURE=signature, HTTP_X_RAZORPAY_EVENT_ID=event_id,
+        )
+
+    def test_duplicates_are_dropped_and_processing_is_idempotent(self):
+        payload = {"event": "payment.captured", "payload": {"payment": {"entity": {"id": "pay_123", "amount": 10000}}}}
+        for _ in range(3):
+            self.assertEqual(self._deliver(payload).status_code, 200)
+
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "Pending")  # Nothing applied before the worker runs
+
+        self.assertEqual(process_pending_events(), (1, 0))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "Processing")
+
+        # Replaying the stored event must not notify again
+        WebhookEvent.objects.update(status="Pending")
+        self.assertEqual(process_pending_events(), (1, 0))
+        self.assertEqual(AdminNotification.objects.filter(event_type="payment_success").count(), 1)
+
+    def test_invalid_signature_is_not_stored(self):
+        response = self.client.post(
+            "/api/orders/razorpay-webhook/", "{}", content_type="application/json", HTTP_X_RAZORPAY_SIGNATURE="bad",
+            HTTP_IDEMPOTENCY_KEY="key-1",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+        self.assertFalse(IdempotencyRecord.objects.exists())  # Nothing written for an unverified caller
+
+    def test_failed_event_is_retried_with_backoff(self):
+        payload = {"event": "payment.captured", "payload": {"payment": {"entity": {"id": "pay_123", "amount": 10000}}}}
+        self._deliver(payload)
+        with mock.patch("orders.webhooks.mark_paid", side_effect=RuntimeError("db down")):
+            self.assertEqual(process_pending_events(), (0, 1))
+            self.assertEqual(process_pending_events(), (0, 0))  # Not due again yet
+
+        webhook_event = WebhookEvent.objects.get()
+        self.assertEqual((webhook_event.status, webhook_event.attempts), ("Pending", 1))
+        self.assertGreater(webhook_event.next_attempt_at, timezone.now())
+
+        WebhookEvent.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(process_pending_events(), (1, 0))
+
+    def test_replay_rejects_an_unparsable_since(self):
+        with self.assertRaises(CommandError):
+            call_command("replay_webhook_events", since="yesterday")
+
+
+class OrderTransitionTest(TestCase):
+    """Status writes are conditional on the status and version they were read with."""
+
+    def setUp(self):
+        self.staff = CustomUser.objects.create_user("9000000009", "staff", "staff@example.com", "pass", role=UserRole.STAFF)
+        self.product = Product.objects.create(name="Widget", description="-", price=100, stock=10)
+        with transaction.atomic():
+            self.order = place_order(self.staff, "Somewhere", [(self.product, 1)])
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def test_late_failure_does_not_clobber_payment(self):
+        stale = Order.objects.get(pk=self.order.pk)
+        self.assertTrue(mark_paid(self.order, "pay_ok"))
+        self.assertFalse(mark_failed(stale, "pay_late"))
+        self.assertEqual(stale.status, "Processing")  # Reloaded with the winner's status
+
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual((order.status, order.razorpay_payment_id, order.version), ("Processing", "pay_ok", 1))
+        self.assertEqual(DailySalesRollup.objects.get().orders, 1)
+
+    def test_stale_writer_loses_even_when_the_transition_is_allowed(self):
+        stale = Order.objects.get(pk=self.order.pk)
+        self.assertTrue(mark_failed(self.order))
+        self.assertTrue(mark_paid(self.order, "pay_retry"))  # Failed -> Processing is allowed
+        stale.status = "Failed"  # Same status as the table expects, but an old version
+        self.assertFalse(mark_paid(stale, "pay_stale"))
+        self.assertEqual(Order.objects.get(pk=self.order.pk).razorpay_payment_id, "pay_retry")
+
+    def test_capture_after_failure_reserves_the_stock_again(self):
+        self.assertTrue(mark_failed(self.order))
+        release_reservations(releasable_reservations())
+        self.assertTrue(mark_paid(self.order, "pay_late"))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved_stock, 1)
+        self.assertEqual(StockReservation.objects.get(order=self.order).status, "Active")
+
+        # When the units were sold in between, the order stays paid and admins are told
+        with transaction.atomic():
+            other = place_order(self.staff, "Somewhere", [(self.product, 2)])
+        self.assertTrue(mark_failed(other))
+        release_reservations(releasable_reservations())
+        Product.objects.filter(pk=self.product.pk).update(reserved_stock=10)
+        self.assertTrue(mark_paid(other, "pay_oversold"))
+        self.assertEqual(StockReservation.objects.get(order=other).status, "Released")
+        self.assertTrue(AdminNotification.objects.filter(event_type="stock_shortfall", message__contains=f"#{other.order_id}").exists())
+
+    def test_update_endpoint_follows_the_table(self):
+        for new_status in ["Delivered", "Shipped"]:  # Unpaid orders neither ship nor deliver
+            response = self.client.put(f"/api/orders/order/{self.order.order_id}/", {"status": new_status}, format="json")
+            self.assertEqual(response.status_code, 400, response.content)
+        response = self.client.post("/api/orders/order/bulk-status/", {"order_ids": [self.order.order_id], "status": "Shipped"}, format="json")
+        self.assertEqual(response.status_code, 400, response.content)
+
+        mark_paid(self.order, "pay_ok")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(f"/api/orders/order/{self.order.order_id}/", {"status": "Shipped"}, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertFalse(any("FOR UPDATE" in query["sql"] and '"orders"' in query["sql"] for query in queries.captured_queries))
+        self.assertEqual(Order.objects.get(pk=self.order.pk).version, 2)
+
+        response = self.client.put(f"/api/orders/order/{self.order.order_id}/", {"status": "Cancelled"}, format="json")
+        self.assertEqual(response.status_code, 400, response.content)
+
+    def test_customers_cannot_set_payment_statuses(self):
+        buyer = CustomUser.objects.create_user("9000000016", "regular", "sneaky@example.com", "pass")
+        with transaction.atomic():
+            order = place_order(buyer, "Somewhere", [(self.product, 1)])
+        self.client.force_authenticate(buyer)
+        for new_status in ["Processing", "Failed"]:
+            response = self.client.put(f"/api/orders/order/{order.order_id}/", {"status": new_status}, format="json")
+            self.assertEqual(response.status_code, 400, response.content)
+        response = self.client.put(f"/api/orders/order/{order.order_id}/", {"status": "Shipped"}, format="json")
+        self.assertEqual(response.status_code, 403, response.content)
+        self.assertEqual(Order.objects.get(pk=order.pk).status, "Pending")
+
+        response = self.client.put(f"/api/orders/order/{order.order_id}/", {"status": "Cancelled"}, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_cancellation_rolls_back_when_stock_cannot_be_released(self):
+        self.client.raise_request_exception = False
+        with mock.patch("orders.views.release_reservations", side_effect=OperationalError("database is locked")):
+            response = self.client.put(f"/api/orders/order/{self.order.order_id}/", {"status": "Cancelled"}, format="json")
+        self.assertEqual(response.status_code, 500)
+
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.is_active), ("Pending", True))
+        self.assertEqual(self.order.reservations.get().status, "Active")
+
+
+class OrderListingQueryCountTest(TestCase):
+    """Listing orders costs the same number of queries however many orders and lines are on the page."""
+
+    def setUp(self):
+        self.admin = CustomUser.objects.create_user("9000000003", "admin", "admin@example.com", "pass", role=UserRole.ADMIN)
+        self.buyer = CustomUser.objects.create_user("9000000004", "buyer", "buyer4@example.com", "pass")
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.category = Category.objects.create(name="Tools", description="-")
+        UploadedImage.objects.create(image="categories/tools.png", category=self.category)
+
+    def _add_orders(self, count):
+        for i in range(count):
+            order = Order.objects.create(user=self.buyer, total_price=100, shipping_address="Somewhere")
+            for j in range(3):
+                product = Product.objects.create(name=f"Part {i}-{j}", description="-", price=100, stock=5, category=self.category)
+                UploadedImage.objects.create(image=f"products/{i}-{j}.png", product=product)
+                Favorite.objects.create(user=self.buyer, product=product)
+                OrderDetail.objects.create(order=order, product=product, quantity=1, price_at_purchase=100)
+
+    def _queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_orders(self):
+        urls = [
+            "/api/orders/order/",
+            f"/api/orders/users/{self.buyer.user_id}/",
+            "/api/orders/all/?detail=full",
+        ]
+        self._add_orders(1)
+        few = [self._queries(url) for url in urls]
+        self._add_orders(4)
+        many = [self._queries(url) for url in urls]
+
+        self.assertEqual(few, many)
+        # Order list: orders, details, products (+category), product images, category images
+        with self.assertNumQueries(5):
+            self.client.get("/api/orders/order/")
+
+    def test_history_renders_from_line_snapshots(self):
+        self._add_orders(2)
+        call_command("backfill_order_snapshots", stdout=io.StringIO())
+        self.assertFalse(OrderDetail.objects.filter(product_name="").exists())
+        Product.objects.update(name="Renamed", is_active=False)  # Catalog edits do not rewrite history
+
+        with self.assertNumQueries(2):  # Orders, then their lines
+            response = self.client.get("/api/orders/order/?detail=lines")
+        self.assertEqual(response.status_code, 200, response.content)
+        line = response.json()[-1]["order_details"][0]
+        self.assertEqual(line["product_name"], "Part 0-0")
+        self.assertEqual(line["thumbnail_url"], "http://testserver/media/products/0-0.png")
+        self.assertNotIn("product_details", line)
+
+        with self.assertNumQueries(2):  # Count-free cursor page: orders, lines
+            self.client.get("/api/orders/all/?detail=lines")
+
+    def test_retrieve_uses_stored_prices_and_is_cached(self):
+        self._add_orders(1)
+        order = Order.objects.get()
+        Product.objects.update(price=999)  # Prices changed after the purchase
+
+        response = self.client.get(f"/api/orders/order/{order.order_id}/")
+        self.assertEqual(response.json()["total_price"], 100)
+        self.assertEqual({item["price_at_purchase"] for item in response.json()["items"]}, {"100.00"})
+        self.assertNotIn("product_details", response.json()["items"][0])  # Nothing live from the catalog is cached
+
+        with self.assertNumQueries(1):  # Only the order itself; the body comes from the cache
+            self.assertEqual(self.client.get(f"/api/orders/order/{order.order_id}/").json(), response.json())
+
+        order.status = "Processing"
+        order.save()
+        self.assertEqual(self.client.get(f"/api/orders/order/{order.order_id}/").json()["status"], "Processing")
+
+
+class AllOrdersListingTest(TestCase):
+    """The admin listing pages by cursor, filters, and streams exports at a fixed query cost."""
+
+    def setUp(self):
+        self.admin = CustomUser.objects.create_user("9000000014", "admin", "all-admin@example.com", "pass", role=UserRole.ADMIN)
+        self.buyer = CustomUser.objects.create_user("9000000015", "buyer", "all-buyer@example.com", "pass")
+        self.other = CustomUser.objects.create_user("9000000016", "other", "all-other@example.com", "pass")
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        product = Product.objects.create(name="Widget", description="-", price=100, stock=100)
+        # Five orders a day apart, newest first: buyer's Processing ones on the even days
+        now = timezone.now()
+        self.created = [now - timedelta(days=day) for day in range(5)]
+        self.orders = []
+        for day in range(5):
+            order = Order.objects.create(
+                user=self.buyer if day % 2 == 0 else self.other, total_price=100, shipping_address="Somewhere",
+                status="Processing" if day % 2 == 0 else "Pending",
+            )
+            OrderDetail.objects.create(order=order, product=product, quantity=1, price_at_purchase=100, product_name="Widget")
+            Order.objects.filter(pk=order.pk).update(created_at=self.created[day])
+            self.orders.append(order)
+
+    def _ids(self, response):
+        self.assertEqual(response.status_code, 200, response.content)
+        return [row["order_id"] for row in response.json()["results"]]
+
+    def test_cursor_pages_walk_every_order_once(self):
+        with self.assertNumQueries(1):  # Count-free cursor page: orders joined with their user
+            response = self.client.get("/api/orders/all/?page_size=2")
+        seen = self._ids(response)
+        self.assertEqual(set(response.json()["results"][0]), set(OrderListSerializer.Meta.fields))
+        while response.json()["next"]:
+            response = self.client.get(response.json()["next"])
+            seen += self._ids(response)
+        self.assertEqual(seen, [order.order_id for order in self.orders])
+
+    def test_filters(self):
+        today = timezone.localdate()
+        cases = {
+            "status=Processing": [0, 2, 4],
+            "status=Pending,Processing": [0, 1, 2, 3, 4],
+            f"user={self.other.user_id}": [1, 3],
+            f"created_after={today - timedelta(days=1)}": [0, 1],
+            f"created_before={today - timedelta(days=3)}": [3, 4],
+            f"status=Processing&created_after={today - timedelta(days=2)}&created_before={today - timedelta(days=1)}": [2],
+            f"month={today:%Y-%m}": [day for day in range(5) if timezone.localdate(self.created[day]).month == today.month],
+        }
+        for query, days in cases.items():
+            with self.subTest(query):
+                self.assertEqual(self._ids(self.client.get(f"/api/orders/all/?{query}")), [self.orders[day].order_id for day in days])
+
+        for query in ["status=Lost", "user=me", "created_after=2024-02-30", "created_before=soon", "month=2024-13"]:
+            with self.subTest(query):
+                response = self.client.get(f"/api/orders/all/?{query}")
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", response.json())
+
+    def test_detail_modes(self):
+        with self.assertNumQueries(2):  # Orders, then their line snapshots
+            response = self.client.get("/api/orders/all/?detail=lines")
+        line = response.json()["results"][0]["order_details"][0]
+        self.assertEqual(line["product_name"], "Widget")
+        self.assertNotIn("product_details", line)
+
+        response = self.client.get("/api/orders/all/?detail=full")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("product_details", response.json()["results"][0]["order_details"][0])
+
+        self.client.force_authenticate(self.buyer)
+        self.assertEqual(self.client.get("/api/orders/all/").status_code, 403)
+
+    def test_exports_stream_every_match(self):
+        with self.assertNumQueries(1):  # One chunked read, however many rows
+            response = self.client.get("/api/orders/all/?export=csv&status=Processing")
+            lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="orders.csv"')
+        self.assertEqual(lines[0].split(","), list(OrderListSerializer.Meta.fields))
+        self.assertEqual([int(line.split(",")[0]) for line in lines[1:]], [self.orders[day].order_id for day in (0, 2, 4)])
+
+        response = self.client.get(f"/api/orders/all/?export=ndjson&user={self.other.user_id}")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row["order_id"], row["username"]) for row in rows], [(self.orders[1].order_id, "other"), (self.orders[3].order_id, "other")])
+
+        self.assertEqual(self.client.get("/api/orders/all/?export=xlsx").status_code, 400)
+
+
+class ShipOrderStockTest(TestCase):
+    """Shipping takes stock in one guarded statement and never drives it below what is reserved."""
+
+    def setUp(self):
+        self.admin = CustomUser.objects.create_user("9000000005", "shipper", "shipper@example.com", "pass", role=UserRole.ADMIN)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.reserved_product = Product.objects.create(name="Hammer", description="-", price=100, stock=10)
+        self.loose_product = Product.objects.create(name="Chisel", description="-", price=100, stock=3)
+
+    def _order(self, lines, reserve):
+        order = Order.objects.create(user=self.admin, total_price=100, shipping_address="Somewhere", status="Processing")
+        for product, quantity in lines:
+            OrderDetail.objects.create(order=order, product=product, quantity=quantity, price_at_purchase=100)
+        if reserve:
+            with transaction.atomic():
+                reserve_stock(order, reserve)
+        return order
+
+    def _ship(self, order):
+        return self.client.put(f"/api/orders/order/{order.order_id}/", {"status": "Shipped"}, format="json")
+
+    def test_ships_reserved_and_unreserved_lines(self):
+        order = self._order([(self.reserved_product, 4), (self.loose_product, 2)], reserve=[(self.reserved_product, 4)])
+        self.assertEqual(self._ship(order).status_code, 200)
+
+        self.reserved_product.refresh_from_db()
+        self.loose_product.refresh_from_db()
+        self.assertEqual((self.reserved_product.stock, self.reserved_product.reserved_stock), (6, 0))
+        self.assertEqual((self.loose_product.stock, self.loose_product.reserved_stock), (1, 0))
+        self.assertEqual(order.reservations.get().status, "Committed")
+
+        self.assertEqual(self._ship(order).status_code, 400)  # Already shipped: stock is not taken twice
+        self.reserved_product.refresh_from_db()
+        self.assertEqual(self.reserved_product.stock, 6)
+
+    def test_insufficient_stock_leaves_everything_untouched(self):
+        other = self._order([(self.loose_product, 2)], reserve=[(self.loose_product, 2)])  # Holds 2 of the 3
+        order = self._order([(self.reserved_product, 4), (self.loose_product, 2)], reserve=[(self.reserved_product, 4)])
+
+        response = self._ship(order)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Chisel", response.json()["error"])
+
+        order.refresh_from_db()
+        self.assertEqual(order.status, "Processing")
+        self.assertEqual(list(Product.objects.order_by("product_id").values_list("stock", "reserved_stock")), [(10, 4), (3, 2)])
+        self.assertEqual(order.reservations.get().status, "Active")
+        self.assertEqual(other.reservations.get().status, "Active")
+
+    def test_bulk_ship_is_all_or_nothing(self):
+        orders = [self._order([(self.reserved_product, 2)], reserve=[(self.reserved_product, 2)]) for _ in range(3)]
+        delivered = self._order([(self.loose_product, 1)], reserve=None)
+        Order.objects.filter(pk=delivered.pk).update(status="Delivered")
+        ids = [order.order_id for order in orders]
+
+        response = self.client.post("/api/orders/order/bulk-status/", {"order_ids": ids + [delivered.order_id], "status": "Shipped"}, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([row["order_id"] for row in response.json()["rejected"]], [delivered.order_id])
+        self.assertFalse(Order.objects.filter(status="Shipped").exists())
+
+        response = self.client.post("/api/orders/order/bulk-status/", {"order_ids": ids, "status": "Shipped"}, format="json")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Order.objects.filter(status="Shipped").count(), 3)
+        self.reserved_product.refresh_from_db()
+        self.assertEqual((self.reserved_product.stock, self.reserved_product.reserved_stock), (4, 0))
+        self.assertEqual(AdminNotification.objects.filter(event_type="order_status_update").count(), 3)
+
+
+class SalesRollupTest(TestCase):
+    """The incrementally maintained rollups agree with a rebuild from the orders."""
+
+    def setUp(self):
+        self.admin = CustomUser.objects.create_user("9000000006", "reporter", "reporter@example.com", "pass", role=UserRole.ADMIN)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.products = [Product.objects.create(name=f"Widget {i}", description="-", price=100, stock=100) for i in range(2)]
+
+    def _order(self, quantities):
+        order = Order.objects.create(user=self.admin, total_price=0, shipping_address="Somewhere")
+        for product, quantity in zip(self.products, quantities):
+            OrderDetail.objects.create(order=order, product=product, quantity=quantity, price_at_purchase=Decimal("12.50"))
+        return order
+
+    def _snapshot(self):
+        return (
+            list(DailySalesRollup.objects.order_by("date").values("date", "orders", "units", "revenue", "cancellations")),
+            list(ProductSalesRollup.objects.order_by("date", "product_id").values("date", "product_id", "orders", "units", "revenue", "cancellations")),
+        )
+
+    def test_incremental_rollups_match_rebuild(self):
+        orders = [self._order([1, 2]), self._order([3, 0]), self._order([2, 2]), self._order([1, 1])]
+        for order in orders[:3]:
+            mark_paid(order, "pay_x")
+        mark_failed(orders[3])
+        self.client.put(f"/api/orders/order/{orders[1].order_id}/", {"status": "Cancelled"}, format="json")
+        self.client.post("/api/orders/order/bulk-status/", {"order_ids": [orders[0].order_id, orders[2].order_id], "status": "Shipped"}, format="json")
+
+        incremental = self._snapshot()
+        self.assertEqual(incremental[0][0]["orders"], 2)
+        self.assertEqual(incremental[0][0]["units"], 7)
+        self.assertEqual(incremental[0][0]["revenue"], Decimal("87.50"))
+        self.assertEqual(incremental[0][0]["cancellations"], 1)
+
+        rebuild_sales_rollups()
+        self.assertEqual(self._snapshot(), incremental)
+
+        response = self.client.get("/api/orders/reports/sales/")
+        self.assertEqual(response.json()["totals"]["orders"], 2)
+        self.assertEqual(response.json()["top_products"][0]["product_id"], self.products[1].product_id)
+
+    def test_user_summaries_follow_orders(self):
+        buyer = CustomUser.objects.create_user("9000000007", "regular", "regular@example.com", "pass")
+        with transaction.atomic():
+            orders = [place_order(buyer, "Somewhere", [(self.products[0], quantity)]) for quantity in [1, 2, 3]]
+        mark_paid(orders[0], "pay_a")
+        mark_paid(orders[1], "pay_b")
+        self.client.put(f"/api/orders/order/{orders[1].order_id}/", {"status": "Cancelled"}, format="json")
+
+        summary = UserOrderSummary.objects.values("order_count", "lifetime_value", "last_order_at", "open_orders").get(user=buyer)
+        self.assertEqual(summary["order_count"], 3)
+        self.assertEqual(summary["lifetime_value"], orders[0].total_price)
+        self.assertEqual(summary["open_orders"], 2)  # One paid, one still pending
+        self.assertEqual(summary["last_order_at"], orders[2].created_at)
+
+        rebuild_user_summaries()
+        self.assertEqual(UserOrderSummary.objects.values("order_count", "lifetime_value", "last_order_at", "open_orders").get(user=buyer), summary)
+
+        response = self.client.get("/api/users/admin/list/?ordering=-lifetime_value&min_orders=1")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([row["user_id"] for row in response.json()["results"]], [buyer.user_id])
+
+        response = self.client.get("/api/users/admin/list/?ordering=-order_count")
+        never_ordered = response.json()["results"][-1]
+        self.assertEqual(never_ordered["user_id"], self.admin.user_id)
+        self.assertEqual(
+            [never_ordered[field] for field in ["order_count", "lifetime_value", "last_order_at", "open_orders"]],
+            [0, "0.00", None, 0],
+        )
+        self.assertEqual(self.client.get("/api/users/admin/list/?last_order_after=2024-02-30").status_code, 400)
+
+
+class OrderArchiveTest(TestCase):
+    """Archived orders disappear from `orders` but stay readable and counted."""
+
+    def setUp(self):
+        self.buyer = CustomUser.objects.create_user("9000000008", "regular", "archive@example.com", "pass")
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+        self.product = Product.objects.create(name="Widget", description="-", price=100, stock=100)
+
+    def test_old_closed_orders_move_to_the_archive(self):
+        with transaction.atomic():
+            delivered, pending = [place_order(self.buyer, "Somewhere", [(self.product, 2)]) for _ in range(2)]
+        mark_paid(delivered, "pay_a")
+        Order.objects.filter(order_id=delivered.order_id).update(status="Delivered", updated_at=timezone.now() - timedelta(days=120))
+        rebuild_sales_rollups()
+        rebuild_user_summaries()
+        rollups = list(DailySalesRollup.objects.values("orders", "units", "revenue"))
+        summary = UserOrderSummary.objects.values("order_count", "lifetime_value", "open_orders").get(user=self.buyer)
+
+        self.assertEqual(archive_batch(days=90), 1)
+        self.assertEqual(archive_batch(days=90), 0)
+        self.assertFalse(Order.objects.filter(order_id=delivered.order_id).exists())
+        self.assertTrue(Order.objects.filter(order_id=pending.order_id).exists())
+        archived_line = ArchivedOrder.objects.get().order_details.get()
+        self.assertEqual((archived_line.quantity, archived_line.product_name), (2, "Widget"))  # Snapshot taken by place_order
+
+        response = self.client.get(f"/api/orders/order/{delivered.order_id}/")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()["status"], "Delivered")
+        self.assertEqual(len(response.json()["items"]), 1)
+
+        rebuild_sales_rollups()
+        rebuild_user_summaries()
+        self.assertEqual(list(DailySalesRollup.objects.values("orders", "units", "revenue")), rollups)
+        self.assertEqual(UserOrderSummary.objects.values("order_count", "lifetime_value", "open_orders").get(user=self.buyer), summary)
+
+
+    def test_archiving_releases_stock_still_held(self):
+        with transaction.atomic():
+            failed = place_order(self.buyer, "Somewhere", [(self.product, 3)])
+        mark_failed(failed)  # Archived before release_stock_reservations gets to it
+        Order.objects.filter(order_id=failed.order_id).update(updated_at=timezone.now() - timedelta(days=120))
+
+        self.assertEqual(archive_batch(days=90), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved_stock, 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+
+class OrderTrackingTest(TestCase):
+    """Public tracking is served from a cache that status changes write through."""
+
+    def setUp(self):
+        cache.clear()
+        self.buyer = CustomUser.objects.create_user("9000000011", "regular", "tracker@example.com", "pass")
+        self.product = Product.objects.create(name="Widget", description="-", price=100, stock=10)
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            self.order = place_order(self.buyer, "Somewhere", [(self.product, 1)])
+        self.client = APIClient()
+
+    def test_tracking_is_served_from_cache(self):
+        url = f"/api/orders/track/{self.order.tracking_id}/"
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()["status"], "Pending")
+        self.assertEqual(set(response.json()), {"tracking_id", "status", "placed_at", "updated_at"})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_paid(self.order, "pay_x")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).json()["status"], "Processing")
+
+        # A transition that is rolled back never reaches the cache
+        staff = CustomUser.objects.create_user("9000000017", "staff", "tracking-staff@example.com", "pass", role=UserRole.STAFF)
+        self.client.force_authenticate(staff)
+        release_reservations(self.order.reservations.all())
+        Product.objects.filter(pk=self.product.pk).update(stock=0)  # Nothing left to ship it with
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(f"/api/orders/order/{self.order.order_id}/", {"status": "Shipped"}, format="json")
+        self.assertEqual(response.status_code, 400, response.content)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(url).json()["status"], "Processing")
+
+        Order.objects.filter(pk=self.order.pk).update(status="Delivered", updated_at=timezone.now() - timedelta(days=120))
+        archive_batch(days=90)
+        cache.clear()
+        self.assertEqual(self.client.get(url).json()["status"], "Delivered")  # Cold cache, archived order
+
+        unknown = f"/api/orders/track/{uuid.uuid4()}/"
+        self.assertEqual(self.client.get(unknown).status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(unknown).status_code, 404)
+
+    def test_tracking_is_rate_limited(self):
+        url = f"/api/orders/track/{self.order.tracking_id}/"
+        with mock.patch.dict(TrackingRateThrottle.THROTTLE_RATES, {"tracking": "2/min"}):
+            # A made-up X-Forwarded-For per request does not buy a fresh allowance
+            statuses = [self.client.get(url, HTTP_X_FORWARDED_FOR=f"10.0.0.{i}").status_code for i in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+
+class PaymentStatusTest(TestCase):
+    """Payment status waits (long-poll, SSE) on the ASGI server only, and end cleanly when the order goes away."""
+
+    def setUp(self):
+        self.buyer = CustomUser.objects.create_user("9000000015", "regular", "stream@example.com", "pass")
+        self.order = Order.objects.create(user=self.buyer, total_price=100, shipping_address="Somewhere")
+        self.authorization = f"Bearer {RefreshToken.for_user(self.buyer).access_token}"
+        self.url = f"/api/orders/payment-status/{self.order.order_id}/"
+
+    def _get(self, query):
+        return async_to_sync(AsyncClient().get)(self.url + query, headers={"Authorization": self.authorization})
+
+    def test_wait_returns_once_the_order_is_paid(self):
+        sleeps = []
+
+        async def payment_arrives(seconds):
+            sleeps.append(seconds)
+            await Order.objects.filter(pk=self.order.pk).aupdate(status="Processing")
+
+        with mock.patch("orders.views.asyncio.sleep", payment_arrives):
+            response = self._get("?wait=10")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()["status"], "Processing")
+        self.assertEqual(sleeps, [1])
+
+        self.assertEqual(self._get("?wait=soon").status_code, 400)
+
+    def test_waiting_is_refused_under_wsgi(self):
+        client = APIClient(HTTP_AUTHORIZATION=self.authorization)
+        with mock.patch("orders.views.asyncio.sleep") as sleep:
+            response = client.get(self.url + "?wait=10")
+        self.assertEqual(response.json()["status"], "Pending")  # Answered at once; the client polls again
+        sleep.assert_not_called()
+        self.assertEqual(client.get(self.url + "?stream=sse").status_code, 400)
+
+    def test_stream_reports_an_order_that_disappears(self):
+        response = self._get("?stream=sse")
+        self.assertEqual(response.status_code, 200)
+        Order.objects.filter(pk=self.order.pk).delete()  # e.g. archived before the first event
+
+        async def read(stream):
+            return b"".join([chunk async for chunk in stream])
+
+        body = async_to_sync(read)(response.streaming_content).decode()
+        self.assertEqual(body, 'event: error\ndata: {"error": "Order not found"}\n\n')
+
+
+class InvoiceTest(TestCase):
+    """Invoices are rendered when an order is paid, stored by content hash and re-rendered only when it changes."""
+
+    def setUp(self):
+        invoice_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, invoice_root, ignore_errors=True)
+        settings_override = override_settings(INVOICE_ROOT=invoice_root, INVOICE_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+        self.buyer = CustomUser.objects.create_user("9000000012", "regular", "invoiced@example.com", "pass")
+        self.staff = CustomUser.objects.create_user("9000000013", "staff", "staff13@example.com", "pass", role=UserRole.STAFF)
+        self.product = Product.objects.create(name="Widget", description="-", price=100, stock=10, product_code="W-1")
+        with transaction.atomic():
+            self.order = place_order(self.buyer, "Somewhere", [(self.product, 3)])
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+        self.url = f"/api/orders/order/{self.order.order_id}/invoice/"
+
+    def test_invoice_lifecycle(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)  # Not paid yet
+
+        with self.captureOnCommitCallbacks(execute=True):
+            mark_paid(self.order, "pay_inv")
+        invoice = Invoice.objects.get(order_id=self.order.order_id)
+        self.assertTrue(os.path.exists(os.path.join(settings.INVOICE_ROOT, invoice.file_path)))
+        self.assertIn(invoice.content_hash, invoice.file_path)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], f'"{invoice.content_hash}"')
+        body = response.content.decode()
+        self.assertIn("Widget", body)
+        self.assertIn("@media print", body)
+        self.assertIn("Processing", body)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+        # Nothing changed: no new render
+        self.assertEqual(render_invoice(self.order.order_id).updated_at, invoice.updated_at)
+
+        staff_client = APIClient()
+        staff_client.force_authenticate(self.staff)
+        with self.captureOnCommitCallbacks(execute=True):
+            staff_client.put(f"/api/orders/order/{self.order.order_id}/", {"status": "Shipped"}, format="json")
+        shipped = Invoice.objects.get(order_id=self.order.order_id)
+        self.assertNotEqual(shipped.content_hash, invoice.content_hash)
+        self.assertIn("Shipped", self.client.get(self.url).content.decode())
+
+        other = CustomUser.objects.create_user("9000000014", "regular", "other14@example.com", "pass")
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_archived_order_without_invoice_is_rendered_from_the_archive(self):
+        mark_paid(self.order, "pay_inv")  # Paid without running the render, as if it had failed
+        Order.objects.filter(order_id=self.order.order_id).update(status="Delivered", updated_at=timezone.now() - timedelta(days=120))
+        archive_batch(days=90)
+        self.assertFalse(Order.objects.filter(order_id=self.order.order_id).exists())
+        self.assertFalse(Invoice.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.get(self.url).status_code, 202)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Widget", response.content.decode())
+        self.assertIn("Delivered", response.content.decode())
+
+
+class OrderLinesExportTest(TestCase):
+    """The accounting export streams one flat row per line, live and archived, within the filters."""
+
+    def setUp(self):
+        self.admin = CustomUser.objects.create_user("9000000012", "admin", "export-admin@example.com", "pass", role=UserRole.ADMIN)
+        self.buyer = CustomUser.objects.create_user("9000000013", "buyer", "export@example.com", "pass")
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.widget = Product.objects.create(name="Widget", description="-", price=100, stock=100)
+        self.gadget = Product.objects.create(name="Gadget", description="-", price=250, stock=100)
+
+    def test_export_streams_lines_with_filters(self):
+        with transaction.atomic():
+            archived = place_order(self.buyer, "Somewhere", [(self.widget, 1)])
+            paid = place_order(self.buyer, "Somewhere", [(self.widget, 2), (self.gadget, 1)])
+            place_order(self.buyer, "Somewhere", [(self.gadget, 3)])  # Left pending
+        mark_paid(archived, "pay_a")
+        mark_paid(paid, "pay_b")
+        Order.objects.filter(order_id=archived.order_id).update(status="Delivered", updated_at=timezone.now() - timedelta(days=120))
+        archive_batch(days=90)
+
+        response = self.client.get("/api/orders/export/order-lines/?status=Processing,Delivered")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="order-lines.csv"')
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(",")[:3], ["order_id", "order_created_at", "order_status"])
+        self.assertEqual(len(lines), 4)  # Header, the archived line, then the two paid lines
+        self.assertTrue(lines[1].startswith(f"{archived.order_id},"))
+
+        response = self.client.get(f"/api/orders/export/order-lines/?export=ndjson&status=Processing&month={timezone.now():%Y-%m}")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row["product_name"], row["quantity"], Decimal(row["line_total"])) for row in rows], [("Widget", 2, 200), ("Gadget", 1, 250)])
+        self.assertEqual((rows[0]["username"], rows[0]["razorpay_payment_id"], rows[0]["order_total"]), ("buyer", "pay_b", str(paid.total_price)))
+
+        self.assertEqual(self.client.get("/api/orders/export/order-lines/?month=2024-13").status_code, 400)
+        self.assertEqual(self.client.get("/api/orders/export/order-lines/?created_after=2024-02-30").status_code, 400)
+        self.assertEqual(self.client.get("/api/orders/export/order-lines/?export=xlsx").status_code, 400)
+        self.client.force_authenticate(self.buyer)
+        self.assertEqual(self.client.get("/api/orders/export/order-lines/").status_code, 403)
@@ -0,0 +1,13 @@
+# orders/throttles.py
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class TrackingRateThrottle(SimpleRateThrottle):
+    """
+    Limits the public tracking endpoint per client IP, logged in or not.
+    The IP is REMOTE_ADDR unless NUM_PROXIES says which X-Forwarded-For entry to trust.
+    """
+    scope = "tracking"
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {"scope": self.scope, "ident": self.get_ident(request)}
@@ -0,0 +1,56 @@
+# orders/tracking.py
+"""
+What the public tracking page shows for a tracking_id, kept in the cache.
+
+Entries are written through by record_status_changes on every status
+change (including the order being placed), so tracking requests are served
+from the cache and only a cold entry falls back to the database. That only
+reaches every process through a shared cache (REDIS_URL); with per-process
+memory, TRACKING_CACHE_TIMEOUT defaults to a minute to bound staleness.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import ArchivedOrder, Order
+
+TRACKING_FIELDS = ["tracking_id", "status", "created_at", "updated_at"]
+NOT_FOUND = "not-found"  # Cached briefly, so guessed IDs do not reach the database on every request
+
+
+def tracking_key(tracking_id):
+    return f"tracking:{tracking_id}"
+
+
+def _tracking_data(row):
+    return {
+        "tracking_id": str(row["tracking_id"]),
+        "status": row["status"],
+        "placed_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+
+
+def refresh_tracking(order_ids):
+    """Rewrite the cached tracking entries of these orders, with one query."""
+    rows = Order.objects.filter(order_id__in=order_ids).values(*TRACKING_FIELDS)
+    cache.set_many(
+        {tracking_key(row["tracking_id"]): _tracking_data(row) for row in rows},
+        settings.TRACKING_CACHE_TIMEOUT,
+    )
+
+
+def get_tracking(tracking_id):
+    """The tracking entry for `tracking_id`, or None if no order (live or archived) has it."""
+    key = tracking_key(tracking_id)
+    data = cache.get(key)
+    if data is None:
+        row = (
+            Order.objects.filter(tracking_id=tracking_id).values(*TRACKING_FIELDS).first()
+            or ArchivedOrder.objects.filter(tracking_id=tracking_id).values(*TRACKING_FIELDS).first()
+        )
+        if row is None:
+            cache.set(key, NOT_FOUND, settings.TRACKING_NOT_FOUND_CACHE_TIMEOUT)
+            return None
+        data = _tracking_data(row)
+        cache.set(key, data, settings.TRACKING_CACHE_TIMEOUT)
+    return None if data == NOT_FOUND else data
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CartViewSet, OrderViewSet, UserOrdersViewSet, payment_webhook, razorpay_webhook, all_orders
+from .views import CartViewSet, OrderViewSet, UserOrdersViewSet, payment_webhook, razorpay_webhook, all_orders, checkout, payment_status, gateway_metrics, sales_report, track_order, export_order_lines
 
 router = DefaultRouter()
 router.register(r'cart', CartViewSet, basename='cart')
@@ -9,6 +9,12 @@ router.register(r'order', OrderViewSet, basename='order')
 urlpatterns = [
     path("", include(router.urls)),  
     path("all/", all_orders, name="all_orders"),
+    path("checkout/", checkout, name="checkout"),  # Buy now: order + payment link in one call
+    path("payment-status/<int:order_id>/", payment_status, name="payment_status"),  # Async long-poll / SSE
+    path("export/order-lines/", export_order_lines, name="export_order_lines"),  # Streamed CSV / NDJSON for accounting
+    path("reports/sales/", sales_report, name="sales_report"),  # Served from the sales rollup tables
+    path("track/<uuid:tracking_id>/", track_order, name="track_order"),  # Public, cached, rate limited
+    path("gateway-metrics/", gateway_metrics, name="gateway_metrics"),  # Razorpay latency/errors per operation
     path('users/<int:pk>/', UserOrdersViewSet.as_view({'get': 'user_orders'}), name='user-orders-detail'),
     path("payment-webhook/", payment_webhook, name="payment_webhook"),  # GET callback redirect
     path("razorpay-webhook/", razorpay_webhook, name="razorpay_webhook"),  # POST webhook from Razorpay
@@ -0,0 +1,110 @@
+from datetime import datetime, time, timedelta
+
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .models import CartItem, Order, OrderDetail
+
+
+def upsert_cart_items(cart, quantities):
+    """
+    Insert or reactivate cart lines in a single statement.
+
+    `quantities` maps product_id -> quantity. Relies on the (cart, product)
+    unique constraint, so a line that already exists has its quantity
+    replaced and is reactivated instead of being duplicated.
+    """
+    return CartItem.objects.bulk_create(
+        [
+            CartItem(cart=cart, product_id=product_id, quantity=quantity, is_active=True)
+            for product_id, quantity in quantities.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["cart", "product"],
+        update_fields=["quantity", "is_active"],
+    )
+
+
+def clear_purchased_cart_items(order):
+    """Deactivate the buyer's cart lines for the products bought in this order."""
+    return CartItem.objects.filter(
+        cart__user_id=order.user_id,
+        product_id__in=order.order_details.values("product_id"),
+        is_active=True,
+    ).update(is_active=False)
+
+
+def clear_purchased_cart_items_for_orders(order_ids):
+    """clear_purchased_cart_items for many orders in one UPDATE."""
+    bought = OrderDetail.objects.filter(
+        order_id__in=order_ids,
+        order__user_id=OuterRef("cart__user_id"),
+        product_id=OuterRef("product_id"),
+    )
+    return CartItem.objects.filter(Exists(bought), is_active=True).update(is_active=False)
+
+
+def parse_product_id(value):
+    """A product ID from request data (an int or a numeric string), or None if it is not one."""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+
+def _parse_bound(value, end_of_day=False):
+    """Parse a date or datetime query param into an aware datetime."""
+    try:
+        # Dates first: parse_datetime also accepts a bare date, as midnight, which would cut off an inclusive end day
+        day = parse_date(value)
+        parsed = parse_datetime(value) if day is None else datetime.combine(day, time.max if end_of_day else time.min)
+    except ValueError:  # Well formed but impossible, e.g. 2024-02-30
+        parsed = None
+    if parsed is None:
+        raise ValidationError({"error": f"Invalid date: {value}"})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def filter_orders(queryset, params):
+    """
+    Apply the admin listing filters from query params:
+    status (comma separated), user (user ID), created_after / created_before
+    (dates are inclusive; datetimes are exact bounds), month (YYYY-MM).
+    Works on Order and ArchivedOrder querysets alike.
+    """
+    statuses = [value for value in params.get("status", "").split(",") if value]
+    if statuses:
+        valid = dict(Order.STATUS_CHOICES)
+        unknown = [value for value in statuses if value not in valid]
+        if unknown:
+            raise ValidationError({"error": f"Unknown status: {', '.join(unknown)}"})
+        queryset = queryset.filter(status__in=statuses)
+
+    user_id = params.get("user")
+    if user_id:
+        if not user_id.isdigit():
+            raise ValidationError({"error": "user must be a user ID"})
+        queryset = queryset.filter(user_id=user_id)
+
+    month = params.get("month")
+    if month:
+        try:
+            first_day = datetime.strptime(month, "%Y-%m").date()
+        except ValueError:
+            raise ValidationError({"error": "month must be YYYY-MM"})
+        next_month = (first_day.replace(day=28) + timedelta(days=4)).replace(day=1)
+        queryset = queryset.filter(
+            created_at__gte=_parse_bound(first_day.isoformat()),
+            created_at__lt=_parse_bound(next_month.isoformat()),
+        )
+
+    if params.get("created_after"):
+        queryset = queryset.filter(created_at__gte=_parse_bound(params["created_after"]))
+    if params.get("created_before"):
+        queryset = queryset.filter(created_at__lte=_parse_bound(params["created_before"], end_of_day=True))
+    return queryset
@@ -3,26 +3,53 @@ from django.db import transaction
 from rest_framework import viewsets, status, generics
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from .models import Order, OrderDetail, Cart, CartItem
+from .models import Order, OrderDetail, Cart, CartItem, DailySalesRollup, ProductSalesRollup, ArchivedOrder, ArchivedOrderDetail, Invoice
+from .rollups import ROLLUP_FIELDS
+from .utils import upsert_cart_items, filter_orders, parse_product_id
+from .exports import CHUNK_SIZE, ORDER_LINE_EXPORT_FIELDS, export_response, order_line_rows
+from .idempotency import idempotent
+from .invoices import INVOICED_STATUSES, invoice_source, read_invoice, schedule_invoices
+from .throttles import TrackingRateThrottle
+from .tracking import get_tracking
+from .payments import mark_paid, mark_failed
+from . import gateway
+from .webhooks import store_event
+from .checkout import place_order
+from .outbox import enqueue_payment_link, run_payment_link_job
+from .reservations import InsufficientStock, release_reservations, ship_order_stock
+from .status import BULK_TRANSITIONS, TRANSITIONS, TransitionError, bulk_transition, transition
 from products.models import Product
-from .serializers import CartItemSerializer, OrderSerializer, CartSerializer, OrderDetailSerializer
-from rest_framework.decorators import action, permission_classes, api_view
+from products.serializers import product_details_queryset
+from .serializers import CartItemSerializer, OrderSerializer, OrderListSerializer, OrderHistorySerializer, CartSerializer, OrderLineSerializer, with_order_details, with_order_lines
+from rest_framework.decorators import action, authentication_classes, permission_classes, api_view, throttle_classes
 from users.permissions import IsAdminOrStaff,IsAdminUser
 from users.serializers import UserSerializer
 from django.shortcuts import get_object_or_404
 from users.models import CustomUser, UserRole
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+import asyncio
+import itertools
+import time
 from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_cache_control
 from django.views.decorators.csrf import csrf_exempt
 import hmac
 import hashlib
 import json
 from ecommerce.logger import logger
-from django.db.models import F
+from django.db.models import F, Prefetch, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from datetime import timedelta
 from django.core.mail import send_mail
-import time
 from users.utils import create_admin_notification
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 
 from razorpay.errors import BadRequestError, ServerError
 import razorpay
@@ -33,6 +60,13 @@ class CartItemPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 20
 
+class OrderCursorPagination(CursorPagination):
+    # Keyset pages stay fast however deep the client goes; order_id breaks created_at ties
+    ordering = ("-created_at", "-order_id")
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
 class CartViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = CartSerializer
@@ -41,29 +75,20 @@ class CartViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         """
-        Return the cart with only active cart items for the user.
+        Return the active items in the user's cart with their product details prefetched.
         """
-        cart = Cart.objects.filter(user=self.request.user).first()
-        
-        if not cart:
-            return Cart.objects.none()
-
-        # Ensure only active cart items are included
-        cart_items = cart.cartitem_set.filter(is_active=True)
-
-        # Attach request context to each cart item
-        for item in cart_items:
-            item.request = self.request
-
-        return Cart.objects.filter(user=self.request.user)
+        return CartItem.objects.filter(cart__user=self.request.user, is_active=True).prefetch_related(
+            Prefetch("product", queryset=product_details_queryset())
+        ).order_by("id")
 
     def list(self, request, *args, **kwargs):
         """
-        List the user's cart with active items and product images.
+        List the active items in the user's cart (paginated) with product images.
         """
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True, context={'request': request})
-        return Response(serializer.data)
+        cart_items = self.get_queryset()
+        page = self.paginate_queryset(cart_items)
+        serializer = CartItemSerializer(page, many=True, context={'request': request})
+        return self.get_paginated_response(serializer.data)
 
     def retrieve(self, request, *args, **kwargs):
         """
@@ -77,46 +102,44 @@ class CartViewSet(viewsets.ModelViewSet):
         # Return the CartItem data serialized using CartItemSerializer
         return Response(CartItemSerializer(cart_item,context={'request': request}).data)
 
+    @idempotent("cart.create")
     def create(self, request, *args, **kwargs):
-        """ Create cart and add items """
+        """
+        Create cart and add items.
+        Items already in the cart (active or not) get the new quantity instead of a duplicate row.
+        """
         user = request.user
         products = request.data.get("products", [])
 
         # Create Cart for the user if it doesn't exist
         cart, created = Cart.objects.get_or_create(user=user)
 
+        # Look up every requested product in one query
+        requested = {}
         for product_data in products:
-            product_id = product_data.get("product")  
+            product_id = parse_product_id(product_data.get("product"))
+            if product_id is None:
+                return Response({"error": "Product not found"}, status=status.HTTP_400_BAD_REQUEST)
             quantity = product_data.get("quantity", 1)
-
-            # Ensure the product exists
-            try:
-                product = Product.objects.get(product_id=product_id, is_active = True)  
-            except Product.DoesNotExist:
+            if not isinstance(quantity, int) or quantity < 1:
+                return Response({"error": "Quantity must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
+            requested[product_id] = quantity
+        available_products = Product.objects.filter(product_id__in=requested.keys(), is_active=True).in_bulk()
+
+        quantities = {}
+        for product_id, quantity in requested.items():
+            product = available_products.get(product_id)
+            if not product:
                 return Response({"error": "Product not found"}, status=status.HTTP_400_BAD_REQUEST)
 
             # Validate stock before adding
-            if quantity > product.stock:
-                return Response({"error": f"Only {product.stock} available for {product.name}"}, status=status.HTTP_400_BAD_REQUEST)
-
-            # Check if item exists in cart
-            existing_cart_item = CartItem.objects.filter(cart=cart, product=product).first()
-
-            if existing_cart_item:
-                if existing_cart_item.is_active:
-                    return Response({
-                        "error": f"{product.name} is already in the cart",
-                        "cart_item_id": existing_cart_item.id
-                    }, status=status.HTTP_400_BAD_REQUEST)
-                elif quantity > product.stock:
-                    return Response({"error": f"Only {product.stock} available for {product.name}"}, status=status.HTTP_400_BAD_REQUEST)
-                else:
-                    existing_cart_item.quantity = quantity
-                    existing_cart_item.is_active = True
-                    existing_cart_item.save()
-            else:
-                # Create new cart item
-                CartItem.objects.create(cart=cart, product=product, quantity=quantity, is_active=True)
+            if quantity > product.available_stock:
+                return Response({"error": f"Only {product.available_stock} available for {product.name}"}, status=status.HTTP_400_BAD_REQUEST)
+            quantities[product.product_id] = quantity
+
+        # Insert new lines and reactivate existing ones in a single statement
+        if quantities:
+            upsert_cart_items(cart, quantities)
         return Response(CartSerializer(cart,context={'request': request}).data, status=status.HTTP_201_CREATED)
 
 
@@ -126,7 +149,7 @@ class CartViewSet(viewsets.ModelViewSet):
         Update cart item quantity.
         If quantity is set to 0, soft delete the cart item.
         """
-        cart_item = CartItem.objects.filter(id=kwargs['pk'], cart__user=request.user).first()
+        cart_item = CartItem.objects.select_related("cart", "product").filter(id=kwargs['pk'], cart__user=request.user).first()
 
         if not cart_item:
             return Response({"error": "Cart item not found"}, status=status.HTTP_404_NOT_FOUND)
@@ -143,14 +166,15 @@ class CartViewSet(viewsets.ModelViewSet):
             return Response({"message": "Cart item marked as inactive"}, status=status.HTTP_200_OK)
 
         # Check if requested quantity exceeds stock
-        if quantity > cart_item.product.stock:
+        if quantity > cart_item.product.available_stock:
             return Response(
-                {"error": f"Only {cart_item.product.stock} items available for {cart_item.product.name}"},
+                {"error": f"Only {cart_item.product.available_stock} items available for {cart_item.product.name}"},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        upsert_cart_items(cart_item.cart, {cart_item.product_id: quantity})
         cart_item.quantity = quantity
-        cart_item.save()
+        cart_item.is_active = True
 
         return Response(CartItemSerializer(cart_item,context={'request': request}).data, status=status.HTTP_200_OK)
 
@@ -174,6 +198,8 @@ class CartViewSet(viewsets.ModelViewSet):
         # Return success response
         return Response({"message": "Cart item marked as inactive"}, status=status.HTTP_204_NO_CONTENT)
 
+BULK_STATUS_MAX_ORDERS = 1000
+
 class OrderViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = OrderSerializer
@@ -182,82 +208,65 @@ class OrderViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         user = self.request.user
         if user.role in [UserRole.ADMIN, UserRole.STAFF]:
-            return Order.objects.all().order_by("-created_at")  # Admins can see all orders
-        return Order.objects.filter(user=user).order_by("-created_at")  # Users see only their own orders
+            orders = Order.objects.all().order_by("-created_at")  # Admins can see all orders
+        else:
+            orders = Order.objects.filter(user=user).order_by("-created_at")  # Users see only their own orders
+        if self.action == "list":
+            orders = with_order_lines(orders) if self.lines_only() else with_order_details(orders)
+        return orders
+
+    def lines_only(self):
+        """?detail=lines renders the order history from the line snapshots alone, without the catalog."""
+        return self.request.query_params.get("detail") == "lines"
 
-    @transaction.atomic
+    def get_serializer_class(self):
+        if self.action == "list" and self.lines_only():
+            return OrderHistorySerializer
+        return super().get_serializer_class()
+
+    @idempotent("order.create")
     def create(self, request):
-        """Create an order and generate a Razorpay Payment Link."""
+        """Create an order from the cart and generate a Razorpay Payment Link."""
         user = request.user
-        cart = Cart.objects.filter(user=user).first()
-        cart_items = CartItem.objects.filter(cart=cart, is_active=True)
+        # Load the active cart lines and their products in one query
+        cart_items = list(CartItem.objects.filter(cart__user=user, is_active=True).select_related("product"))
 
-        if not cart or not cart_items.exists():
+        if not cart_items:
             return Response({"error": "Cart is empty"}, status=status.HTTP_400_BAD_REQUEST)
 
         shipping_address = request.data.get("shipping_address")
         if not shipping_address:
             return Response({"error": "Shipping address is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        total_price =sum(item.product.offer_price * item.quantity for item in cart_items)
-        client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-
         try:
-            # Create order in the database but keep it pending
-            order = Order.objects.create(
-                user=user,
-                total_price=total_price,
-                shipping_address=shipping_address,
-                status="Pending"
-            )
+            with transaction.atomic():
+                # Create the pending order, bulk insert its details, reserve the stock
+                # and queue the payment link, all in one short transaction
+                order = place_order(user, shipping_address, [(item.product, item.quantity) for item in cart_items])
+                job = enqueue_payment_link(order)
 
-            # Move Cart Items to OrderDetail (without modifying stock)
-            for item in cart_items:
-                OrderDetail.objects.create(
-                    order=order,
-                    product=item.product,
-                    quantity=item.quantity,
-                    price_at_purchase=item.product.offer_price
+                # ✅ Notify admin about new order
+                create_admin_notification(
+                    title="order_creation",
+                    user=request.user,
+                    message=f"New order placed: {order.order_id} (Total: ₹{order.total_price})",
+                    event_type="order_created"
                 )
-
-            # Create a Razorpay Payment Link
-            payment_link = client.payment_link.create({
-                "amount": int(total_price * 100),  # Convert to paise
-                "currency": "INR",
-                "description": f"Order #{order.order_id} Payment",
-                "customer": {
-                    "name": user.username,
-                    "email": user.email,
-                    "contact": user.phone_number,  # Ensure phone number is available
-                }
-            })
-
-            # Save Razorpay payment link ID
-            order.razorpay_payment_link_id = payment_link["id"]
-            order.save()
-            
-            # ✅ Notify admin about new order
-            create_admin_notification(
-                title="order_creation",
-                user=request.user,
-                message=f"New order placed: {order.order_id} (Total: ₹{total_price})",
-                event_type="order_created"
-            )
-
-            return Response({
-                "order_id": order.order_id,
-                "payment_link_id" : payment_link["id"],
-                "payment_link": payment_link["short_url"]
-            }, status=status.HTTP_201_CREATED)
-
+        except InsufficientStock as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+        # The order is committed; call Razorpay without holding any database lock
+        payment_link = run_payment_link_job(job.job_id, timeout=settings.PAYMENT_LINK_REQUEST_TIMEOUT)
+        return order_placed_response(order, payment_link)
+
     @action(detail=False, methods=["POST"])
     def verify(self, request):
-        """Verify payment and update order status"""
-        client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-
+        """
+        Check the payment once and return the order's current state without waiting.
+        Pending payments answer 202; use payment-status/<order_id>/ to wait for a change.
+        """
         razorpay_payment_id = request.data.get("razorpay_payment_id")
         razorpay_payment_link_id = request.data.get("razorpay_payment_link_id")
 
@@ -265,57 +274,153 @@ class OrderViewSet(viewsets.ModelViewSet):
         if not order:
             return Response({"error": "Order not found or inactive"}, status=status.HTTP_404_NOT_FOUND)
 
+        # Already settled by the webhook or the poller: no need to ask Razorpay again
+        if order.status == "Failed":
+            return Response({"error": "Payment failed", "status": order.status}, status=status.HTTP_400_BAD_REQUEST)
+        if order.status != "Pending":
+            return Response({"message": "Payment verified successfully", "status": order.status}, status=status.HTTP_200_OK)
+
         try:
             # If payment ID is not provided, fetch the latest one using payment link
             if not razorpay_payment_id:
-                payments_response = client.payment_link.fetch(razorpay_payment_link_id)
-                payments = payments_response.get("payments", [])
+                payments_response = gateway.fetch_payment_link(razorpay_payment_link_id)
+                payments = payments_response.get("payments") or []
 
                 if not payments:
-                    return Response({"error": "No payments found for this link"}, status=status.HTTP_400_BAD_REQUEST)
+                    return Response({"message": "No payments yet for this link", "status": order.status}, status=status.HTTP_202_ACCEPTED)
 
                 logger.info(f"payments:{payments[0]}")
                 razorpay_payment_id = payments[0]["payment_id"]  # Get the latest payment ID
 
-            # Poll Razorpay API up to 5 times to check payment status
-            for _ in range(5):
-                payment = client.payment.fetch(razorpay_payment_id)
-                logger.info(f"Payment status at the moment is {payment['status']} for payment id : {razorpay_payment_id}")
-
-                if payment["status"] == "captured":
-                    order.status = "Processing"
-                    order.razorpay_payment_id = razorpay_payment_id
-                    order.save()
-
-                    # Mark cart items as inactive
-                    CartItem.objects.filter(cart__user=order.user, is_active=True).update(is_active=False)
+            payment = gateway.fetch_payment(razorpay_payment_id)
+            logger.info(f"Payment status at the moment is {payment['status']} for payment id : {razorpay_payment_id}")
 
-                    return Response({"message": "Payment verified successfully"}, status=status.HTTP_200_OK)
+            if payment["status"] == "captured":
+                mark_paid(order, razorpay_payment_id)
+                return Response({"message": "Payment verified successfully", "status": order.status}, status=status.HTTP_200_OK)
 
-                elif payment["status"] in ["failed", "refunded"]:
-                    order.status = "Failed"
-                    order.razorpay_payment_id = razorpay_payment_id
-                    order.save()
-                    return Response({"error": f"Payment {payment['status']}"}, status=status.HTTP_400_BAD_REQUEST)
+            elif payment["status"] in ["failed", "refunded"]:
+                mark_failed(order, razorpay_payment_id)
+                return Response({"error": f"Payment {payment['status']}", "status": order.status}, status=status.HTTP_400_BAD_REQUEST)
 
-                time.sleep(3)  # Wait 3 seconds before retrying
-
-            return Response({"error": "Payment still pending"}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({"message": "Payment still pending", "status": order.status}, status=status.HTTP_202_ACCEPTED)
 
         except razorpay.errors.BadRequestError:
             return Response({"error": "Invalid payment details"}, status=status.HTTP_400_BAD_REQUEST)
+        except gateway.GatewayUnavailable:
+            return Response({"message": "Payment gateway unavailable, status will be updated shortly", "status": order.status}, status=status.HTTP_202_ACCEPTED)
+
+    def get_archived_order(self, pk):
+        """An order moved out by archive_orders, visible to its buyer and to admins/staff."""
+        archived = ArchivedOrder.objects.all()
+        if self.request.user.role not in [UserRole.ADMIN, UserRole.STAFF]:
+            archived = archived.filter(user=self.request.user)
+        return get_object_or_404(archived, order_id=pk)
 
     def retrieve(self, request, *args, **kwargs):
-        order = self.get_object()
-        order_details = order.order_details.filter(is_active=True)
+        """
+        The order as it was bought: the stored total and each line's
+        snapshot (name, code, thumbnail, price_at_purchase), never the
+        products' current state. Since nothing in it reads the catalog, the
+        rendered order is cached under a key that changes only when the order
+        is saved, so a cache hit costs only the order lookup. Orders moved out
+        by archive_orders are served from the archive tables.
+        """
+        try:
+            order = self.get_object()
+            detail_model = OrderDetail
+        except Http404:
+            order = self.get_archived_order(kwargs["pk"])
+            detail_model = ArchivedOrderDetail
 
-        return Response({
-            "order_id": order.order_id,
-            "total_price":  sum(detail.product.offer_price * detail.quantity for detail in  order_details),
-            "status": order.status,
-            "shipping_address": order.shipping_address,
-            "items": OrderDetailSerializer(order_details, context={"request": request}, many=True).data
-        })
+        cache_key = f"order:{order.order_id}:{order.status}:{order.updated_at.timestamp()}:{request.get_host()}"
+        data = cache.get(cache_key)
+
+        if data is None:
+            data = {
+                "order_id": order.order_id,
+                "total_price": order.total_price,
+                "status": order.status,
+                "shipping_address": order.shipping_address,
+                "payment_link_id": order.razorpay_payment_link_id,
+                "payment_link": order.razorpay_payment_link_url,
+                "items": OrderLineSerializer(
+                    detail_model.objects.filter(order=order, is_active=True).order_by("order_detail_id"),
+                    context={"request": request}, many=True,
+                ).data
+            }
+            cache.set(cache_key, data, settings.ORDER_CACHE_TIMEOUT)
+
+        return Response(data)
+
+    @action(detail=True, methods=["GET"])
+    def invoice(self, request, pk=None):
+        """
+        The order's invoice as printable HTML. It is rendered in the background
+        once the order is paid (202 until it exists). The ETag is the
+        document's content hash, so a client holding the current copy gets 304.
+        """
+        try:
+            order = self.get_object()
+        except Http404:
+            order = self.get_archived_order(pk)
+
+        invoice = Invoice.objects.filter(order_id=order.order_id).first()
+        if invoice is None:
+            if order.status not in INVOICED_STATUSES:
+                return Response({"error": "An invoice is issued once the order is paid"}, status=status.HTTP_400_BAD_REQUEST)
+            schedule_invoices([order.order_id])
+            return Response({"message": "The invoice is being generated, try again shortly"}, status=status.HTTP_202_ACCEPTED)
+        if isinstance(order, Order) and invoice.source != invoice_source(order):
+            schedule_invoices([order.order_id])  # Behind the order; the previous copy is served meanwhile
+
+        etag = f'"{invoice.content_hash}"'
+        if etag in request.headers.get("If-None-Match", ""):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            cache_key = f"invoice:{invoice.content_hash}"  # Content-addressed, so never stale
+            content = cache.get(cache_key)
+            if content is None:
+                content = read_invoice(invoice)
+                cache.set(cache_key, content, settings.INVOICE_CACHE_TIMEOUT)
+            response = HttpResponse(content, content_type="text/html; charset=utf-8")
+            response["Content-Disposition"] = f'inline; filename="invoice-{order.order_id}.html"'
+        response["ETag"] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    @action(detail=False, methods=["POST"], url_path="bulk-status", permission_classes=[IsAuthenticated, IsAdminOrStaff])
+    def bulk_status(self, request):
+        """
+        Move many orders to one status in a single request (warehouse batches).
+        Expects {"order_ids": [...], "status": "Shipped" | "Delivered" | "Cancelled"}.
+        Either every order is updated or none is.
+        """
+        order_ids = request.data.get("order_ids") or []
+        new_status = request.data.get("status")
+
+        if new_status not in BULK_TRANSITIONS:
+            return Response({"error": f"Status must be one of: {', '.join(BULK_TRANSITIONS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        if not order_ids or not all(isinstance(order_id, int) for order_id in order_ids):
+            return Response({"error": "order_ids must be a non-empty list of order IDs"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(order_ids) > BULK_STATUS_MAX_ORDERS:
+            return Response({"error": f"At most {BULK_STATUS_MAX_ORDERS} orders per request"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            updated = bulk_transition(order_ids, new_status)
+        except TransitionError as e:
+            return Response({"error": str(e), "rejected": e.rejected}, status=status.HTTP_400_BAD_REQUEST)
+        except InsufficientStock as e:
+            return Response({"error": f"Cannot ship orders: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"message": f"{updated} order(s) updated to '{new_status}'.", "updated": updated})
+
+    def transition_conflict(self, order, new_status):
+        """Another request changed the order's status between our read and our write."""
+        return Response(
+            {"error": f"Order {order.order_id} was changed to '{order.status}' meanwhile, it cannot become '{new_status}'", "status": order.status},
+            status=status.HTTP_409_CONFLICT,
+        )
 
     def update(self, request, pk=None):
         """Update order status, including handling order cancellations."""
@@ -326,13 +431,22 @@ class OrderViewSet(viewsets.ModelViewSet):
         if not order.is_active:
             return Response({"error": "Cannot update an inactive order"}, status=status.HTTP_400_BAD_REQUEST)
 
+        # Processing and Failed are only ever set by the payment paths
+        if new_status not in ["Cancelled", "Shipped", "Delivered"]:
+            return Response({"error": "Invalid status update"}, status=status.HTTP_400_BAD_REQUEST)
+        if new_status != "Cancelled":  # Customers may only cancel
+            self.permission_classes = [IsAdminOrStaff]
+            self.check_permissions(request)
+
         if new_status == "Cancelled":
-            if previous_status in ["Shipped", "Delivered"]:
+            if previous_status not in TRANSITIONS["Cancelled"]:
                 return Response({"error": "Order cannot be cancelled at this stage"}, status=status.HTTP_400_BAD_REQUEST)
 
-            order.status = "Cancelled"
-            order.is_active = False
-            order.save()
+            # One transaction, so a cancelled order never keeps its stock held, nor is stock released for a live one
+            with transaction.atomic():
+                if not transition(order, "Cancelled", is_active=False):
+                    return self.transition_conflict(order, new_status)
+                release_reservations(order.reservations.all())
             # ✅ Notify admin about cancellation
             create_admin_notification(
                 title="order_cancelation",
@@ -353,25 +467,22 @@ class OrderViewSet(viewsets.ModelViewSet):
 
             return Response({"message": "Order cancelled successfully."}, status=status.HTTP_200_OK)
 
-        elif new_status == "Shipped":
-            self.permission_classes = [IsAdminOrStaff]
-            self.check_permissions(request)
-            order.status = "Shipped"
-
-            # Reduce stock once order is shipped
-            for item in order.order_details.all():
-                item.product.stock = F("stock") - item.quantity
-                item.product.save()
+        if previous_status not in TRANSITIONS[new_status]:
+            return Response({"error": f"Order cannot be {new_status.lower()}, it is {previous_status}"}, status=status.HTTP_400_BAD_REQUEST)
 
-        elif new_status == "Delivered":
-            self.permission_classes = [IsAdminOrStaff]
-            self.check_permissions(request)
-            order.status = "Delivered"
+        if new_status == "Shipped":
+            # The conditional UPDATE holds the order's row until the stock is taken, so it cannot ship twice
+            try:
+                with transaction.atomic():
+                    if not transition(order, "Shipped"):
+                        return self.transition_conflict(order, new_status)
+                    ship_order_stock([order.order_id])
+            except InsufficientStock as e:
+                return Response({"error": f"Cannot ship order {order.order_id}: {e}"}, status=status.HTTP_400_BAD_REQUEST)
 
-        else:
-            return Response({"error": "Invalid status update"}, status=status.HTTP_400_BAD_REQUEST)
+        elif not transition(order, new_status):
+            return self.transition_conflict(order, new_status)
 
-        order.save()
         # ✅ Notify admin about status update
         create_admin_notification(
             title="order_status",
@@ -382,6 +493,168 @@ class OrderViewSet(viewsets.ModelViewSet):
         return Response(OrderSerializer(order, context={"request": request}).data)
 
 
+@api_view(["POST"])
+@permission_classes([IsAuthenticated])
+@idempotent("checkout")
+def checkout(request):
+    """
+    "Buy now": validate stock, create the order with its details and the
+    Razorpay Payment Link in a single request, without going through the cart.
+    Expects {"items": [{"product": <id>, "quantity": <n>}], "shipping_address": "..."}.
+    """
+    user = request.user
+    items = request.data.get("items", [])
+    shipping_address = request.data.get("shipping_address") or user.default_shipping_address
+
+    if not items:
+        return Response({"error": "No items provided"}, status=status.HTTP_400_BAD_REQUEST)
+    if not shipping_address:
+        return Response({"error": "Shipping address is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Look up every product in one query
+    requested = {}
+    for item in items:
+        quantity = item.get("quantity", 1)
+        if not isinstance(quantity, int) or quantity < 1:
+            return Response({"error": "Quantity must be a positive integer"}, status=status.HTTP_400_BAD_REQUEST)
+        product_id = parse_product_id(item.get("product"))
+        if product_id is None:
+            return Response({"error": "Product not found"}, status=status.HTTP_400_BAD_REQUEST)
+        requested[product_id] = requested.get(product_id, 0) + quantity
+    products = Product.objects.filter(product_id__in=requested.keys(), is_active=True).in_bulk()
+
+    lines = []
+    for product_id, quantity in requested.items():
+        product = products.get(product_id)
+        if not product:
+            return Response({"error": "Product not found"}, status=status.HTTP_400_BAD_REQUEST)
+        if quantity > product.available_stock:
+            return Response({"error": f"Only {product.available_stock} available for {product.name}"}, status=status.HTTP_400_BAD_REQUEST)
+        lines.append((product, quantity))
+
+    try:
+        with transaction.atomic():
+            order = place_order(user, shipping_address, lines)
+            job = enqueue_payment_link(order)
+
+            # ✅ Notify admin about new order
+            create_admin_notification(
+                title="order_creation",
+                user=user,
+                message=f"New order placed: {order.order_id} (Total: ₹{order.total_price})",
+                event_type="order_created"
+            )
+    except InsufficientStock as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # The order is committed; call Razorpay without holding any database lock
+    payment_link = run_payment_link_job(job.job_id, timeout=settings.PAYMENT_LINK_REQUEST_TIMEOUT)
+    return order_placed_response(order, payment_link)
+
+
+def order_placed_response(order, payment_link):
+    """
+    201 with the payment link, or 202 when Razorpay did not answer in time and
+    process_payment_link_jobs will attach the link to the order later.
+    """
+    if payment_link is None:
+        return Response({
+            "order_id": order.order_id,
+            "total_price": order.total_price,
+            "payment_link_id": None,
+            "payment_link": None,
+            "message": "Order placed. The payment link is being created; fetch the order to get it."
+        }, status=status.HTTP_202_ACCEPTED)
+
+    return Response({
+        "order_id": order.order_id,
+        "total_price": order.total_price,
+        "payment_link_id": payment_link["id"],
+        "payment_link": payment_link["short_url"]
+    }, status=status.HTTP_201_CREATED)
+
+
+PAYMENT_STATUS_MAX_WAIT = 30  # Seconds a long-poll or SSE connection may stay open
+
+
+async def payment_status(request, order_id):
+    """
+    Wait for an order's payment state without tying up a sync worker.
+
+    - default: answer immediately with the current status
+    - ?wait=<seconds>: long-poll until the status leaves Pending (max 30s)
+    - ?stream=sse: Server-Sent Events, one event per status change
+
+    Only reads the database; Razorpay is polled by poll_payment_status and the
+    webhooks. Waiting needs the ASGI server (see gunicorn.conf.py): under WSGI
+    every waiting request would hold a sync worker, so there ?wait answers
+    immediately and ?stream=sse is refused.
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "Invalid request method"}, status=405)
+
+    try:
+        auth = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({"error": str(e.detail)}, status=401)
+    if not auth:
+        return JsonResponse({"error": "Authentication credentials were not provided."}, status=401)
+    user = auth[0]
+
+    orders = Order.objects.filter(order_id=order_id)
+    if user.role not in [UserRole.ADMIN, UserRole.STAFF]:
+        orders = orders.filter(user_id=user.user_id)
+
+    async def current_state():
+        return await orders.values("order_id", "status", "razorpay_payment_id", "updated_at").afirst()
+
+    state = await current_state()
+    if not state:
+        return JsonResponse({"error": "Order not found"}, status=404)
+
+    try:
+        wait = min(float(request.GET.get("wait", 0)), PAYMENT_STATUS_MAX_WAIT)
+    except ValueError:
+        return JsonResponse({"error": "wait must be a number of seconds"}, status=400)
+    under_asgi = isinstance(request, ASGIRequest)
+    if not under_asgi:
+        wait = 0
+
+    if request.GET.get("stream") == "sse":
+        if not under_asgi:
+            return JsonResponse({"error": "stream=sse is only available on the ASGI server; poll instead"}, status=400)
+
+        async def events():
+            last_status = None
+            deadline = time.monotonic() + PAYMENT_STATUS_MAX_WAIT
+            while time.monotonic() < deadline:
+                current = await current_state()
+                if current is None:  # Archived or deleted since the stream opened
+                    yield f"event: error\ndata: {json.dumps({'error': 'Order not found'})}\n\n"
+                    return
+                if current["status"] != last_status:
+                    last_status = current["status"]
+                    yield f"data: {json.dumps(current, cls=DjangoJSONEncoder)}\n\n"
+                    if last_status != "Pending":
+                        return
+                await asyncio.sleep(1)
+
+        response = StreamingHttpResponse(events(), content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        return response
+
+    deadline = time.monotonic() + wait
+    while state["status"] == "Pending" and time.monotonic() < deadline:
+        await asyncio.sleep(1)
+        state = await current_state()
+        if not state:
+            return JsonResponse({"error": "Order not found"}, status=404)
+
+    return JsonResponse(state)
+
+
 @api_view(["GET"])
 @permission_classes([AllowAny])
 def payment_webhook(request):
@@ -395,9 +668,7 @@ def payment_webhook(request):
     if not (razorpay_payment_id and razorpay_payment_link_id and razorpay_payment_link_status and razorpay_signature):
         return JsonResponse({"error": "Missing required parameters"}, status=400)
 
-    client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-
-    client.utility.verify_payment_link_signature({
+    gateway.get_client().utility.verify_payment_link_signature({
         "payment_link_id": razorpay_payment_link_id,
         "payment_link_reference_id": razorpay_payment_link_reference_id,
         "payment_link_status": razorpay_payment_link_status,
@@ -405,23 +676,19 @@ def payment_webhook(request):
         "razorpay_signature": razorpay_signature
     })
 
-    order = Order.objects.filter(razorpay_payment_link_id=razorpay_payment_link_id, is_active=True).first()
+    order = Order.objects.filter(razorpay_payment_link_id=razorpay_payment_link_id).first()
     if not order:
         return JsonResponse({"error": "Order not found or inactive"}, status=400)
 
     if razorpay_payment_link_status == "paid":
-        order.status = "Processing"
-        order.razorpay_payment_id = razorpay_payment_id
-        order.save()
-
-        # Soft delete CartItems after successful payment
-        CartItem.objects.filter(cart__user=order.user, is_active=True).update(is_active=False)
+        # Processing + soft delete the purchased CartItems; a cancelled order's payment is flagged for refund
+        if not mark_paid(order, razorpay_payment_id) and not order.is_active:
+            return JsonResponse({"error": "Order not found or inactive"}, status=400)
 
         return JsonResponse({"message": "Payment verified, order is now Processing, cart items deactivated"}, status=200)
 
     elif razorpay_payment_link_status == "failed":
-        order.status = "Failed"
-        order.save()
+        mark_failed(order)
 
     return JsonResponse({"error": "Unknown status received"}, status=400)
 
@@ -430,7 +697,11 @@ def payment_webhook(request):
 @api_view(["POST"])
 @permission_classes([AllowAny])
 def razorpay_webhook(request):
-    """Handle Razorpay POST webhook events (payment.captured, payment.failed, etc.)"""
+    """
+    Receive Razorpay POST webhook events (payment.captured, payment.failed, etc.).
+    Verified events go to the webhook inbox and are acknowledged immediately;
+    redeliveries of an event already stored are dropped.
+    """
     try:
         # Get webhook signature and body
         webhook_signature = request.headers.get('X-Razorpay-Signature')
@@ -448,75 +719,14 @@ def razorpay_webhook(request):
             hashlib.sha256
         ).hexdigest()
         
-        if webhook_signature != expected_signature:
+        if not hmac.compare_digest(webhook_signature, expected_signature):
             logger.warning("Razorpay webhook: Invalid signature")
             return JsonResponse({'error': 'Invalid signature'}, status=400)
         
-        # Parse webhook payload
+        # Store the event and acknowledge right away; process_webhook_events applies it
         payload = json.loads(webhook_body)
-        event = payload.get('event')
-        logger.info(f"Razorpay webhook received: {event}")
-        
-        if event == 'payment.captured':
-            # Payment successful
-            payment_entity = payload.get('payload', {}).get('payment', {}).get('entity', {})
-            payment_id = payment_entity.get('id')
-            order_id = payment_entity.get('notes', {}).get('order_id')  # If you pass order_id in notes
-            amount = payment_entity.get('amount', 0) / 100  # Convert from paise to rupees
-            
-            logger.info(f"Payment captured: {payment_id}, Amount: {amount}")
-            
-            # Try to find order by payment_id or use order_id from notes
-            order = None
-            if payment_id:
-                order = Order.objects.filter(razorpay_payment_id=payment_id, is_active=True).first()
-            
-            if order:
-                order.status = "Processing"
-                order.save()
-                logger.info(f"Order {order.order_id} updated to Processing")
-                
-                # Notify admin
-                create_admin_notification(
-                    title="payment_captured",
-                    user=order.user,
-                    message=f"Payment captured for Order #{order.order_id} (₹{amount})",
-                    event_type="payment_success"
-                )
-            else:
-                logger.warning(f"Order not found for payment_id: {payment_id}")
-        
-        elif event == 'payment.failed':
-            # Payment failed
-            payment_entity = payload.get('payload', {}).get('payment', {}).get('entity', {})
-            payment_id = payment_entity.get('id')
-            error_reason = payment_entity.get('error_reason')
-            error_description = payment_entity.get('error_description')
-            
-            logger.warning(f"Payment failed: {payment_id}, Reason: {error_reason}")
-            
-            # Try to find order
-            order = Order.objects.filter(razorpay_payment_id=payment_id, is_active=True).first()
-            if order:
-                order.status = "Failed"
-                order.save()
-                logger.info(f"Order {order.order_id} marked as Failed")
-                
-                # Notify admin
-                create_admin_notification(
-                    title="payment_failed",
-                    user=order.user,
-                    message=f"Payment failed for Order #{order.order_id}: {error_description}",
-                    event_type="payment_failed"
-                )
-        
-        elif event == 'order.paid':
-            # Order paid event (alternative to payment.captured)
-            order_entity = payload.get('payload', {}).get('order', {}).get('entity', {})
-            order_id = order_entity.get('id')
-            amount_paid = order_entity.get('amount_paid', 0) / 100
-            
-            logger.info(f"Order paid: {order_id}, Amount: {amount_paid}")
+        logger.info(f"Razorpay webhook received: {payload.get('event')}")
+        store_event(payload, request.headers.get('X-Razorpay-Event-Id'))
         
         return JsonResponse({'status': 'ok'})
         
@@ -527,16 +737,136 @@ def razorpay_webhook(request):
         logger.error(f"Razorpay webhook error: {str(e)}")
         return JsonResponse({'error': str(e)}, status=500)
 
+# Columns of the CSV / NDJSON export; the same as OrderListSerializer's
+ORDER_EXPORT_FIELDS = OrderListSerializer.Meta.fields
+
+
 @api_view(["GET"])
 @permission_classes([IsAuthenticated, IsAdminOrStaff])
 def all_orders(request):
-    """ 
-    Admin/Staff can view all orders 
     """
-    orders = Order.objects.filter(is_active=True).order_by("-created_at")
-    serializer = OrderSerializer(orders, many=True, context={"request": request})
-    return Response(serializer.data)
-    
+    Admin/Staff can view all orders.
+
+    Keyset-paginated (newest first) and filterable by status, user,
+    created_after and created_before. Rows are flat by default; pass
+    ?detail=full for the nested order details, ?detail=lines for the line
+    snapshots without the catalog, or ?export=csv|ndjson to stream every
+    matching order instead of a page.
+    """
+    orders = filter_orders(Order.objects.filter(is_active=True), request.query_params)
+
+    export_format = request.query_params.get("export")
+    if export_format:
+        rows = (
+            orders.order_by("-created_at", "-order_id")
+            .annotate(username=F("user__username"))
+            .values(*ORDER_EXPORT_FIELDS)
+            .iterator(chunk_size=CHUNK_SIZE)
+        )
+        return export_response(rows, ORDER_EXPORT_FIELDS, export_format, "orders")
+
+    if request.query_params.get("detail") == "full":
+        orders = with_order_details(orders)
+        serializer_class = OrderSerializer
+    elif request.query_params.get("detail") == "lines":
+        orders = with_order_lines(orders)
+        serializer_class = OrderHistorySerializer
+    else:
+        orders = orders.select_related("user").only(
+            "order_id", "user__username", "total_price", "status", "tracking_id", "created_at", "updated_at"
+        )
+        serializer_class = OrderListSerializer
+
+    paginator = OrderCursorPagination()
+    page = paginator.paginate_queryset(orders, request)
+    serializer = serializer_class(page, many=True, context={"request": request})
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated, IsAdminOrStaff])
+def export_order_lines(request):
+    """
+    Accounting export: one flat row per order line with its order and buyer,
+    streamed as ?export=csv (default) or ndjson so memory stays flat however
+    many rows match. Takes the all/ filters (status, user, created_after,
+    created_before) plus month=YYYY-MM, and covers archived orders too:
+    those come first, then the live ones, each oldest first.
+    """
+    export_format = request.query_params.get("export", "csv")
+    live = filter_orders(Order.objects.all(), request.query_params)
+    archived = filter_orders(ArchivedOrder.objects.all(), request.query_params)
+    rows = itertools.chain(order_line_rows(archived, ArchivedOrderDetail), order_line_rows(live, OrderDetail))
+    return export_response(rows, ORDER_LINE_EXPORT_FIELDS, export_format, "order-lines")
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated, IsAdminOrStaff])
+def sales_report(request):
+    """
+    Sales between ?start= and ?end= (order dates, inclusive; default the last
+    30 days) read from the rollup tables: one row per day, the totals, and
+    the top ?products= (default 10) products by revenue.
+    """
+    try:
+        end = parse_date(request.query_params.get("end", "")) or timezone.localdate()
+        start = parse_date(request.query_params.get("start", "")) or end - timedelta(days=29)
+    except ValueError:
+        return Response({"error": "Dates must be valid YYYY-MM-DD dates"}, status=status.HTTP_400_BAD_REQUEST)
+    if start > end:
+        return Response({"error": "start must not be after end"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        top = min(int(request.query_params.get("products", 10)), 100)
+    except ValueError:
+        return Response({"error": "products must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+
+    totals = {field: Sum(field) for field in ROLLUP_FIELDS}
+    days = DailySalesRollup.objects.filter(date__range=(start, end))
+    top_products = (
+        ProductSalesRollup.objects.filter(date__range=(start, end))
+        .values("product_id", "product__name")
+        .annotate(**totals)
+        .order_by("-revenue")[:top]
+    )
+
+    return Response({
+        "start": start,
+        "end": end,
+        "totals": {field: value or 0 for field, value in days.aggregate(**totals).items()},
+        "days": list(days.order_by("date").values("date", *ROLLUP_FIELDS)),
+        "top_products": list(top_products),
+    })
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated, IsAdminOrStaff])
+def gateway_metrics(request):
+    """
+    Latency and error counts per Razorpay operation for this process,
+    plus the circuit breaker state.
+    """
+    return Response({
+        "circuit_breaker": gateway.breaker.state,
+        "operations": gateway.metrics.snapshot(),
+    })
+
+
+@api_view(["GET"])
+@authentication_classes([])
+@permission_classes([AllowAny])
+@throttle_classes([TrackingRateThrottle])
+def track_order(request, tracking_id):
+    """
+    Public order tracking: status and timestamps only, for the tracking page.
+    Served from the tracking cache, which every status change writes through.
+    """
+    data = get_tracking(tracking_id)
+    if data is None:
+        return Response({"error": "Tracking ID not found"}, status=status.HTTP_404_NOT_FOUND)
+    response = Response(data)
+    patch_cache_control(response, public=True, max_age=settings.TRACKING_MAX_AGE)
+    return response
+
 class UserOrdersViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = CustomUser.objects.all()
     serializer_class = UserSerializer
@@ -549,7 +879,7 @@ class UserOrdersViewSet(viewsets.ReadOnlyModelViewSet):
         Fetch all orders for a specific user.
         """
         user = get_object_or_404(CustomUser, pk=pk)
-        orders = Order.objects.filter(user=user).order_by('-created_at')
+        orders = with_order_details(Order.objects.filter(user=user).order_by('-created_at'))
 
         page = self.paginate_queryset(orders)
         if page is not None:
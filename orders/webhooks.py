@@ -0,0 +1,127 @@
+# orders/webhooks.py
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from ecommerce.logger import logger
+from users.utils import create_admin_notification
+from .models import Order, WebhookEvent
+from .payments import mark_paid, mark_failed
+
+MAX_ATTEMPTS = 5  # After this many errors an event stays Failed until replay_webhook_events re-drives it
+RETRY_DELAY = timedelta(minutes=1)  # Doubled after each failed attempt, so MAX_ATTEMPTS spans about 15 minutes
+
+
+def event_key(payload, event_id=None):
+    """
+    The inbox key for an event: Razorpay's event ID when the header was sent,
+    otherwise the event name plus the payment (or order) it is about, which
+    is stable across Razorpay's retries of the same delivery.
+    """
+    if event_id:
+        return event_id
+    entities = payload.get("payload", {})
+    entity = (entities.get("payment") or entities.get("order") or {}).get("entity", {})
+    return f"{payload.get('event')}:{entity.get('id')}"
+
+
+def store_event(payload, event_id=None):
+    """Persist a verified webhook in a single INSERT; a redelivered event is silently dropped."""
+    WebhookEvent.objects.bulk_create(
+        [WebhookEvent(event_key=event_key(payload, event_id), event=payload.get("event") or "", payload=payload)],
+        ignore_conflicts=True,
+    )
+
+
+def _find_order(payment_entity):
+    # Inactive (cancelled) orders too: mark_paid refuses them and flags the payment for a refund
+    payment_id = payment_entity.get("id")
+    order = Order.objects.filter(razorpay_payment_id=payment_id).select_related("user").first() if payment_id else None
+    order_id = (payment_entity.get("notes") or {}).get("order_id")  # If you pass order_id in notes
+    if not order and order_id:
+        order = Order.objects.filter(order_id=order_id).select_related("user").first()
+    return order
+
+
+def apply_event(webhook_event):
+    """
+    Apply one stored event to its order. Safe to run more than once: an order
+    that has already moved on (see orders.status.TRANSITIONS) is left alone
+    and no second notification is sent.
+    """
+    payload = webhook_event.payload
+    event = webhook_event.event
+
+    if event == 'payment.captured':
+        payment_entity = payload.get('payload', {}).get('payment', {}).get('entity', {})
+        payment_id = payment_entity.get('id')
+        amount = payment_entity.get('amount', 0) / 100  # Convert from paise to rupees
+
+        order = _find_order(payment_entity)
+        if not order:
+            logger.warning(f"Order not found for payment_id: {payment_id}")
+            return
+        if not mark_paid(order, payment_id):
+            return  # Already paid, or moved on since (mark_paid flags a capture that needs refunding)
+        logger.info(f"Order {order.order_id} updated to Processing")
+        create_admin_notification(
+            title="payment_captured",
+            user=order.user,
+            message=f"Payment captured for Order #{order.order_id} (₹{amount})",
+            event_type="payment_success"
+        )
+
+    elif event == 'payment.failed':
+        payment_entity = payload.get('payload', {}).get('payment', {}).get('entity', {})
+        payment_id = payment_entity.get('id')
+        error_description = payment_entity.get('error_description')
+
+        order = _find_order(payment_entity)
+        if not order or not mark_failed(order, payment_id):
+            return  # A late failure never overrides a payment or a later status
+        logger.info(f"Order {order.order_id} marked as Failed")
+        create_admin_notification(
+            title="payment_failed",
+            user=order.user,
+            message=f"Payment failed for Order #{order.order_id}: {error_description}",
+            event_type="payment_failed"
+        )
+
+    elif event == 'order.paid':
+        order_entity = payload.get('payload', {}).get('order', {}).get('entity', {})
+        logger.info(f"Order paid: {order_entity.get('id')}, Amount: {order_entity.get('amount_paid', 0) / 100}")
+
+
+def process_pending_events(batch_size=100):
+    """
+    Apply one batch of due stored events in arrival order. Each event is
+    applied in its own savepoint, so a bad event is retried later with
+    exponential backoff (and marked Failed after MAX_ATTEMPTS) without
+    undoing the rest of the batch. Returns (processed, failed).
+    """
+    processed = failed = 0
+    with transaction.atomic():
+        events = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(status="Pending", next_attempt_at__lte=timezone.now())
+            .order_by("received_at", "webhook_event_id")[:batch_size]
+        )
+        for webhook_event in events:
+            webhook_event.attempts += 1
+            try:
+                with transaction.atomic():
+                    apply_event(webhook_event)
+            except Exception as e:
+                logger.error(f"Webhook event {webhook_event.event_key} failed: {e}")
+                webhook_event.last_error = str(e)
+                webhook_event.status = "Failed" if webhook_event.attempts >= MAX_ATTEMPTS else "Pending"
+                webhook_event.next_attempt_at = timezone.now() + RETRY_DELAY * 2 ** (webhook_event.attempts - 1)
+                failed += 1
+            else:
+                webhook_event.status = "Processed"
+                webhook_event.last_error = None
+                webhook_event.processed_at = timezone.now()
+                processed += 1
+        WebhookEvent.objects.bulk_update(events, ["status", "attempts", "next_attempt_at", "last_error", "processed_at"])
+    return processed, failed
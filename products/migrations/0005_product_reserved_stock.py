@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_uploadedimage_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reserved_stock',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
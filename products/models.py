@@ -1,6 +1,7 @@
 from django.db import models
 from django.db.models import Q, UniqueConstraint
 from users.models import CustomUser
+from decimal import Decimal, ROUND_HALF_UP
 import os
 import uuid
 
@@ -46,6 +47,7 @@ class Product(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     discount_percentage = models.DecimalField(max_digits=5, decimal_places=2, default=0.0)
     stock = models.PositiveIntegerField()
+    reserved_stock = models.PositiveIntegerField(default=0)  # Units held by unpaid orders (see orders.reservations)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='products')
     product_code = models.CharField(max_length=100, default=None, blank=True, null=True)  # No unique=True here
     created_at = models.DateTimeField(auto_now_add=True)
@@ -59,10 +61,29 @@ class Product(models.Model):
             return float(self.price)
         return float(self.price - (self.price * self.discount_percentage / 100))
 
+    @property
+    def offer_price_decimal(self):
+        """Offer price as a Decimal rounded to paise, for order totals and price_at_purchase."""
+        price = Decimal(str(self.price))
+        discount = Decimal(str(self.discount_percentage or 0))
+        return (price - price * discount / 100).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+
+    @property
+    def available_stock(self):
+        """Stock that is not already reserved by pending orders."""
+        return self.stock - self.reserved_stock
+
     def save(self, *args, **kwargs):
         if not self.product_code:
             self.product_code = f"PROD-{uuid.uuid4().hex[:8]}"  # Generate default product_code
-    
+
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            # reserved_stock only moves through conditional UPDATEs (orders.reservations);
+            # a full-row save would write back whatever stale value this instance was read with
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "reserved_stock"
+            ]
         super().save(*args, **kwargs)
 
     def __str__(self):
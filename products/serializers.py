@@ -1,6 +1,18 @@
 from rest_framework import serializers
+from django.db import transaction
+from django.db.models import Count, Q
 from .models import Product, Category, Favorite, UploadedImage
 
+
+def product_details_queryset():
+    """
+    Products with everything ProductSerializer reads loaded up front:
+    the category, the images of both, and the active favorite count.
+    """
+    return Product.objects.select_related("category").prefetch_related(
+        "uploadedimage_set", "category__uploadedimage_set"
+    ).annotate(active_favorite_count=Count("favorites", filter=Q(favorites__is_active=True)))
+
 class CategorySerializer(serializers.ModelSerializer):
     images = serializers.SerializerMethodField()  # New field to include image URLs
 
@@ -11,7 +23,7 @@ class CategorySerializer(serializers.ModelSerializer):
     def get_images(self, obj):
         """Fetch all image URLs related to this category or product, including their type."""
         request = self.context.get("request")
-        images = UploadedImage.objects.filter(category=obj) if isinstance(obj, Category) else UploadedImage.objects.filter(product=obj)
+        images = obj.uploadedimage_set.all()  # Uses prefetched images when available
 
         result = []
         for img in images:
@@ -26,6 +38,17 @@ class CategorySerializer(serializers.ModelSerializer):
         return result
 
 
+def check_stock_covers_reservations(product):
+    """
+    Refuse a stock below what pending orders have reserved. Reads reserved_stock
+    under the row lock, so call it inside the transaction that saves `product`.
+    """
+    reserved = Product.objects.select_for_update().values_list("reserved_stock", flat=True).get(pk=product.pk)
+    if product.stock < reserved:
+        raise serializers.ValidationError({"stock": f"Stock cannot be below the {reserved} units reserved by pending orders."})
+    product.reserved_stock = reserved
+
+
 class ProductSerializer(serializers.ModelSerializer):
     category = serializers.SerializerMethodField()  # Use SerializerMethodField for filtering
     favorite_count = serializers.SerializerMethodField()
@@ -64,11 +87,13 @@ class ProductSerializer(serializers.ModelSerializer):
         return None  # Return None if category is inactive
 
     def get_favorite_count(self, obj):
+        if hasattr(obj, "active_favorite_count"):  # Annotated by product_details_queryset
+            return obj.active_favorite_count
         return obj.favorite_count()
 
     def get_images(self, obj):
         request = self.context.get("request")
-        images = UploadedImage.objects.filter(product=obj)
+        images = obj.uploadedimage_set.all()  # Uses prefetched images when available
 
         result = []
         for img in images:
@@ -138,7 +163,9 @@ class ProductSerializer(serializers.ModelSerializer):
                 existing_product.price = validated_data.get("price", existing_product.price)
                 existing_product.stock = validated_data.get("stock", existing_product.stock)
                 existing_product.category = category or existing_product.category  # Update category if provided
-                existing_product.save()
+                with transaction.atomic():
+                    check_stock_covers_reservations(existing_product)
+                    existing_product.save()
                 return existing_product  # Return the reactivated product
 
         # 🔹 If no existing product, create a new one
@@ -155,7 +182,10 @@ class ProductSerializer(serializers.ModelSerializer):
 
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
-        instance.save()
+        with transaction.atomic():
+            check_stock_covers_reservations(instance)
+            # Only what the request changed: a stale stock or reserved_stock must not overwrite concurrent checkouts
+            instance.save(update_fields=[*validated_data, "category", "product_code", "updated_at"])
         return instance
 
 
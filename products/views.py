@@ -66,7 +66,7 @@ class ProductViewSet(viewsets.ModelViewSet):
         if product:
             # Mark product as inactive
             product.is_active = False
-            product.save()
+            product.save(update_fields=["is_active", "updated_at"])
 
             # Mark all related favorites as inactive
             Favorite.objects.filter(product=product, is_active=True).update(is_active=False)
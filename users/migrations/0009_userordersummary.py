@@ -0,0 +1,30 @@
+# Generated by Django 5.1.4 on 2026-10-19 02:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_deleteaccountotp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserOrderSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='order_summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('order_count', models.IntegerField(default=0)),
+                ('lifetime_value', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('last_order_at', models.DateTimeField(blank=True, null=True)),
+                ('open_orders', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'user_order_summaries',
+                'indexes': [models.Index(fields=['order_count'], name='user_summary_count_idx'), models.Index(fields=['lifetime_value'], name='user_summary_value_idx'), models.Index(fields=['last_order_at'], name='user_summary_last_order_idx'), models.Index(fields=['open_orders'], name='user_summary_open_idx')],
+            },
+        ),
+    ]
@@ -120,3 +120,28 @@ class AdminNotification(models.Model):
         return f"{self.title} - {self.created_at}"
 
 
+
+
+class UserOrderSummary(models.Model):
+    """
+    Per-user order totals, kept up to date by orders.status.record_status_changes
+    so admin user lists can sort and filter on them without scanning orders.
+    """
+    class Meta:
+        db_table = 'user_order_summaries'
+        indexes = [
+            models.Index(fields=["order_count"], name="user_summary_count_idx"),
+            models.Index(fields=["lifetime_value"], name="user_summary_value_idx"),
+            models.Index(fields=["last_order_at"], name="user_summary_last_order_idx"),
+            models.Index(fields=["open_orders"], name="user_summary_open_idx"),
+        ]
+
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True, related_name="order_summary")
+    order_count = models.IntegerField(default=0)  # Every order placed, whatever became of it
+    lifetime_value = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # Total of paid, not cancelled orders
+    last_order_at = models.DateTimeField(blank=True, null=True)
+    open_orders = models.IntegerField(default=0)  # Pending, Processing or Shipped
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.order_count} orders by user {self.user_id}"
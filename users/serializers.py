@@ -6,13 +6,29 @@ from rest_framework import serializers
 from .models import CustomUser,UserRole
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.contrib.auth import authenticate
-from .models import AdminNotification
+from .models import AdminNotification, UserOrderSummary
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = CustomUser
         fields = ['user_id', 'username', 'email', 'phone_number','default_shipping_address', 'role']
 
+class AdminUserSerializer(UserSerializer):
+    """UserSerializer plus the user's maintained order summary (zeros if they never ordered)."""
+    order_count = serializers.IntegerField(source='order_summary.order_count', read_only=True)
+    lifetime_value = serializers.DecimalField(source='order_summary.lifetime_value', max_digits=14, decimal_places=2, read_only=True)
+    last_order_at = serializers.DateTimeField(source='order_summary.last_order_at', read_only=True)
+    open_orders = serializers.IntegerField(source='order_summary.open_orders', read_only=True)
+
+    class Meta(UserSerializer.Meta):
+        fields = UserSerializer.Meta.fields + ['order_count', 'lifetime_value', 'last_order_at', 'open_orders']
+
+    def to_representation(self, instance):
+        # Users who never ordered have no summary row; render an empty one (DRF would give nulls)
+        if not hasattr(instance, 'order_summary'):
+            instance.order_summary = UserOrderSummary(user=instance)
+        return super().to_representation(instance)
+
 # **Login Serializer**
 class LoginSerializer(serializers.Serializer):
     email = serializers.CharField()
@@ -67,4 +67,9 @@ def create_admin_notification(user,title, message, event_type=None):
         user=user,
         message=message,
         event_type=event_type
-    )  
\ No newline at end of file
+    )  
+
+
+def create_admin_notifications(notifications):
+    """Insert many notifications with one query; each item holds create_admin_notification's fields."""
+    AdminNotification.objects.bulk_create([AdminNotification(**notification) for notification in notifications])
@@ -22,7 +22,10 @@ from users.models import OTP, DeleteAccountOTP
 from django.utils import timezone 
 from .utils import create_admin_notification
 from .models import AdminNotification
-from .serializers import AdminNotificationSerializer
+from .serializers import AdminNotificationSerializer, AdminUserSerializer
+from django.db.models import F
+from django.utils.dateparse import parse_date
+from decimal import Decimal, InvalidOperation
 
 class CustomRefreshToken(RefreshToken):
     @classmethod
@@ -376,14 +379,55 @@ class AdminUserListView(APIView):
     permission_classes = [IsAuthenticated, IsAdminOrStaff]  # Ensure only admins/staff can access
     pagination_class = UserPagination
 
+    # ?ordering= values and the summary columns they sort on
+    ORDERINGS = {
+        "username": "username",
+        "order_count": "order_summary__order_count",
+        "lifetime_value": "order_summary__lifetime_value",
+        "last_order_at": "order_summary__last_order_at",
+        "open_orders": "order_summary__open_orders",
+    }
+
     def get(self, request):
         """
-        List all users.
+        List all users with their order summary.
+        Sort with ?ordering=<field> or -<field> (username, order_count, lifetime_value,
+        last_order_at, open_orders) and filter with ?min_orders=, ?min_lifetime_value=,
+        ?has_open_orders=true, ?last_order_after= and ?last_order_before= (ISO dates).
         """
-        users = CustomUser.objects.all().order_by("username")
+        params = request.query_params
+        users = CustomUser.objects.select_related("order_summary")
+
+        try:
+            if params.get("min_orders"):
+                users = users.filter(order_summary__order_count__gte=int(params["min_orders"]))
+            if params.get("min_lifetime_value"):
+                users = users.filter(order_summary__lifetime_value__gte=Decimal(params["min_lifetime_value"]))
+        except (ValueError, InvalidOperation):
+            return Response({"error": "min_orders and min_lifetime_value must be numbers"}, status=status.HTTP_400_BAD_REQUEST)
+        if params.get("has_open_orders") == "true":
+            users = users.filter(order_summary__open_orders__gt=0)
+        for param, lookup in [("last_order_after", "gte"), ("last_order_before", "lte")]:
+            if params.get(param):
+                try:
+                    day = parse_date(params[param])
+                except ValueError:  # Well formed but impossible, e.g. 2024-02-30
+                    day = None
+                if day is None:
+                    return Response({"error": f"{param} must be a YYYY-MM-DD date"}, status=status.HTTP_400_BAD_REQUEST)
+                users = users.filter(**{f"order_summary__last_order_at__date__{lookup}": day})
+
+        ordering = params.get("ordering", "username")
+        field = self.ORDERINGS.get(ordering.lstrip("-"))
+        if field is None:
+            return Response({"error": f"ordering must be one of: {', '.join(self.ORDERINGS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        # Users who never ordered have no summary row; keep them last either way
+        sort = F(field).desc(nulls_last=True) if ordering.startswith("-") else F(field).asc(nulls_last=True)
+        users = users.order_by(sort, "user_id")
+
         paginator = UserPagination()
         paginated_users = paginator.paginate_queryset(users, request)
-        serializer = UserSerializer(paginated_users, many=True)
+        serializer = AdminUserSerializer(paginated_users, many=True)
 
         return paginator.get_paginated_response(serializer.data)
 